@@ -3,6 +3,14 @@ from django.contrib import admin
 # Register your models here.
 from django.contrib import admin
 
-from .models import IDs
+from .models import IDs, Job
 
-admin.site.register(IDs)
\ No newline at end of file
+admin.site.register(IDs)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'owner', 'pipeline', 'state', 'submitted_at', 'ended_at', 'exit_code', 'node')
+    list_filter = ('state', 'priority', 'node')
+    search_fields = ('owner', 'pipeline', 'fingerprint', 'batch_id')
+    ordering = ('-submitted_at', '-id')
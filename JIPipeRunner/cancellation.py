@@ -0,0 +1,148 @@
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import Optional
+
+from django.conf import settings
+
+from JIPipeRunner.redis_client import get_redis
+
+# Seconds a cancelled JIPipe process group gets to exit after SIGTERM before it is killed with SIGKILL
+CANCEL_GRACE_SECONDS = getattr(settings, 'JIPIPE_CANCEL_GRACE_SECONDS', 10)
+
+# Seconds between two checks of the cancel flag of a running job
+CANCEL_POLL_SECONDS = getattr(settings, 'JIPIPE_CANCEL_POLL_SECONDS', 0.5)
+
+# Time (in seconds) to keep the cancel flag of a job
+CANCEL_TTL = 24 * 60 * 60
+
+# Intialize the logger
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a task when its job was cancelled, to skip the remaining steps.
+    """
+
+
+def cancel_key(job_uuid: str) -> str:
+    return f'jipipe_cancel_{job_uuid}'
+
+
+def cancel_requested_at(job_uuid: str) -> Optional[float]:
+    """
+    Get the time a job was asked to cancel (UNIX timestamp), or None if it was not.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    """
+    requested_at = get_redis().get(cancel_key(job_uuid))
+    return float(requested_at) if requested_at is not None else None
+
+
+def terminate_process_group(process: subprocess.Popen, grace_seconds: float = CANCEL_GRACE_SECONDS) -> bool:
+    """
+    Send SIGTERM to the process group of a process (started with os.setsid),
+    wait up to grace_seconds for it to exit, then send SIGKILL to the group.
+    Returns True if SIGKILL was needed.
+
+    param process: Leader of the process group (e.g. xvfb-run running ImageJ)
+    param grace_seconds: Seconds to wait for a clean exit after SIGTERM
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=grace_seconds)
+        return False
+    except ProcessLookupError:
+        return False
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+    return True
+
+
+class CancelWatcher:
+    """
+    Watches the cancel flag of a running job in a background thread. Once
+    the job is cancelled, the attached JIPipe process group is terminated
+    (see terminate_process_group), so the task returns from waiting on the
+    process and runs its regular cleanup. A process attached after the
+    cancel request is terminated right away.
+    """
+
+    def __init__(self, job_uuid: str):
+        """
+        param job_uuid: Unique identifier for the JIPipe job
+        """
+        self.job_uuid = job_uuid
+        self.requested_at: Optional[float] = None
+        self.forced = False
+        self.process: Optional[subprocess.Popen] = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._watch, name='jipipe-cancel-watcher', daemon=True)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.requested_at is not None
+
+    def start(self) -> 'CancelWatcher':
+        """
+        Start watching the cancel flag.
+        """
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop watching the cancel flag.
+        """
+        self.stop_event.set()
+
+    def attach(self, process: subprocess.Popen) -> None:
+        """
+        Terminate this process group once the job is cancelled.
+
+        param process: Leader of the process group running the job
+        """
+        with self.lock:
+            self.process = process
+            if not self.cancelled:
+                return
+        self._terminate(process)
+
+    def raise_if_cancelled(self) -> None:
+        """
+        Raise JobCancelled if the job was cancelled.
+        """
+        if self.cancelled:
+            raise JobCancelled(self.job_uuid)
+
+    def _watch(self) -> None:
+        while not self.stop_event.wait(CANCEL_POLL_SECONDS):
+            try:
+                requested_at = cancel_requested_at(self.job_uuid)
+            except Exception:
+                logger.exception('Failed to check the cancel flag of JIPipe job %s', self.job_uuid)
+                continue
+            if requested_at is None:
+                continue
+            with self.lock:
+                self.requested_at = requested_at
+                process = self.process
+            if process is not None:
+                self._terminate(process)
+            return
+
+    def _terminate(self, process: subprocess.Popen) -> None:
+        if process.poll() is not None:
+            return
+        self.forced = terminate_process_group(process)
+        logger.info('Terminated cancelled JIPipe job %s%s', self.job_uuid, ' with SIGKILL' if self.forced else '')
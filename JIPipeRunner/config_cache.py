@@ -0,0 +1,55 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class ByteLRUCache:
+    """
+    Thread-safe in-process LRU cache for byte strings with a total size budget.
+    Used to keep validated .jip project files in memory, keyed by their
+    content identity (file ID, size and hash), so unchanged pipelines are
+    neither downloaded from OMERO nor parsed again.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        """
+        Get the cached bytes for a key and mark them as recently used.
+        Returns None if the key is not cached.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: bytes) -> None:
+        """
+        Store the bytes for a key and evict the least recently used entries
+        until the cache fits its budget. Values larger than the whole budget
+        are not cached.
+        """
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self) -> None:
+        """
+        Remove all entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -0,0 +1,214 @@
+import contextlib
+import fcntl
+import logging
+import os
+import signal
+import subprocess
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+from django.conf import settings
+
+# Display handling: 'xvfb-run' starts an Xvfb per job, 'pool' leases a shared pre-started
+# display, 'auto' leases a display only if the project contains GUI nodes and runs headless otherwise
+DISPLAY_MODE = getattr(settings, 'JIPIPE_DISPLAY_MODE', 'xvfb-run')
+
+# Display numbers of the shared pool (:FIRST ... :FIRST+SIZE-1)
+DISPLAY_POOL_FIRST = getattr(settings, 'JIPIPE_DISPLAY_POOL_FIRST', 90)
+DISPLAY_POOL_SIZE = getattr(settings, 'JIPIPE_DISPLAY_POOL_SIZE', 8)
+
+# Directory holding the lock and PID files of the pooled displays
+DISPLAY_POOL_DIR = getattr(settings, 'JIPIPE_DISPLAY_POOL_DIR', '/tmp/jipipe_displays')
+
+# Screen configuration of the pooled Xvfb servers
+DISPLAY_SCREEN = getattr(settings, 'JIPIPE_DISPLAY_SCREEN', '1920x1080x24')
+
+# Seconds to wait for a free display or for a started Xvfb to accept connections
+DISPLAY_LEASE_TIMEOUT = getattr(settings, 'JIPIPE_DISPLAY_LEASE_TIMEOUT', 600)
+DISPLAY_START_TIMEOUT = 10
+
+# Substrings of node type IDs that need a display (all other nodes can run headless)
+GUI_NODE_PATTERNS = getattr(settings, 'JIPIPE_GUI_NODE_PATTERNS', ['ij1', 'imagej', 'macro', 'display', 'viewer'])
+
+# Intialize the logger
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class JobDisplay:
+    """
+    Describes how the ImageJ launcher of a job is wrapped for display access:
+    a command prefix (e.g. xvfb-run), extra launcher options (e.g. --headless)
+    and environment variables (e.g. DISPLAY of a leased display).
+    """
+    prefix: List[str] = field(default_factory=list)
+    options: List[str] = field(default_factory=list)
+    env: Dict[str, str] = field(default_factory=dict)
+
+
+def project_requires_gui(jipipe_project_config: dict) -> bool:
+    """
+    Check whether any node of a JIPipe project is likely to need a display.
+
+    param jipipe_project_config: JSON configuration of the JIPipe project
+    """
+    for node in jipipe_project_config.get('graph', {}).get('nodes', {}).values():
+        node_type = node.get('jipipe:node-info-id', '').lower()
+        if any(pattern in node_type for pattern in GUI_NODE_PATTERNS):
+            return True
+    return False
+
+
+@contextlib.contextmanager
+def display_for_job(jipipe_project_config: Optional[dict]) -> Iterator[JobDisplay]:
+    """
+    Provide the display configuration for running a JIPipe project according
+    to JIPIPE_DISPLAY_MODE. Pooled displays are leased for the duration of
+    the context and returned afterwards, while their Xvfb keeps running.
+
+    param jipipe_project_config: JSON configuration of the JIPipe project (None == the projects are
+                                 not known in advance, e.g. for a warm process, so a display is always provided)
+    """
+    if DISPLAY_MODE == 'xvfb-run':
+        yield JobDisplay(prefix=['xvfb-run', '-a'])
+    elif DISPLAY_MODE == 'auto' and jipipe_project_config is not None and not project_requires_gui(jipipe_project_config):
+        yield JobDisplay(options=['--headless'])
+    else:
+        with lease_display() as display_number:
+            yield JobDisplay(env={'DISPLAY': f':{display_number}'})
+
+
+@contextlib.contextmanager
+def lease_display() -> Iterator[int]:
+    """
+    Lease a display of the shared pool. Leases are exclusive file locks, so they
+    work across all Celery worker processes of a host and are released
+    automatically if a worker dies. Dead Xvfb servers are restarted on lease,
+    and displays whose Xvfb fails to start are skipped for the next one.
+    Yields the display number.
+    """
+    os.makedirs(DISPLAY_POOL_DIR, exist_ok=True)
+    deadline = time.monotonic() + DISPLAY_LEASE_TIMEOUT
+
+    while True:
+        # Try to lock any display of the pool
+        leased = False
+        for display_number in range(DISPLAY_POOL_FIRST, DISPLAY_POOL_FIRST + DISPLAY_POOL_SIZE):
+            lock_file = open(os.path.join(DISPLAY_POOL_DIR, f'display_{display_number}.lock'), 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                leased = True
+                continue
+
+            try:
+                _ensure_display_running(display_number)
+            except (OSError, RuntimeError):
+                logger.exception('Failed to start Xvfb on display :%s, trying the next display', display_number)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+                continue
+
+            try:
+                yield display_number
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+            return
+
+        # Give up if no display can be started, else wait for a leased one to be returned
+        if not leased:
+            raise RuntimeError('Failed to start Xvfb on any display of the JIPipe display pool')
+        if time.monotonic() > deadline:
+            raise TimeoutError('No virtual display available in the JIPipe display pool')
+        time.sleep(1)
+
+
+def start_display_pool() -> None:
+    """
+    Start the Xvfb servers of all displays of the shared pool that are not
+    running yet (if JIPIPE_DISPLAY_MODE uses the pool), so the first jobs
+    do not wait for a display to start. Displays leased by another worker
+    process are skipped, and displays that fail to start are logged and
+    started again on lease.
+    """
+    if DISPLAY_MODE not in ('pool', 'auto'):
+        return
+    os.makedirs(DISPLAY_POOL_DIR, exist_ok=True)
+    for display_number in range(DISPLAY_POOL_FIRST, DISPLAY_POOL_FIRST + DISPLAY_POOL_SIZE):
+        with open(os.path.join(DISPLAY_POOL_DIR, f'display_{display_number}.lock'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            try:
+                _ensure_display_running(display_number)
+            except (OSError, RuntimeError):
+                logger.exception('Failed to start Xvfb on display :%s', display_number)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _display_socket(display_number: int) -> str:
+    return f'/tmp/.X11-unix/X{display_number}'
+
+
+def _read_pid(pid_file: str):
+    try:
+        with open(pid_file) as pid_handle:
+            return int(pid_handle.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _is_display_server(pid, display_number: int) -> bool:
+    # Only trust the PID file if the process is still the Xvfb of this display (PIDs are reused, Linux only)
+    if pid is None:
+        return False
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as cmdline_file:
+            args = cmdline_file.read().decode('utf-8', 'replace').split('\0')
+    except OSError:
+        return False
+    return os.path.basename(args[0]) == 'Xvfb' and f':{display_number}' in args[1:]
+
+
+def _ensure_display_running(display_number: int) -> None:
+    """
+    Health check a pooled display and (re)start its Xvfb if it is not running.
+    Must be called while holding the lease of the display.
+    """
+    pid_file = os.path.join(DISPLAY_POOL_DIR, f'display_{display_number}.pid')
+    pid = _read_pid(pid_file)
+    server_running = _is_display_server(pid, display_number)
+    if server_running and os.path.exists(_display_socket(display_number)):
+        return
+
+    # Stop a hung server and remove stale X lock files left by a dead one. Raises PermissionError
+    # (the display is then skipped) if the server or its files belong to another user
+    if server_running:
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(pid, signal.SIGKILL)
+    for stale_file in (f'/tmp/.X{display_number}-lock', _display_socket(display_number)):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(stale_file)
+
+    # Start the Xvfb in its own session so it outlives the job and the worker process
+    process = subprocess.Popen(
+        ['Xvfb', f':{display_number}', '-screen', '0', DISPLAY_SCREEN, '-nolisten', 'tcp'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    with open(pid_file, 'w') as pid_handle:
+        pid_handle.write(str(process.pid))
+
+    # Wait until the server accepts connections
+    deadline = time.monotonic() + DISPLAY_START_TIMEOUT
+    while not os.path.exists(_display_socket(display_number)):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError(f'Failed to start Xvfb on display :{display_number}')
+        time.sleep(0.1)
@@ -0,0 +1,560 @@
+import json
+import logging
+import math
+import time
+from typing import Dict, List, Optional
+
+from celery import signature as task_signature
+from django.conf import settings
+
+from JIPipeRunner.cancellation import CANCEL_TTL, cancel_key
+from JIPipeRunner.nodes import alive_nodes, choose_node, forget_node, lost_nodes, node_queue
+from JIPipeRunner.redis_client import get_redis
+from JIPipeRunner.registry import finish_job, get_job, update_job
+from JIPipeRunner.scheduler import DEFAULT_JOB_MEMORY_GB, JOB_CPUS, RESERVATION_LEASE_SECONDS
+
+# Celery queue of each priority class, in the order the classes are served. Used while no worker node
+# serves the class, else jobs go to the queue of the class on the node they are routed to (see nodes.node_queue).
+# Workers must consume these queues (e.g. celery -A JIPipePlugin worker -Q jipipe_interactive,jipipe_batch,celery);
+# a worker consumes the node queues of the classes it consumes
+PRIORITY_QUEUES: Dict[str, str] = getattr(settings, 'JIPIPE_PRIORITY_QUEUES', {
+    'interactive': 'jipipe_interactive',
+    'batch': 'jipipe_batch',
+})
+
+# Largest JVM heap (in GB) of a job that may run in the interactive class, larger jobs always run as batch jobs
+INTERACTIVE_MAX_MEMORY_GB = getattr(settings, 'JIPIPE_INTERACTIVE_MAX_MEMORY_GB', DEFAULT_JOB_MEMORY_GB)
+
+# Number of jobs handed to Celery at the same time over all users (0 == unlimited).
+# Set it to about the number of worker slots, so the cluster stays full while the
+# order of the remaining jobs is still decided by the fair share
+MAX_DISPATCHED_JOBS = getattr(settings, 'JIPIPE_MAX_DISPATCHED_JOBS', 16)
+
+# Number of jobs of a user and of an OMERO group that may be dispatched at the same time (0 == unlimited)
+USER_MAX_JOBS = getattr(settings, 'JIPIPE_USER_MAX_JOBS', 4)
+GROUP_MAX_JOBS = getattr(settings, 'JIPIPE_GROUP_MAX_JOBS', 0)
+
+# Number of batch class jobs of a user that may be dispatched at the same time (0 == unlimited)
+BATCH_PARALLELISM = getattr(settings, 'JIPIPE_BATCH_PARALLELISM', 4)
+
+# Fair-share weight of each user (default 1), a user with weight 2 gets twice the slots of a user with weight 1
+USER_WEIGHTS: Dict[str, float] = getattr(settings, 'JIPIPE_USER_WEIGHTS', {})
+
+# Seconds a dispatched job may wait for a worker to start it before its slot is freed. Running
+# jobs renew their slot with their resource reservation (see scheduler.start_reservation_lease),
+# so the slot of a job whose worker process died is freed after JIPIPE_RESERVATION_LEASE_SECONDS
+DISPATCH_TIMEOUT_SECONDS = getattr(settings, 'JIPIPE_DISPATCH_TIMEOUT_SECONDS', 24 * 60 * 60)
+
+DISPATCHED_JOBS_KEY = 'jipipe_dispatched_jobs'
+PENDING_JOBS_KEY = 'jipipe_pending_jobs'
+JOB_SIGNATURES_KEY = 'jipipe_job_signatures'
+PENDING_USERS_PREFIX = 'jipipe_pending_users_'
+PENDING_QUEUE_PREFIX = 'jipipe_pending_'
+
+# Move the next jobs from the pending queues of the users to the dispatched jobs, as long as
+# the caps allow. Priority classes are served in order; within a class, the user with the
+# fewest dispatched jobs per weight goes first (ties: the oldest waiting job).
+# KEYS[1]: dispatched jobs hash, KEYS[2]: pending jobs hash, KEYS[3]: job signatures hash
+# ARGV: pending users prefix, pending queue prefix, total cap, user cap, group cap,
+#       batch cap per user, user weights (JSON), lease expiry of dispatched jobs, priority classes in order
+# Returns the UUID, the metadata and the task signature of every dispatched job
+_DISPATCH_SCRIPT = """
+local max_jobs = tonumber(ARGV[3])
+local user_cap = tonumber(ARGV[4])
+local group_cap = tonumber(ARGV[5])
+local batch_cap = tonumber(ARGV[6])
+local weights = cjson.decode(ARGV[7])
+
+local total = 0
+local users = {}
+local groups = {}
+local batches = {}
+for _, value in ipairs(redis.call('HVALS', KEYS[1])) do
+    local job = cjson.decode(value)
+    total = total + 1
+    users[job['owner']] = (users[job['owner']] or 0) + 1
+    groups[job['group']] = (groups[job['group']] or 0) + 1
+    if job['priority'] == 'batch' then
+        batches[job['owner']] = (batches[job['owner']] or 0) + 1
+    end
+end
+
+local result = {}
+for index = 9, #ARGV do
+    local priority = ARGV[index]
+    local users_key = ARGV[1] .. priority
+    while max_jobs <= 0 or total < max_jobs do
+        local best_owner, best_uuid, best_job, best_score
+        for _, owner in ipairs(redis.call('SMEMBERS', users_key)) do
+            local queue_key = ARGV[2] .. priority .. '_' .. owner
+            local head = redis.call('LINDEX', queue_key, 0)
+            local meta = head and redis.call('HGET', KEYS[2], head)
+            if not head then
+                redis.call('SREM', users_key, owner)
+            elseif not meta then
+                redis.call('LPOP', queue_key)
+            else
+                local job = cjson.decode(meta)
+                local count = users[owner] or 0
+                if (user_cap <= 0 or count < user_cap)
+                    and (group_cap <= 0 or (groups[job['group']] or 0) < group_cap)
+                    and (priority ~= 'batch' or batch_cap <= 0 or (batches[owner] or 0) < batch_cap) then
+                    local score = count / (weights[owner] or 1)
+                    if best_score == nil or score < best_score
+                        or (score == best_score and job['submitted_at'] < best_job['submitted_at']) then
+                        best_owner, best_uuid, best_job, best_score = owner, head, job, score
+                    end
+                end
+            end
+        end
+        if best_owner == nil then
+            break
+        end
+
+        local queue_key = ARGV[2] .. priority .. '_' .. best_owner
+        redis.call('LPOP', queue_key)
+        if redis.call('LLEN', queue_key) == 0 then
+            redis.call('SREM', users_key, best_owner)
+        end
+        redis.call('HDEL', KEYS[2], best_uuid)
+        best_job['lease_until'] = tonumber(ARGV[8])
+        redis.call('HSET', KEYS[1], best_uuid, cjson.encode(best_job))
+        table.insert(result, best_uuid)
+        table.insert(result, cjson.encode(best_job))
+        table.insert(result, redis.call('HGET', KEYS[3], best_uuid))
+
+        total = total + 1
+        users[best_owner] = (users[best_owner] or 0) + 1
+        groups[best_job['group']] = (groups[best_job['group']] or 0) + 1
+        if priority == 'batch' then
+            batches[best_owner] = (batches[best_owner] or 0) + 1
+        end
+    end
+end
+return result
+"""
+
+# Free the slot of a dispatched job unless it was requeued to another node meanwhile, and drop
+# its task signature unless the job is pending again.
+# KEYS[1]: dispatched jobs hash, KEYS[2]: pending jobs hash, KEYS[3]: job signatures hash
+# ARGV: job UUID, node releasing the job ('' == any)
+_RELEASE_SCRIPT = """
+local value = redis.call('HGET', KEYS[1], ARGV[1])
+if not value then
+    if redis.call('HEXISTS', KEYS[2], ARGV[1]) == 0 then
+        redis.call('HDEL', KEYS[3], ARGV[1])
+    end
+    return 0
+end
+local node = cjson.decode(value)['node']
+if ARGV[2] ~= '' and node and node ~= ARGV[2] then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+return 1
+"""
+
+# Claim a job for the node about to run it and extend the lease of its slot. Fails if the job is
+# pending again (requeued after its node was considered lost), was routed to another node or
+# was cancelled before it was claimed (see _CANCEL_SCRIPT).
+# KEYS[1]: dispatched jobs hash, KEYS[2]: pending jobs hash, KEYS[3]: cancel flag of the job
+# ARGV: job UUID, node, lease expiry
+_CLAIM_SCRIPT = """
+if redis.call('HEXISTS', KEYS[2], ARGV[1]) == 1 then
+    return 0
+end
+local value = redis.call('HGET', KEYS[1], ARGV[1])
+if not value then
+    return redis.call('EXISTS', KEYS[3]) == 0 and 1 or 0
+end
+local job = cjson.decode(value)
+if job['node'] and job['node'] ~= ARGV[2] then
+    return 0
+end
+job['node'] = ARGV[2]
+job['claimed'] = true
+job['lease_until'] = tonumber(ARGV[3])
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(job))
+return 1
+"""
+
+# Cancel a job in one atomic step: set its cancel flag (keeping the time of the first request), then
+# remove it from its pending queue, or free the slot of a dispatched job no worker claimed yet.
+# Jobs claimed by a worker keep their slot, the worker terminates them and frees it.
+# KEYS[1]: dispatched jobs hash, KEYS[2]: pending jobs hash, KEYS[3]: job signatures hash, KEYS[4]: cancel flag
+# ARGV: pending queue prefix, job UUID, now, cancel flag TTL
+# Returns 'pending', 'dispatched', 'claimed' or 'unknown' (the job holds no slot)
+_CANCEL_SCRIPT = """
+redis.call('SET', KEYS[4], ARGV[3], 'EX', ARGV[4], 'NX')
+local meta = redis.call('HGET', KEYS[2], ARGV[2])
+if meta then
+    local job = cjson.decode(meta)
+    redis.call('LREM', ARGV[1] .. job['priority'] .. '_' .. job['owner'], 0, ARGV[2])
+    redis.call('HDEL', KEYS[2], ARGV[2])
+    redis.call('HDEL', KEYS[3], ARGV[2])
+    return 'pending'
+end
+local value = redis.call('HGET', KEYS[1], ARGV[2])
+if not value then
+    return 'unknown'
+end
+if cjson.decode(value)['claimed'] then
+    return 'claimed'
+end
+redis.call('HDEL', KEYS[1], ARGV[2])
+redis.call('HDEL', KEYS[3], ARGV[2])
+return 'dispatched'
+"""
+
+# Route a dispatched job to a node, unless it was cancelled meanwhile.
+# KEYS[1]: dispatched jobs hash, ARGV: job UUID, node
+_ROUTE_SCRIPT = """
+local value = redis.call('HGET', KEYS[1], ARGV[1])
+if not value then
+    return 0
+end
+local job = cjson.decode(value)
+job['node'] = ARGV[2]
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(job))
+return 1
+"""
+
+# Extend the lease of the slot of a job running on a node.
+# KEYS[1]: dispatched jobs hash, ARGV: job UUID, node, lease expiry
+_RENEW_SCRIPT = """
+local value = redis.call('HGET', KEYS[1], ARGV[1])
+if not value then
+    return 0
+end
+local job = cjson.decode(value)
+if job['node'] ~= ARGV[2] then
+    return 0
+end
+job['lease_until'] = tonumber(ARGV[3])
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(job))
+return 1
+"""
+
+# Free the slots of dispatched jobs whose lease expired and drop their task signatures.
+# Slots without a lease (dispatched before leases existed) get a new one.
+# KEYS[1]: dispatched jobs hash, KEYS[2]: job signatures hash, ARGV: now, lease expiry for slots without one
+# Returns the UUID and the owner of every freed slot
+_REAP_SCRIPT = """
+local now = tonumber(ARGV[1])
+local result = {}
+local jobs = redis.call('HGETALL', KEYS[1])
+for index = 1, #jobs, 2 do
+    local job = cjson.decode(jobs[index + 1])
+    if not job['lease_until'] then
+        job['lease_until'] = tonumber(ARGV[2])
+        redis.call('HSET', KEYS[1], jobs[index], cjson.encode(job))
+    elseif job['lease_until'] < now then
+        redis.call('HDEL', KEYS[1], jobs[index])
+        redis.call('HDEL', KEYS[2], jobs[index])
+        table.insert(result, jobs[index])
+        table.insert(result, job['owner'])
+    end
+end
+return result
+"""
+
+# Move a job dispatched to a lost node back to the head of the pending queue of its owner.
+# KEYS[1]: dispatched jobs hash, KEYS[2]: pending jobs hash
+# ARGV: pending users prefix, pending queue prefix, job UUID, lost node. Returns the owner or nil.
+_REQUEUE_SCRIPT = """
+local value = redis.call('HGET', KEYS[1], ARGV[3])
+if not value then
+    return false
+end
+local job = cjson.decode(value)
+if job['node'] ~= ARGV[4] then
+    return false
+end
+job['node'] = nil
+job['lease_until'] = nil
+job['claimed'] = nil
+redis.call('HDEL', KEYS[1], ARGV[3])
+redis.call('HSET', KEYS[2], ARGV[3], cjson.encode(job))
+redis.call('LPUSH', ARGV[2] .. job['priority'] .. '_' .. job['owner'], ARGV[3])
+redis.call('SADD', ARGV[1] .. job['priority'], job['owner'])
+return job['owner']
+"""
+
+# Intialize the logger
+logger = logging.getLogger(__name__)
+
+
+def pending_users_key(priority: str) -> str:
+    return f'{PENDING_USERS_PREFIX}{priority}'
+
+
+def pending_queue_key(priority: str, owner: str) -> str:
+    return f'{PENDING_QUEUE_PREFIX}{priority}_{owner}'
+
+
+def job_priority(memory_gb: int, requested: Optional[str] = None) -> str:
+    """
+    Get the priority class of a job. Jobs are interactive unless the batch
+    class was requested or their JVM heap exceeds JIPIPE_INTERACTIVE_MAX_MEMORY_GB.
+    Raises ValueError for unknown priority classes.
+
+    param memory_gb: JVM heap of the job in GB
+    param requested: Requested priority class (e.g. from a query parameter)
+    """
+    if requested in (None, ''):
+        requested = 'interactive'
+    if requested not in PRIORITY_QUEUES:
+        raise ValueError(f'Unknown priority class: {requested}')
+    if requested == 'interactive' and memory_gb > INTERACTIVE_MAX_MEMORY_GB:
+        return 'batch'
+    return requested
+
+
+def enqueue_jobs(signatures: list, owner: str, group_id: Optional[int], priority: str) -> None:
+    """
+    Add jobs to the pending queue of their owner. The jobs are handed to
+    Celery by dispatch_jobs once the fair share and the caps allow it.
+
+    param signatures: Celery task signatures of the jobs (the task ID is the job UUID)
+    param owner: Name of the OMERO user owning the jobs
+    param group_id: ID of the OMERO group the jobs were submitted in (None == unknown)
+    param priority: Priority class of the jobs (see job_priority)
+    """
+    if not signatures:
+        return
+    submitted_at = time.time()
+    pipe = get_redis().pipeline(transaction=True)
+    for signature in signatures:
+        signature.set(queue=PRIORITY_QUEUES[priority])
+        pipe.hset(PENDING_JOBS_KEY, signature.id, json.dumps({
+            'owner': owner,
+            'group': group_id if group_id is not None else -1,
+            'priority': priority,
+            'memory_gb': signature.kwargs.get('memory_gb', DEFAULT_JOB_MEMORY_GB),
+            'submitted_at': submitted_at,
+        }))
+        pipe.hset(JOB_SIGNATURES_KEY, signature.id, json.dumps(signature))
+    pipe.rpush(pending_queue_key(priority, owner), *(signature.id for signature in signatures))
+    pipe.sadd(pending_users_key(priority), owner)
+    pipe.execute()
+
+
+def dispatch_jobs() -> List[str]:
+    """
+    Hand the next pending jobs to Celery in fair-share order, as long as
+    the total, per-user, per-group and per-user batch caps allow. If
+    worker nodes serve the priority class of a job, it is routed to the
+    queue of that class on one of them (see nodes.choose_node), else it
+    goes to the queue of its class. Jobs of lost nodes are requeued and
+    stale slots are freed first (see reap_stale_jobs).
+    Call it after jobs were enqueued or released.
+    Returns the UUIDs of the dispatched jobs.
+    """
+    requeue_lost_jobs()
+    reap_stale_jobs()
+    redis_client = get_redis()
+    result = redis_client.eval(
+        _DISPATCH_SCRIPT,
+        3,
+        DISPATCHED_JOBS_KEY,
+        PENDING_JOBS_KEY,
+        JOB_SIGNATURES_KEY,
+        PENDING_USERS_PREFIX,
+        PENDING_QUEUE_PREFIX,
+        MAX_DISPATCHED_JOBS,
+        USER_MAX_JOBS,
+        GROUP_MAX_JOBS,
+        BATCH_PARALLELISM,
+        json.dumps(USER_WEIGHTS),
+        time.time() + DISPATCH_TIMEOUT_SECONDS,
+        *PRIORITY_QUEUES,
+    )
+    if not result:
+        return []
+
+    # Memory and cores of the jobs already routed to each alive node
+    nodes = alive_nodes()
+    load = {}
+    if nodes:
+        for job in dispatched_jobs().values():
+            if job.get('node') in nodes:
+                node_load = load.setdefault(job['node'], {'memory_gb': 0, 'cpus': 0})
+                node_load['memory_gb'] += job.get('memory_gb', DEFAULT_JOB_MEMORY_GB)
+                node_load['cpus'] += JOB_CPUS
+
+    dispatched = []
+    for index in range(0, len(result), 3):
+        job_uuid = result[index].decode('utf-8')
+        job = json.loads(result[index + 1])
+        signature = task_signature(json.loads(result[index + 2]))
+        node = choose_node(nodes, load, job['memory_gb'], job['priority']) if nodes else None
+        if node is not None:
+            node_load = load.setdefault(node, {'memory_gb': 0, 'cpus': 0})
+            node_load['memory_gb'] += job['memory_gb']
+            node_load['cpus'] += JOB_CPUS
+            if not redis_client.eval(_ROUTE_SCRIPT, 1, DISPATCHED_JOBS_KEY, job_uuid, node):
+                continue
+            signature.set(queue=node_queue(node, job['priority']))
+        signature.apply_async()
+        dispatched.append(job_uuid)
+    return dispatched
+
+
+def release_job(job_uuid: str, node: Optional[str] = None) -> bool:
+    """
+    Free the slot of a dispatched job, so dispatch_jobs can hand out the next one.
+    Releasing is idempotent. Returns True if the job held a slot.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param node: Worker node releasing the job, ignored if the job was requeued to another node (None == any)
+    """
+    released = get_redis().eval(
+        _RELEASE_SCRIPT, 3, DISPATCHED_JOBS_KEY, PENDING_JOBS_KEY, JOB_SIGNATURES_KEY, job_uuid, node or '')
+    return bool(released)
+
+
+def claim_job(job_uuid: str, node: str) -> bool:
+    """
+    Claim a dispatched job for the worker node about to run it.
+    Returns False if the job must not run there, because it was requeued
+    after its node was considered lost, was routed to another node or was
+    cancelled before any worker claimed it.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param node: Name of the worker node
+    """
+    claimed = get_redis().eval(
+        _CLAIM_SCRIPT, 3, DISPATCHED_JOBS_KEY, PENDING_JOBS_KEY, cancel_key(job_uuid),
+        job_uuid, node, time.time() + DISPATCH_TIMEOUT_SECONDS)
+    return bool(claimed)
+
+
+def renew_job_lease(job_uuid: str, node: str) -> bool:
+    """
+    Keep the slot of a running job for another JIPIPE_RESERVATION_LEASE_SECONDS.
+    Returns False if the job holds no slot on the node anymore.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param node: Name of the worker node running the job
+    """
+    renewed = get_redis().eval(
+        _RENEW_SCRIPT, 1, DISPATCHED_JOBS_KEY, job_uuid, node, time.time() + RESERVATION_LEASE_SECONDS)
+    return bool(renewed)
+
+
+def reap_stale_jobs() -> List[str]:
+    """
+    Free the slots of dispatched jobs whose lease expired: jobs no worker
+    started within JIPIPE_DISPATCH_TIMEOUT_SECONDS, and running jobs whose
+    worker process stopped renewing the lease (e.g. it was killed). Jobs
+    that did not end yet are recorded as failed.
+    Returns the UUIDs of the freed jobs.
+    """
+    now = time.time()
+    result = get_redis().eval(
+        _REAP_SCRIPT, 2, DISPATCHED_JOBS_KEY, JOB_SIGNATURES_KEY, now, now + DISPATCH_TIMEOUT_SECONDS)
+    reaped = []
+    for index in range(0, len(result), 2):
+        job_uuid = result[index].decode('utf-8')
+        job = get_job(job_uuid)
+        if job is not None and job.get('state') not in ('finished', 'failed', 'cancelled'):
+            logger.warning('Freeing the slot of stale JIPipe job %s (state %s)', job_uuid, job.get('state'))
+            finish_job(result[index + 1].decode('utf-8'), job_uuid, state='failed')
+        reaped.append(job_uuid)
+    return reaped
+
+
+def requeue_lost_jobs() -> List[str]:
+    """
+    Move the jobs of worker nodes without heartbeat back to the head of the
+    pending queues of their owners and remove the lost nodes.
+    Returns the UUIDs of the requeued jobs.
+    """
+    lost = lost_nodes()
+    if not lost:
+        return []
+    requeued = []
+    jobs = dispatched_jobs()
+    for node in lost:
+        for job_uuid, job in jobs.items():
+            if job.get('node') != node:
+                continue
+            owner = get_redis().eval(
+                _REQUEUE_SCRIPT, 2, DISPATCHED_JOBS_KEY, PENDING_JOBS_KEY,
+                PENDING_USERS_PREFIX, PENDING_QUEUE_PREFIX, job_uuid, node)
+            if owner is not None:
+                update_job(job_uuid, state='queued', requeued_from=node)
+                requeued.append(job_uuid)
+        forget_node(node)
+    return requeued
+
+
+def cancel_job(job_uuid: str) -> str:
+    """
+    Flag a job as cancelled (see cancellation.cancel_requested_at) and, in
+    the same atomic step, remove it from its pending queue or free the slot
+    of a dispatched job that no worker claimed yet. A job claimed by a worker
+    keeps its slot until the worker has terminated it.
+    Returns 'pending', 'dispatched' (the job ended without running),
+    'claimed' (its worker ends it) or 'unknown' (the job holds no slot).
+
+    param job_uuid: Unique identifier for the JIPipe job
+    """
+    outcome = get_redis().eval(
+        _CANCEL_SCRIPT, 4, DISPATCHED_JOBS_KEY, PENDING_JOBS_KEY, JOB_SIGNATURES_KEY, cancel_key(job_uuid),
+        PENDING_QUEUE_PREFIX, job_uuid, time.time(), CANCEL_TTL)
+    return outcome.decode('utf-8')
+
+
+def queue_position(job_uuid: str) -> Optional[int]:
+    """
+    Estimate the position of a pending job in the dispatch order (1 == next).
+    Counts the pending jobs of higher priority classes, the jobs of the owner
+    ahead of it and the jobs other users get in the meantime by their fair
+    share. Returns None if the job is not pending (dispatched or unknown).
+
+    param job_uuid: Unique identifier for the JIPipe job
+    """
+    redis_client = get_redis()
+    meta = redis_client.hget(PENDING_JOBS_KEY, job_uuid)
+    if meta is None:
+        return None
+    job = json.loads(meta)
+    owner = job['owner']
+    own_queue = [value.decode('utf-8') for value in redis_client.lrange(pending_queue_key(job['priority'], owner), 0, -1)]
+    if job_uuid not in own_queue:
+        return None
+    own_ahead = own_queue.index(job_uuid)
+
+    # Pending queue lengths of all users of this and the higher priority classes
+    classes = list(PRIORITY_QUEUES)
+    classes = classes[:classes.index(job['priority']) + 1]
+    pipe = redis_client.pipeline(transaction=False)
+    for priority in classes:
+        pipe.smembers(pending_users_key(priority))
+    members = pipe.execute()
+    queues = [(priority, user.decode('utf-8')) for priority, users in zip(classes, members) for user in users]
+    pipe = redis_client.pipeline(transaction=False)
+    for priority, user in queues:
+        pipe.llen(pending_queue_key(priority, user))
+    lengths = pipe.execute()
+
+    ahead = own_ahead
+    own_weight = USER_WEIGHTS.get(owner, 1)
+    for (priority, user), length in zip(queues, lengths):
+        if priority != job['priority']:
+            ahead += length
+        elif user != owner:
+            ahead += min(length, math.ceil((own_ahead + 1) * USER_WEIGHTS.get(user, 1) / own_weight))
+    return ahead + 1
+
+
+def dispatched_jobs() -> Dict[str, Dict]:
+    """
+    Get the owner, group, priority class, memory and worker node of all dispatched jobs.
+    """
+    return {
+        job_uuid.decode('utf-8'): json.loads(value)
+        for job_uuid, value in get_redis().hgetall(DISPATCHED_JOBS_KEY).items()
+    }
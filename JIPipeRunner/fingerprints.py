@@ -0,0 +1,151 @@
+import hashlib
+import json
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+from JIPipeRunner.redis_client import get_redis
+from JIPipeRunner.registry import FINISHED_JOB_TTL, get_job
+
+# Version of the installed JIPipe, part of every fingerprint so upgrades invalidate all results
+JIPIPE_VERSION = getattr(settings, 'JIPIPE_VERSION', '')
+
+# Node keys that only describe the graph layout and do not change results
+_LAYOUT_NODE_KEYS = ('jipipe:node:ui-grid-location',)
+
+# Seconds a job that claimed a fingerprint may take to be registered, until then it counts as queued
+CLAIM_REGISTRATION_SECONDS = 60
+
+FINGERPRINT_KEY_PREFIX = 'jipipe_fingerprint_'
+
+# Claim a fingerprint for a job unless another job already holds it.
+# KEYS[1]: fingerprint key, ARGV: job UUID, owner, TTL, claim time
+# Returns the holding job UUID and its claim time, or nil.
+_CLAIM_SCRIPT = """
+local existing = redis.call('HMGET', KEYS[1], 'job_uuid', 'claimed_at')
+if existing[1] then
+    return existing
+end
+redis.call('HSET', KEYS[1], 'job_uuid', ARGV[1], 'owner', ARGV[2], 'claimed_at', ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return false
+"""
+
+# Replace the job holding a fingerprint if it is still the expected (stale) one.
+# KEYS[1]: fingerprint key, ARGV: stale job UUID, new job UUID, owner, TTL, claim time
+_REPLACE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'job_uuid') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'job_uuid', ARGV[2], 'owner', ARGV[3], 'claimed_at', ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+
+def fingerprint_key(fingerprint: str) -> str:
+    return f'{FINGERPRINT_KEY_PREFIX}{fingerprint}'
+
+
+def _normalize_node(node: dict) -> dict:
+    # Drop layout-only keys and normalize dataset IDs entered as strings and in any order
+    normalized = {key: value for key, value in node.items() if key not in _LAYOUT_NODE_KEYS}
+    if isinstance(normalized.get('dataset-ids'), list):
+        normalized['dataset-ids'] = sorted(str(dataset_id).strip() for dataset_id in normalized['dataset-ids'])
+    return normalized
+
+
+def compute_fingerprint(jipipe_project_config: dict, owner: str,
+                        input_versions: Optional[Dict[int, List[List[int]]]] = None) -> str:
+    """
+    Compute a canonical fingerprint of a job from the normalized project
+    (including its input dataset IDs and output targets), the content of
+    its input datasets, the owner and the JIPipe version. Identical
+    fingerprints produce identical results.
+
+    param jipipe_project_config: JSON configuration of the JIPipe project
+    param owner: Name of the OMERO user submitting the job
+    param input_versions: [image ID, update time] of every image of each input dataset,
+                          so adding, removing or changing images changes the fingerprint
+    """
+    graph = jipipe_project_config.get('graph', {})
+    normalized = {
+        **jipipe_project_config,
+        'graph': {
+            **graph,
+            'nodes': {uuid: _normalize_node(node) for uuid, node in graph.get('nodes', {}).items()},
+        },
+    }
+    canonical = json.dumps(
+        {
+            'project': normalized,
+            'inputs': {str(dataset_id): sorted(images) for dataset_id, images in (input_versions or {}).items()},
+            'owner': owner,
+            'jipipe_version': JIPIPE_VERSION,
+        },
+        sort_keys=True,
+        separators=(',', ':'),
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _is_reusable(job: Optional[Dict[str, str]]) -> bool:
+    # Jobs that are still queued or running can be joined, finished ones only if they succeeded
+    if job is None:
+        return False
+    return job['state'] in ('queued', 'running') or (job['state'] == 'finished' and job.get('exit_code') == '0')
+
+
+def claim_fingerprint(fingerprint: str, owner: str, job_uuid: str) -> Optional[Tuple[str, Dict[str, str]]]:
+    """
+    Claim a fingerprint for a new job. If a job with the same fingerprint is
+    in flight or completed successfully, returns its UUID and metadata instead,
+    so the caller can coalesce onto it. A job that claimed the fingerprint
+    less than CLAIM_REGISTRATION_SECONDS ago but is not registered yet (a
+    concurrent identical submission) counts as queued. Failed, cancelled or
+    expired jobs are replaced by the new job. Returns None if the new job
+    holds the fingerprint.
+
+    param fingerprint: Fingerprint of the new job
+    param owner: Name of the OMERO user submitting the job
+    param job_uuid: Unique identifier for the new JIPipe job
+    """
+    redis_client = get_redis()
+    key = fingerprint_key(fingerprint)
+    for _ in range(3):
+        now = time.time()
+        existing = redis_client.eval(_CLAIM_SCRIPT, 1, key, job_uuid, owner, FINISHED_JOB_TTL, now)
+        if existing is None:
+            return None
+        existing_uuid, claimed_at = existing[0].decode('utf-8'), float(existing[1] or 0)
+        job = get_job(existing_uuid)
+        if job is None and now - claimed_at < CLAIM_REGISTRATION_SECONDS:
+            return existing_uuid, {'state': 'queued'}
+        if _is_reusable(job):
+            return existing_uuid, job
+        if redis_client.eval(_REPLACE_SCRIPT, 1, key, existing_uuid, job_uuid, owner, FINISHED_JOB_TTL, now):
+            return None
+    return None
+
+
+def iter_fingerprints() -> Iterator[Tuple[str, Dict[str, str]]]:
+    """
+    Iterate over all stored fingerprints and the job holding them.
+    """
+    redis_client = get_redis()
+    for key in redis_client.scan_iter(match=f'{FINGERPRINT_KEY_PREFIX}*'):
+        values = redis_client.hgetall(key)
+        if values:
+            fingerprint = key.decode('utf-8')[len(FINGERPRINT_KEY_PREFIX):]
+            yield fingerprint, {field.decode('utf-8'): value.decode('utf-8') for field, value in values.items()}
+
+
+def invalidate_fingerprint(fingerprint: str) -> bool:
+    """
+    Remove a stored fingerprint so the next identical submission runs again.
+    Returns True if the fingerprint existed.
+
+    param fingerprint: Fingerprint to remove
+    """
+    return bool(get_redis().delete(fingerprint_key(fingerprint)))
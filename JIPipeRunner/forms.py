@@ -14,25 +14,46 @@ class RangeInputForm(forms.ModelForm):
         model = IDs
         fields = ['raw_number_list']
 
+    def __init__(self, *args, max_count=None, **kwargs):
+        """
+        param max_count: Largest number of distinct IDs accepted (None == unlimited),
+                         checked before the ranges are expanded
+        """
+        super().__init__(*args, **kwargs)
+        self.max_count = max_count
+
     def clean_raw_number_list(self):
         data = self.cleaned_data['raw_number_list']
         pattern = r'(\d+-\d+|\d+)'
         matches = re.findall(pattern, data)
-        numbers = set()
+        ranges = []
 
         for match in matches:
             if '-' in match:
                 start, end = map(int, match.split('-'))
-                numbers.update(range(start, end + 1))
+                ranges.append((start, end))
             else:
-                numbers.add(int(match))
+                ranges.append((int(match), int(match)))
 
+        # Count the distinct IDs of the merged ranges, so huge ranges are rejected without expanding them
+        if self.max_count is not None:
+            count, covered_until = 0, -1
+            for start, end in sorted(ranges):
+                start = max(start, covered_until + 1)
+                if end >= start:
+                    count += end - start + 1
+                    covered_until = end
+            if count > self.max_count:
+                raise forms.ValidationError(f'At most {self.max_count} IDs are allowed')
+
+        numbers = set()
+        for start, end in ranges:
+            numbers.update(range(start, end + 1))
         return sorted(numbers)
 
     def save(self, commit=True):
         instance = super().save(commit=False)
         numbers = self.cleaned_data['raw_number_list']
-        print(f"Type: {type(numbers)}, Value: {numbers}")
         # Save the list directly to the JSONField
         instance.id_list_field = numbers
         if commit:
@@ -0,0 +1,227 @@
+import json
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from JIPipeRunner.models import Job
+from JIPipeRunner.redis_client import get_redis
+from JIPipeRunner.registry import JOB_EVENTS_KEY, get_job
+
+# Largest number of job state changes written to the database in one batch
+HISTORY_BATCH_SIZE = getattr(settings, 'JIPIPE_HISTORY_BATCH_SIZE', 500)
+
+# Page size of the job history API (default and maximum)
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+# Seconds a flush may hold the job history lock, and wait for it
+HISTORY_LOCK_TIMEOUT = 60
+HISTORY_LOCK_WAIT = 10
+
+HISTORY_LOCK_KEY = 'jipipe_job_history_lock'
+
+# Job events claimed by the running flush, removed once they are committed to the database
+PROCESSING_EVENTS_KEY = 'jipipe_job_events_processing'
+
+# Claim up to ARGV[1] job events by moving them to the processing list. Events left there by
+# a failed flush are older than all queued events, so they are returned again first.
+# KEYS[1]: job event list, KEYS[2]: processing list, ARGV[1]: largest number of events
+_CLAIM_EVENTS_SCRIPT = """
+local events = redis.call('LRANGE', KEYS[2], 0, -1)
+if #events > 0 then
+    return events
+end
+events = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #events > 0 then
+    redis.call('LTRIM', KEYS[1], #events, -1)
+    redis.call('RPUSH', KEYS[2], unpack(events))
+end
+return events
+"""
+
+# Registry fields stored in the columns of the same name
+_TEXT_FIELDS = ('owner', 'pipeline', 'fingerprint', 'batch_id', 'priority', 'worker', 'node', 'log_file')
+_INTEGER_FIELDS = ('jip_file_id', 'dataset_id', 'memory_gb', 'exit_code', 'results_project_id')
+_TIME_FIELDS = ('submitted_at', 'started_at', 'ended_at')
+
+# Intialize the logger
+logger = logging.getLogger(__name__)
+
+
+def _columns(fields: Dict) -> Dict:
+    # Convert the registry fields of a job event to model column values
+    columns = {}
+    for field in _TEXT_FIELDS:
+        if field in fields:
+            columns[field] = str(fields[field])
+    for field in _INTEGER_FIELDS:
+        if fields.get(field) not in (None, ''):
+            columns[field] = int(fields[field])
+    for field in _TIME_FIELDS:
+        if fields.get(field) not in (None, ''):
+            columns[field] = datetime.fromtimestamp(float(fields[field]), tz=timezone.utc)
+    if fields.get('state') in dict(Job.STATES):
+        columns['state'] = fields['state']
+    return columns
+
+
+def flush_job_history(max_events: int = HISTORY_BATCH_SIZE) -> int:
+    """
+    Write the queued job state changes (see registry) to the job history in
+    the database. Flushes hold a lock, so the changes of a job are written in
+    order. The events are claimed into a processing list and only removed
+    after the transaction commits, so a failed flush retries them. Changes of
+    the same job are merged first, then all jobs of the batch are read,
+    updated and created with three queries in a single transaction. Jobs
+    without a history row (e.g. registered before the job history existed)
+    are created from their registry record. Returns the number of claimed
+    events (0 if another flush holds the lock).
+
+    param max_events: Largest number of events to write
+    """
+    lock = get_redis().lock(HISTORY_LOCK_KEY, timeout=HISTORY_LOCK_TIMEOUT)
+    if not lock.acquire(blocking_timeout=HISTORY_LOCK_WAIT):
+        return 0
+    try:
+        events = get_redis().eval(_CLAIM_EVENTS_SCRIPT, 2, JOB_EVENTS_KEY, PROCESSING_EVENTS_KEY, max_events)
+        if not events:
+            return 0
+        _write_events(events)
+        get_redis().delete(PROCESSING_EVENTS_KEY)
+        return len(events)
+    finally:
+        lock.release()
+
+
+def _write_events(events: List[bytes]) -> None:
+    # Merge the events per job and write them to the database in one transaction
+    changes: Dict[uuid.UUID, Dict] = {}
+    job_uuids: Dict[uuid.UUID, str] = {}
+    for event in events:
+        try:
+            fields = json.loads(event)
+            job_uuid = fields.pop('id')
+            job_id = uuid.UUID(job_uuid)
+            changes.setdefault(job_id, {}).update(_columns(fields))
+            job_uuids[job_id] = job_uuid
+        except (ValueError, KeyError, TypeError):
+            logger.warning('Skipping malformed JIPipe job event: %r', event)
+
+    with transaction.atomic():
+        existing = Job.objects.in_bulk(list(changes))
+        updated, created, update_fields = [], [], set()
+        for job_id, columns in changes.items():
+            job = existing.get(job_id)
+            if job is None:
+                if 'submitted_at' not in columns:
+                    # Jobs registered before the job history existed have no submission event
+                    columns = {**_columns(get_job(job_uuids[job_id]) or {}), **columns}
+                if 'owner' not in columns:
+                    logger.warning('Skipping events of unknown JIPipe job %s', job_id)
+                    continue
+                columns.setdefault('submitted_at', columns.get('started_at') or columns.get('ended_at') or datetime.now(timezone.utc))
+                created.append(Job(id=job_id, **columns))
+                continue
+            for column, value in columns.items():
+                setattr(job, column, value)
+            update_fields.update(columns)
+            updated.append(job)
+        if created:
+            Job.objects.bulk_create(created, ignore_conflicts=True)
+        if updated:
+            Job.objects.bulk_update(updated, sorted(update_fields), batch_size=HISTORY_BATCH_SIZE)
+
+
+def flush_job_history_quietly() -> None:
+    """
+    Flush the job history (see flush_job_history), logging failures instead
+    of raising them. The events stay queued in Redis until a flush succeeds.
+    """
+    try:
+        while flush_job_history() >= HISTORY_BATCH_SIZE:
+            pass
+    except Exception:
+        logger.exception('Failed to write the JIPipe job history')
+
+
+def job_record(job: Job) -> Dict:
+    """
+    Convert a job of the history to the field names of the job registry (UNIX timestamps for times).
+
+    param job: Job of the history
+    """
+    record = {
+        'job_id': job.id.hex,
+        'owner': job.owner,
+        'state': job.state,
+        'pipeline': job.pipeline,
+        'fingerprint': job.fingerprint,
+        'worker': job.worker,
+        'node': job.node,
+    }
+    for field in ('jip_file_id', 'batch_id', 'dataset_id', 'priority', 'memory_gb', 'exit_code', 'results_project_id'):
+        value = getattr(job, field)
+        if value not in (None, ''):
+            record[field] = value
+    for field in _TIME_FIELDS:
+        value = getattr(job, field)
+        if value is not None:
+            record[field] = value.timestamp()
+    return record
+
+
+def get_history_job(job_uuid: str) -> Optional[Dict]:
+    """
+    Get a job from the history in the field names of the job registry, or None if it is unknown.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    """
+    try:
+        job = Job.objects.filter(id=uuid.UUID(job_uuid)).first()
+    except ValueError:
+        return None
+    return job_record(job) if job is not None else None
+
+
+def encode_cursor(job: Job) -> str:
+    return f'{job.submitted_at.timestamp():.6f}_{job.id.hex}'
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """
+    Parse a job history cursor (see encode_cursor). Raises ValueError if it is malformed.
+
+    param cursor: Cursor returned with the previous page
+    """
+    timestamp, job_id = cursor.split('_', 1)
+    return datetime.fromtimestamp(float(timestamp), tz=timezone.utc), uuid.UUID(job_id)
+
+
+def list_job_history(owner: str, limit: int = HISTORY_PAGE_SIZE, cursor: Optional[str] = None,
+                     states: Optional[List[str]] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Get a page of the jobs of a user, newest first. Pages are addressed by
+    the (submission time, ID) of the last job of the previous page, so every
+    page is a range scan of the (owner, submitted_at, id) index no matter
+    how deep the history is.
+    Returns the jobs of the page and the cursor of the next page (None on the last page).
+
+    param owner: Name of the OMERO user
+    param limit: Largest number of jobs in the page
+    param cursor: Cursor returned with the previous page (None == first page)
+    param states: Only list jobs in these states (None == all states)
+    """
+    jobs = Job.objects.filter(owner=owner)
+    if states:
+        jobs = jobs.filter(state__in=states)
+    if cursor:
+        submitted_at, job_id = decode_cursor(cursor)
+        jobs = jobs.filter(Q(submitted_at__lt=submitted_at) | Q(submitted_at=submitted_at, id__lt=job_id))
+    page = list(jobs.order_by('-submitted_at', '-id')[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return [job_record(job) for job in page[:limit]], next_cursor
@@ -0,0 +1,100 @@
+import codecs
+import os
+import threading
+import time
+from typing import Callable, List
+
+from django.conf import settings
+
+# Size of the reads from the output pipe of the JIPipe process
+LOG_PUMP_READ_BYTES = 64 * 1024
+
+# Buffered output is written once it is this old (in seconds) or this large (in bytes)
+LOG_PUMP_FLUSH_SECONDS = getattr(settings, 'JIPIPE_LOG_FLUSH_SECONDS', 0.25)
+LOG_PUMP_FLUSH_BYTES = getattr(settings, 'JIPIPE_LOG_FLUSH_BYTES', 256 * 1024)
+
+# Largest amount of output (in bytes) queued in memory, the reader stops draining the pipe beyond it
+LOG_PUMP_QUEUE_BYTES = getattr(settings, 'JIPIPE_LOG_QUEUE_BYTES', 16 * 1024 * 1024)
+
+
+class LogPump:
+    """
+    Moves the output of a child process into the job log with few syscalls.
+    A reader thread drains the output pipe in large binary chunks into an
+    in-memory queue, so a slow log disk only blocks the child on a full pipe
+    once LOG_PUMP_QUEUE_BYTES are queued. The calling thread collects the
+    queued chunks and hands complete lines to the write callback in batches,
+    once they are LOG_PUMP_FLUSH_SECONDS old or LOG_PUMP_FLUSH_BYTES large.
+    """
+
+    def __init__(self, pipe, write: Callable[[str], None]):
+        """
+        param pipe: Binary output pipe of the child process
+        param write: Callback receiving batches of complete, newline-terminated lines
+        """
+        self.pipe = pipe
+        self.write = write
+        self.chunks: List[bytes] = []
+        self.buffered = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.reader = threading.Thread(target=self._read, name='jipipe-log-pump', daemon=True)
+
+    def _read(self) -> None:
+        # Drain the pipe as fast as the child writes, independent of the log writes
+        file_descriptor = self.pipe.fileno()
+        try:
+            while True:
+                chunk = os.read(file_descriptor, LOG_PUMP_READ_BYTES)
+                if not chunk:
+                    break
+                with self.condition:
+                    # Wait for the writer while the queue is full
+                    while self.buffered >= LOG_PUMP_QUEUE_BYTES:
+                        self.condition.wait()
+                    self.chunks.append(chunk)
+                    self.buffered += len(chunk)
+                    self.condition.notify_all()
+        finally:
+            with self.condition:
+                self.closed = True
+                self.condition.notify_all()
+
+    def run(self) -> None:
+        """
+        Pump the output until the child closed its end of the pipe.
+        """
+        self.reader.start()
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        pending = ''
+        while True:
+            with self.condition:
+                # Sleep until the child writes, then until enough output is buffered or the flush interval passed
+                while not self.closed and not self.chunks:
+                    self.condition.wait()
+                deadline = time.monotonic() + LOG_PUMP_FLUSH_SECONDS
+                while not self.closed and self.buffered < LOG_PUMP_FLUSH_BYTES:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                chunks, self.chunks, self.buffered = self.chunks, [], 0
+                closed = self.closed
+                self.condition.notify_all()
+
+            # Only write complete lines, keeping a partial last line for the next batch
+            text = pending + decoder.decode(b''.join(chunks), final=closed)
+            if closed or len(text) - text.rfind('\n') > LOG_PUMP_FLUSH_BYTES:
+                # Terminate a remaining partial line (or one growing without bounds)
+                if text and not text.endswith('\n'):
+                    text += '\n'
+                pending = ''
+            else:
+                split = text.rfind('\n') + 1
+                text, pending = text[:split], text[split:]
+
+            if text:
+                self.write(text)
+            if closed:
+                break
+        self.reader.join()
@@ -0,0 +1,552 @@
+import bisect
+import contextlib
+import gzip
+import json
+import os
+import re
+import shutil
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+# Directory where JIPipe log files are stored (customize via Django settings)
+LOG_DIR = getattr(settings, 'JIPIPE_LOG_ROOT', '/tmp/jipipe_logs')
+os.makedirs(LOG_DIR, exist_ok=True)
+
+# Maximum number of bytes returned by a single incremental log read
+LOG_MAX_CHUNK_BYTES = 1024 * 1024
+
+# Block size used when scanning a log file backwards for tail reads
+LOG_TAIL_BLOCK_BYTES = 64 * 1024
+
+# Number of bytes at the end of a log file that are checked for the exit message
+LOG_EXIT_MARKER_BYTES = 256
+
+# Message written by the Celery task once the JIPipe process has exited
+LOG_EXIT_MARKER = 'JIPipe exited with code'
+
+# A new log segment is started after this many (uncompressed) bytes or seconds
+LOG_SEGMENT_BYTES = getattr(settings, 'JIPIPE_LOG_SEGMENT_BYTES', 1024 * 1024)
+LOG_SEGMENT_SECONDS = getattr(settings, 'JIPIPE_LOG_SEGMENT_SECONDS', 60)
+
+# Archived logs older than this many days are deleted, then the oldest ones beyond the size budget
+LOG_RETENTION_DAYS = getattr(settings, 'JIPIPE_LOG_RETENTION_DAYS', 30)
+LOG_RETENTION_BYTES = getattr(settings, 'JIPIPE_LOG_RETENTION_BYTES', 10 * 1024 ** 3)
+
+# Minimum time (in seconds) between two retention runs triggered by finished jobs
+LOG_PRUNE_INTERVAL = 3600
+
+# Maximum number of (uncompressed) bytes scanned by a single search call, and the longest accepted pattern
+LOG_SEARCH_MAX_BYTES = 32 * 1024 * 1024
+LOG_SEARCH_MAX_PATTERN = 200
+
+# Log levels derived from the content of a line, ordered by severity
+LOG_LEVELS = ('info', 'warning', 'error')
+_ERROR_PATTERN = re.compile(rb'ERROR|SEVERE|FATAL|Exception|Traceback')
+_WARNING_PATTERN = re.compile(rb'WARN')
+
+
+def archive_path(log_file_path: str) -> str:
+    """
+    Get the directory holding the compressed segments of an archived log file.
+    """
+    return log_file_path + '.d'
+
+
+def index_path(log_file_path: str) -> str:
+    """
+    Get the path of the segment index written next to a live log file.
+    """
+    return log_file_path + '.idx'
+
+
+def log_exists(log_file_path: str) -> bool:
+    """
+    Check whether a job has a live or an archived log.
+
+    param log_file_path: Path to the log file of the JIPipe job
+    """
+    return os.path.exists(log_file_path) or os.path.exists(os.path.join(archive_path(log_file_path), 'index.json'))
+
+
+def log_stat(log_file_path: str) -> Optional[Tuple[int, float]]:
+    """
+    Get the end cursor (size in bytes) and the time of the last write of a
+    live or archived log, or None if the job has no log.
+
+    param log_file_path: Path to the log file of the JIPipe job
+    """
+    try:
+        stat = os.stat(log_file_path)
+        return stat.st_size, stat.st_mtime
+    except FileNotFoundError:
+        archive = _load_archive(log_file_path)
+        if archive is None:
+            return None
+        return archive['size'], os.path.getmtime(os.path.join(archive_path(log_file_path), 'index.json'))
+
+
+def line_level(line: bytes) -> str:
+    """
+    Classify a log line as 'error', 'warning' or 'info' by its content.
+    """
+    if _ERROR_PATTERN.search(line):
+        return 'error'
+    if _WARNING_PATTERN.search(line):
+        return 'warning'
+    return 'info'
+
+
+def _count_levels(data: bytes) -> Tuple[int, int, int]:
+    # Count the lines, error lines and warning lines of a chunk of log data
+    lines = data.splitlines()
+    errors = warnings = 0
+    for line in lines:
+        level = line_level(line)
+        errors += level == 'error'
+        warnings += level == 'warning'
+    return len(lines), errors, warnings
+
+
+class LogWriter:
+    """
+    Append-only writer of a live job log.
+    Every LOG_SEGMENT_BYTES bytes or LOG_SEGMENT_SECONDS seconds, the writer
+    closes a segment at the next line break and appends its byte range, first
+    line number, time range and number of error and warning lines to the index
+    file next to the log. archive_log compresses the log along these segments,
+    and searches skip segments that cannot match.
+    """
+
+    def __init__(self, log_file_path: str):
+        self.log_file_path = log_file_path
+        self.file_handle = open(log_file_path, 'ab', buffering=0)
+        self.index_handle = open(index_path(log_file_path), 'a')
+        self.cursor = os.fstat(self.file_handle.fileno()).st_size
+
+        # Continue after the last closed segment (lines written while the job was queued are counted here)
+        segments = _read_index_file(index_path(log_file_path))
+        if segments:
+            self.segment = _new_segment(segments[-1]['end'], segments[-1]['first_line'] + segments[-1]['lines'], segments[-1]['end_time'])
+        else:
+            self.segment = _new_segment(0, 0, os.path.getmtime(log_file_path))
+        with open(log_file_path, 'rb') as existing:
+            existing.seek(self.segment['offset'])
+            self.segment['lines'], self.segment['errors'], self.segment['warnings'] = _count_levels(existing.read(self.cursor - self.segment['offset']))
+
+    def __enter__(self) -> 'LogWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, text: str) -> Tuple[int, int]:
+        """
+        Append text to the log. Returns the byte offsets before and after the written text.
+        """
+        data = text.encode('utf-8')
+        start = self.cursor
+        self.file_handle.write(data)
+        self.cursor += len(data)
+
+        _, errors, warnings = _count_levels(data)
+        segment = self.segment
+        segment['lines'] += data.count(b'\n')
+        segment['errors'] += errors
+        segment['warnings'] += warnings
+
+        # Close the segment at a line break once it is large or old enough
+        now = time.time()
+        if data.endswith(b'\n') and (self.cursor - segment['offset'] >= LOG_SEGMENT_BYTES or now - segment['start_time'] >= LOG_SEGMENT_SECONDS):
+            segment['end'] = self.cursor
+            segment['end_time'] = now
+            self.index_handle.write(json.dumps(segment) + '\n')
+            self.index_handle.flush()
+            self.segment = _new_segment(self.cursor, segment['first_line'] + segment['lines'], now)
+        return start, self.cursor
+
+    def flush(self) -> None:
+        # Writes are unbuffered, so every line is visible to readers right away
+        pass
+
+    def close(self) -> None:
+        self.file_handle.close()
+        self.index_handle.close()
+
+
+def _new_segment(offset: int, first_line: int, start_time: float) -> dict:
+    return {
+        'offset': offset, 'end': offset, 'first_line': first_line, 'lines': 0,
+        'start_time': start_time, 'end_time': start_time, 'errors': 0, 'warnings': 0,
+    }
+
+
+def _read_index_file(path: str) -> List[dict]:
+    # Read the closed segments of a live log, ignoring a partially written last entry
+    segments = []
+    with contextlib.suppress(FileNotFoundError):
+        with open(path) as index_file:
+            for entry in index_file:
+                with contextlib.suppress(ValueError):
+                    segments.append(json.loads(entry))
+    return segments
+
+
+def archive_log(log_file_path: str) -> None:
+    """
+    Compress a finished job log into gzip segments with a JSON index of the
+    byte offsets, line numbers, time ranges and error counts of all segments.
+    Byte offsets keep referring to the uncompressed log, so cursors handed out
+    while the job was running stay valid. Readers switch to the archive once
+    the live log file was removed.
+
+    param log_file_path: Path to the log file of the JIPipe job
+    """
+    directory = archive_path(log_file_path)
+    if not os.path.exists(log_file_path):
+        return
+    os.makedirs(directory, exist_ok=True)
+
+    segments = _read_index_file(index_path(log_file_path))
+    with open(log_file_path, 'rb') as log_file:
+        size = os.fstat(log_file.fileno()).st_size
+
+        def read_part(offset, length):
+            log_file.seek(offset)
+            return log_file.read(length)
+
+        # Compress the closed segments of the live index
+        for number, segment in enumerate(segments):
+            segment['file'] = f'{number:06d}.log.gz'
+            _write_segment(log_file_path, segment, read_part(segment['offset'], segment['end'] - segment['offset']))
+
+        # Cut the part after the last closed segment into segments at line breaks, one segment in memory at a time
+        now = time.time()
+        offset = segments[-1]['end'] if segments else 0
+        first_line = segments[-1]['first_line'] + segments[-1]['lines'] if segments else 0
+        start_time = segments[-1]['end_time'] if segments else os.path.getmtime(log_file_path)
+        while offset < size:
+            data = read_part(offset, LOG_SEGMENT_BYTES)
+            if not data:
+                break
+            if offset + len(data) < size and data.rfind(b'\n') != -1:
+                data = data[:data.rfind(b'\n') + 1]
+            lines, errors, warnings = _count_levels(data)
+            segment = {
+                'offset': offset, 'end': offset + len(data), 'first_line': first_line, 'lines': lines,
+                'start_time': start_time, 'end_time': now, 'errors': errors, 'warnings': warnings,
+                'file': f'{len(segments):06d}.log.gz',
+            }
+            _write_segment(log_file_path, segment, data)
+            segments.append(segment)
+            offset = segment['end']
+            first_line += lines
+
+    # Publish the index atomically before removing the live log
+    temp_index = os.path.join(directory, 'index.json.part')
+    with open(temp_index, 'w') as index_file:
+        json.dump({'size': offset, 'lines': first_line, 'segments': segments}, index_file)
+    os.replace(temp_index, os.path.join(directory, 'index.json'))
+    os.remove(log_file_path)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(index_path(log_file_path))
+
+
+def _write_segment(log_file_path: str, segment: dict, data: bytes) -> None:
+    with gzip.open(os.path.join(archive_path(log_file_path), segment['file']), 'wb', compresslevel=6) as segment_file:
+        segment_file.write(data)
+
+
+def _load_archive(log_file_path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(archive_path(log_file_path), 'index.json')) as index_file:
+            return json.load(index_file)
+    except FileNotFoundError:
+        return None
+
+
+def _read_segment(log_file_path: str, segment: dict) -> bytes:
+    with gzip.open(os.path.join(archive_path(log_file_path), segment['file']), 'rb') as segment_file:
+        return segment_file.read()
+
+
+def _find_segment(segments: List[dict], cursor: int) -> int:
+    # Index of the segment containing the byte offset
+    return max(bisect.bisect_right([segment['offset'] for segment in segments], cursor) - 1, 0)
+
+
+def read_log_from(log_file_path: str, cursor: int, max_bytes: int = LOG_MAX_CHUNK_BYTES) -> Tuple[List[str], int, bool]:
+    """
+    Read the complete log lines written after the given byte offset.
+    Only complete lines (terminated by a newline) are returned, so a line
+    that is currently being written is delivered with the next call.
+    Returns the new lines, the cursor to continue from and whether more
+    data is available beyond the returned chunk.
+
+    param log_file_path: Path to the log file of the JIPipe job
+    param cursor: Byte offset returned by the previous call (0 for the start of the file)
+    param max_bytes: Maximum number of bytes read in a single call
+    """
+    try:
+        file_handle = open(log_file_path, 'rb')
+    except FileNotFoundError:
+        return _read_archive_from(log_file_path, cursor, max_bytes)
+    with file_handle:
+        # Clamp the cursor to the current file size in case the file was replaced
+        file_size = os.fstat(file_handle.fileno()).st_size
+        if cursor < 0 or cursor > file_size:
+            cursor = 0
+
+        file_handle.seek(cursor)
+        chunk = file_handle.read(max_bytes)
+
+    # Cut the chunk at the last newline to only return complete lines
+    last_newline = chunk.rfind(b'\n')
+    if last_newline == -1:
+        # A single line longer than max_bytes is returned as is to avoid stalling the reader
+        if len(chunk) < max_bytes:
+            return [], cursor, False
+        last_newline = len(chunk) - 1
+    chunk = chunk[:last_newline + 1]
+
+    next_cursor = cursor + len(chunk)
+    log_lines = chunk.decode('utf-8', errors='replace').splitlines()
+    return log_lines, next_cursor, next_cursor < file_size
+
+
+def read_log_tail(log_file_path: str, line_count: int) -> Tuple[List[str], int]:
+    """
+    Read the last complete lines of a log file without reading the whole file.
+    The file is scanned backwards in blocks until enough lines were found.
+    Returns the lines and the cursor pointing behind the last returned line.
+
+    param log_file_path: Path to the log file of the JIPipe job
+    param line_count: Maximum number of lines to return
+    """
+    try:
+        file_handle = open(log_file_path, 'rb')
+    except FileNotFoundError:
+        return _read_archive_tail(log_file_path, line_count)
+    with file_handle:
+        file_size = os.fstat(file_handle.fileno()).st_size
+        position = file_size
+        data = b''
+
+        # Read blocks from the end of the file until enough newlines were collected
+        while position > 0 and data.count(b'\n') <= line_count:
+            read_size = min(LOG_TAIL_BLOCK_BYTES, position)
+            position -= read_size
+            file_handle.seek(position)
+            data = file_handle.read(read_size) + data
+
+    # Only keep complete lines (ignoring a trailing line that is still being written)
+    last_newline = data.rfind(b'\n')
+    if last_newline == -1:
+        return [], position
+    end = position + last_newline + 1
+    log_lines = data[:last_newline + 1].decode('utf-8', errors='replace').splitlines()
+
+    # Drop a possibly partial first line if the scan stopped in the middle of the file
+    if position > 0 and log_lines:
+        log_lines = log_lines[1:]
+    return log_lines[-line_count:] if line_count > 0 else [], end
+
+
+def log_has_exit_marker(log_file_path: str) -> bool:
+    """
+    Check whether the JIPipe exit message was written to the end of the log file.
+    Only the last few bytes are read, so the check does not depend on the log size.
+    Archived logs belong to finished jobs and always count as complete.
+
+    param log_file_path: Path to the log file of the JIPipe job
+    """
+    try:
+        file_handle = open(log_file_path, 'rb')
+    except FileNotFoundError:
+        if _load_archive(log_file_path) is None:
+            raise
+        return True
+    with file_handle:
+        file_size = os.fstat(file_handle.fileno()).st_size
+        file_handle.seek(max(0, file_size - LOG_EXIT_MARKER_BYTES))
+        tail = file_handle.read()
+    return LOG_EXIT_MARKER.encode('utf-8') in tail
+
+
+def _read_archive_from(log_file_path: str, cursor: int, max_bytes: int) -> Tuple[List[str], int, bool]:
+    # Read the lines after the cursor from the segment containing it (segments end at line breaks)
+    archive = _load_archive(log_file_path)
+    if archive is None:
+        raise FileNotFoundError(log_file_path)
+    if cursor < 0 or cursor > archive['size']:
+        cursor = 0
+    if cursor == archive['size'] or not archive['segments']:
+        return [], cursor, False
+
+    segment = archive['segments'][_find_segment(archive['segments'], cursor)]
+    start = cursor - segment['offset']
+    chunk = _read_segment(log_file_path, segment)[start:start + max_bytes]
+    if len(chunk) == max_bytes and b'\n' in chunk:
+        chunk = chunk[:chunk.rfind(b'\n') + 1]
+    next_cursor = cursor + len(chunk)
+    return chunk.decode('utf-8', errors='replace').splitlines(), next_cursor, next_cursor < archive['size']
+
+
+def _read_archive_tail(log_file_path: str, line_count: int) -> Tuple[List[str], int]:
+    # Decompress segments from the end until enough lines were collected
+    archive = _load_archive(log_file_path)
+    if archive is None:
+        raise FileNotFoundError(log_file_path)
+    log_lines = []
+    for segment in reversed(archive['segments']):
+        if len(log_lines) >= line_count:
+            break
+        log_lines = _read_segment(log_file_path, segment).decode('utf-8', errors='replace').splitlines() + log_lines
+    return log_lines[-line_count:] if line_count > 0 else [], archive['size']
+
+
+def search_log(
+    log_file_path: str,
+    level: Optional[str] = None,
+    pattern: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    cursor: int = 0,
+    limit: int = 1000,
+) -> Tuple[List[Dict], int, bool]:
+    """
+    Search a live or archived job log for lines of at least the given level,
+    containing a text and written in the given time range.
+    Segments that cannot match (by their time range or error counts) are
+    skipped without reading them; time ranges are resolved per segment
+    (LOG_SEGMENT_SECONDS). At most LOG_SEARCH_MAX_BYTES are scanned per call.
+    Returns the matches (line number, cursor, level and text), the cursor to
+    continue the search from and whether the log has not been fully searched.
+
+    param log_file_path: Path to the log file of the JIPipe job
+    param level: Minimum level of the returned lines ('info', 'warning' or 'error')
+    param pattern: Text the returned lines must contain (matched literally)
+    param since: Only return lines written after this UNIX timestamp
+    param until: Only return lines written before this UNIX timestamp
+    param cursor: Byte offset to start searching from (returned by the previous call)
+    param limit: Maximum number of matches to return
+    """
+    if level is not None and level not in LOG_LEVELS:
+        raise ValueError(f'Unknown log level: {level}')
+    if pattern is not None and len(pattern) > LOG_SEARCH_MAX_PATTERN:
+        raise ValueError('Search pattern too long')
+    needle = pattern.encode('utf-8') if pattern else None
+    min_level = LOG_LEVELS.index(level) if level else 0
+
+    segments, size, read_segment = _search_segments(log_file_path)
+    matches = []
+    scanned = 0
+    for segment in segments[_find_segment(segments, cursor):] if segments else []:
+        if segment['end'] <= cursor:
+            continue
+        if scanned >= LOG_SEARCH_MAX_BYTES or len(matches) >= limit:
+            return matches, max(cursor, segment['offset']), True
+
+        # Skip segments outside the time range or without lines of the requested level
+        skip = (since is not None and segment['end_time'] < since) or (until is not None and segment['start_time'] > until)
+        if segment.get('errors') is not None:
+            skip = skip or (min_level == 2 and not segment['errors']) or (min_level == 1 and not segment['errors'] + segment['warnings'])
+        if skip:
+            cursor = segment['end']
+            continue
+
+        data = read_segment(segment)
+        scanned += len(data)
+        offset = segment['offset']
+        line_number = segment['first_line']
+        for line in data.splitlines(keepends=True):
+            line_start = offset
+            offset += len(line)
+            if not line.endswith(b'\n') and segment['errors'] is None:
+                # Keep a line that is still being written for the next call
+                offset = line_start
+                break
+            if line_start >= cursor:
+                line_level_name = line_level(line)
+                if LOG_LEVELS.index(line_level_name) >= min_level and (needle is None or needle in line):
+                    matches.append({
+                        'line': line_number,
+                        'cursor': line_start,
+                        'level': line_level_name,
+                        'text': line.decode('utf-8', errors='replace').rstrip('\r\n'),
+                    })
+                    if len(matches) >= limit:
+                        return matches, offset, offset < size
+            line_number += 1
+        cursor = offset
+    return matches, max(cursor, 0), False
+
+
+def _search_segments(log_file_path: str):
+    # Segments of an archived log, or the closed segments of a live log plus its open tail
+    archive = _load_archive(log_file_path)
+    if archive is not None and not os.path.exists(log_file_path):
+        return archive['segments'], archive['size'], lambda segment: _read_segment(log_file_path, segment)
+
+    size = os.path.getsize(log_file_path)
+    segments = [segment for segment in _read_index_file(index_path(log_file_path)) if segment['end'] <= size]
+    tail_offset = segments[-1]['end'] if segments else 0
+    tail = _new_segment(tail_offset, segments[-1]['first_line'] + segments[-1]['lines'] if segments else 0, segments[-1]['end_time'] if segments else 0)
+    tail.update({'end': size, 'end_time': time.time(), 'errors': None, 'warnings': None})
+
+    def read_live_segment(segment):
+        with open(log_file_path, 'rb') as file_handle:
+            file_handle.seek(segment['offset'])
+            return file_handle.read(segment['end'] - segment['offset'])
+
+    return segments + [tail], size, read_live_segment
+
+
+def prune_logs(log_dir: str = LOG_DIR, force: bool = False) -> int:
+    """
+    Enforce the log retention: delete archived logs older than
+    LOG_RETENTION_DAYS, then the oldest archived logs until all archives fit
+    into LOG_RETENTION_BYTES. Plain logs that were never archived (e.g. of
+    jobs whose worker died) are deleted once they were not written for
+    LOG_RETENTION_DAYS; live logs of queued or running jobs are kept.
+    Unless forced, runs at most once per LOG_PRUNE_INTERVAL per directory.
+    Returns the number of deleted logs.
+
+    param log_dir: Directory of the job logs
+    param force: Ignore the prune interval
+    """
+    stamp_path = os.path.join(log_dir, '.last_prune')
+    now = time.time()
+    with contextlib.suppress(FileNotFoundError):
+        if not force and now - os.path.getmtime(stamp_path) < LOG_PRUNE_INTERVAL:
+            return 0
+    with open(stamp_path, 'w'):
+        pass
+
+    archives = []
+    deleted = 0
+    for entry in os.scandir(log_dir):
+        if entry.is_file() and entry.name.endswith('.log'):
+            with contextlib.suppress(FileNotFoundError):
+                if now - entry.stat().st_mtime > LOG_RETENTION_DAYS * 86400:
+                    os.remove(entry.path)
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(index_path(entry.path))
+                    deleted += 1
+            continue
+        if not (entry.is_dir() and entry.name.endswith('.log.d')):
+            continue
+        with contextlib.suppress(FileNotFoundError):
+            modified = os.path.getmtime(os.path.join(entry.path, 'index.json'))
+            size = sum(segment.stat().st_size for segment in os.scandir(entry.path))
+            archives.append((modified, size, entry.path))
+
+    total = sum(size for _, size, _ in archives)
+    for modified, size, path in sorted(archives):
+        if now - modified <= LOG_RETENTION_DAYS * 86400 and total <= LOG_RETENTION_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        deleted += 1
+    return deleted
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from JIPipeRunner.job_history import flush_job_history
+
+
+class Command(BaseCommand):
+    """
+    Write all pending job state changes to the job history.
+
+    Usage: python manage.py jipipe_flush_history
+    """
+    help = 'Write the pending JIPipe job state changes from Redis to the job history in the database'
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            flushed = flush_job_history()
+            if not flushed:
+                break
+            total += flushed
+        self.stdout.write(f'Wrote {total} job state change(s) to the job history')
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from JIPipeRunner.fingerprints import invalidate_fingerprint, iter_fingerprints
+
+
+class Command(BaseCommand):
+    """
+    Invalidate memoized JIPipe results so identical submissions run again.
+
+    Usage: python manage.py jipipe_invalidate_results (--all | --user <name> | --fingerprint <hash> | --job <uuid>)
+    """
+    help = 'Invalidate memoized JIPipe job results'
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('--all', action='store_true', help='Invalidate all memoized results')
+        group.add_argument('--user', help='Invalidate all memoized results of an OMERO user')
+        group.add_argument('--fingerprint', help='Invalidate a single fingerprint')
+        group.add_argument('--job', help='Invalidate the fingerprint held by a job UUID')
+
+    def handle(self, *args, **options):
+        if options['fingerprint']:
+            if not invalidate_fingerprint(options['fingerprint']):
+                raise CommandError(f"Fingerprint not found: {options['fingerprint']}")
+            self.stdout.write('Invalidated 1 result')
+            return
+
+        # Select the fingerprints to invalidate by owner, job or all of them
+        invalidated = 0
+        for fingerprint, holder in iter_fingerprints():
+            if options['user'] and holder.get('owner') != options['user']:
+                continue
+            if options['job'] and holder.get('job_uuid') != options['job']:
+                continue
+            invalidated += invalidate_fingerprint(fingerprint)
+        self.stdout.write(f'Invalidated {invalidated} result(s)')
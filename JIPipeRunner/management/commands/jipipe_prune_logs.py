@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from JIPipeRunner.logs import LOG_DIR, prune_logs
+
+
+class Command(BaseCommand):
+    """
+    Enforce the retention of archived JIPipe job logs.
+
+    Usage: python manage.py jipipe_prune_logs
+    """
+    help = 'Delete archived JIPipe job logs beyond the configured age and size limits'
+
+    def handle(self, *args, **options):
+        deleted = prune_logs(LOG_DIR, force=True)
+        self.stdout.write(f'Deleted {deleted} archived log(s)')
@@ -0,0 +1,256 @@
+import contextlib
+import functools
+import logging
+import os
+import time
+from typing import Dict, Iterator, Optional
+
+from django.conf import settings
+
+from JIPipeRunner.fair_share import PENDING_JOBS_KEY, PRIORITY_QUEUES, dispatched_jobs
+from JIPipeRunner.nodes import alive_nodes
+from JIPipeRunner.redis_client import get_redis
+from JIPipeRunner.registry import active_jobs_key
+
+# Prometheus and OpenTelemetry are optional, without them all instrumentation is a no-op
+try:
+    import prometheus_client
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:
+    prometheus_client = None
+
+try:
+    from opentelemetry import propagate, trace
+except ImportError:
+    trace = None
+
+# Bearer token required to scrape the metrics endpoint (None == endpoint disabled)
+METRICS_TOKEN: Optional[str] = getattr(settings, 'JIPIPE_METRICS_TOKEN', None)
+
+# Port of a metrics endpoint served by each Celery worker host (None == only via the web endpoint)
+METRICS_WORKER_PORT: Optional[int] = getattr(settings, 'JIPIPE_METRICS_WORKER_PORT', None)
+
+# Intialize the logger
+logger = logging.getLogger(__name__)
+
+# Latency buckets (in seconds) of requests and job phases
+_REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_PHASE_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 300, 900, 1800, 3600, 4 * 3600, 12 * 3600)
+_CALL_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class _NoOpMetric:
+    # Stand-in for Prometheus metrics when prometheus_client is not installed
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+if prometheus_client is not None:
+    REQUEST_SECONDS = prometheus_client.Histogram(
+        'jipipe_request_seconds', 'Latency of the JIPipeRunner endpoints', ['view'], buckets=_REQUEST_BUCKETS)
+    OMERO_CALLS = prometheus_client.Histogram(
+        'jipipe_omero_calls_per_request', 'OMERO gateway and service calls per request', ['view'], buckets=_CALL_BUCKETS)
+    JOB_PHASE_SECONDS = prometheus_client.Histogram(
+        'jipipe_job_phase_seconds', 'Time spent by jobs in each phase', ['phase'], buckets=_PHASE_BUCKETS)
+    JOBS_FINISHED = prometheus_client.Counter(
+        'jipipe_jobs_finished', 'Jobs finished on the workers by final state', ['state'])
+    LOG_BYTES = prometheus_client.Counter(
+        'jipipe_log_bytes', 'Bytes written to job logs')
+    CANCEL_SECONDS = prometheus_client.Histogram(
+        'jipipe_cancel_seconds', 'Time from a cancel request until the worker slot of the job was free', buckets=_REQUEST_BUCKETS + (30, 60))
+else:
+    REQUEST_SECONDS = OMERO_CALLS = JOB_PHASE_SECONDS = JOBS_FINISHED = LOG_BYTES = CANCEL_SECONDS = _NoOpMetric()
+
+
+class _RegistryCollector:
+    """
+    Collects the queue depths, the dispatched jobs and the active jobs per user from Redis at scrape time.
+    """
+
+    def collect(self):
+        redis_client = get_redis()
+        queue_depth = GaugeMetricFamily('jipipe_queue_depth', 'Tasks waiting in the Celery queues', labels=['queue'])
+        for queue in PRIORITY_QUEUES.values():
+            queue_depth.add_metric([queue], redis_client.llen(queue))
+        yield queue_depth
+
+        pending_jobs = GaugeMetricFamily('jipipe_pending_jobs', 'Jobs waiting in the fair-share queues')
+        pending_jobs.add_metric([], redis_client.hlen(PENDING_JOBS_KEY))
+        yield pending_jobs
+
+        dispatched = GaugeMetricFamily('jipipe_dispatched_jobs', 'Jobs handed to Celery per priority class', labels=['priority'])
+        counts = {priority: 0 for priority in PRIORITY_QUEUES}
+        for job in dispatched_jobs().values():
+            counts[job['priority']] = counts.get(job['priority'], 0) + 1
+        for priority, count in counts.items():
+            dispatched.add_metric([priority], count)
+        yield dispatched
+
+        nodes = GaugeMetricFamily('jipipe_worker_nodes', 'Worker nodes with a recent heartbeat')
+        nodes.add_metric([], len(alive_nodes()))
+        yield nodes
+
+        active_jobs = GaugeMetricFamily('jipipe_active_jobs', 'Queued and running jobs per user', labels=['user'])
+        prefix = active_jobs_key('')
+        for key in redis_client.scan_iter(match=f'{prefix}*'):
+            active_jobs.add_metric([key.decode('utf-8')[len(prefix):]], redis_client.scard(key))
+        yield active_jobs
+
+
+def metrics_registry(include_jobs: bool = True):
+    """
+    Get the registry exported by the metrics endpoint: the metrics of all
+    processes of this host if PROMETHEUS_MULTIPROC_DIR is set (web and worker
+    processes), else of this process, plus the job registry in Redis.
+
+    param include_jobs: Export the job registry in Redis (queue depths and active jobs per user)
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        from prometheus_client import multiprocess
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.CollectorRegistry()
+        registry.register(prometheus_client.REGISTRY)
+    if include_jobs:
+        registry.register(_RegistryCollector())
+    return registry
+
+
+def start_worker_metrics_server() -> None:
+    """
+    Serve the metrics of this worker host on JIPIPE_METRICS_WORKER_PORT, for
+    workers that do not share a host (and PROMETHEUS_MULTIPROC_DIR) with the web server.
+    The port has no authentication, so the job registry (which names users)
+    is only exported by the web endpoint.
+    """
+    if prometheus_client is None or METRICS_WORKER_PORT is None:
+        return
+    prometheus_client.start_http_server(int(METRICS_WORKER_PORT), registry=metrics_registry(include_jobs=False))
+
+
+class CountingConnection:
+    """
+    Proxy of an OMERO connection that counts the calls made through it,
+    including calls on the services it returns (query, update, ...).
+    """
+
+    def __init__(self, conn, counter: Optional[Dict[str, int]] = None):
+        self._conn = conn
+        self._counter = counter if counter is not None else {'calls': 0}
+
+    @property
+    def call_count(self) -> int:
+        return self._counter['calls']
+
+    def __getattr__(self, name):
+        attribute = getattr(self._conn, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def counted(*args, **kwargs):
+            self._counter['calls'] += 1
+            result = attribute(*args, **kwargs)
+            if name.startswith('get') and name.endswith('Service'):
+                return CountingConnection(result, self._counter)
+            return result
+
+        return counted
+
+
+def instrument_view(view):
+    """
+    Record the latency and the number of OMERO calls of a view.
+    Must be applied below login_required, which provides the connection.
+    With OpenTelemetry installed, the view runs in a span, so jobs it
+    submits are linked to the request (see current_trace_context).
+    """
+    view_name = view.__name__
+
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        conn = kwargs.get('conn')
+        if conn is not None:
+            kwargs['conn'] = conn = CountingConnection(conn)
+        started = time.perf_counter()
+        try:
+            with _span(f'jipipe.{view_name}'):
+                return view(request, *args, **kwargs)
+        finally:
+            REQUEST_SECONDS.labels(view_name).observe(time.perf_counter() - started)
+            if conn is not None:
+                OMERO_CALLS.labels(view_name).observe(conn.call_count)
+
+    return wrapped
+
+
+@contextlib.contextmanager
+def _span(name: str, context=None, **attributes) -> Iterator[None]:
+    if trace is None:
+        yield
+        return
+    with trace.get_tracer('JIPipeRunner').start_as_current_span(name, context=context, attributes=attributes):
+        yield
+
+
+def current_trace_context() -> Optional[Dict[str, str]]:
+    """
+    Serialize the current trace context to pass it to a Celery task
+    (None without OpenTelemetry).
+    """
+    if trace is None:
+        return None
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier or None
+
+
+@contextlib.contextmanager
+def job_span(job_uuid: str, trace_context: Optional[Dict[str, str]]) -> Iterator[None]:
+    """
+    Run a job in a span that continues the trace of the request that submitted it.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param trace_context: Trace context created by current_trace_context
+    """
+    if trace is None:
+        yield
+        return
+    with _span('jipipe.run_job', context=propagate.extract(trace_context or {}), job_uuid=job_uuid):
+        yield
+
+
+class PhaseTimer:
+    """
+    Records the duration of consecutive job phases. Each phase ends when it
+    is marked and the next one starts; marking a phase again is ignored.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.marked = set()
+
+    def mark(self, phase: str) -> None:
+        if phase in self.marked:
+            return
+        now = time.monotonic()
+        JOB_PHASE_SECONDS.labels(phase).observe(now - self.started)
+        self.marked.add(phase)
+        self.started = now
+
+
+def observe_queue_wait(submitted_at: Optional[str]) -> None:
+    """
+    Record the time a job waited between submission and start.
+
+    param submitted_at: Submission time from the job registry (UNIX timestamp)
+    """
+    if submitted_at:
+        JOB_PHASE_SECONDS.labels('queue_wait').observe(max(time.time() - float(submitted_at), 0))
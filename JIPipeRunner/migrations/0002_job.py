@@ -0,0 +1,71 @@
+# Generated by Django 5.1.4 on 2026-10-17 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("JIPipeRunner", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Job",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(editable=False, primary_key=True, serialize=False),
+                ),
+                ("owner", models.CharField(max_length=255)),
+                ("pipeline", models.CharField(blank=True, default="", max_length=255)),
+                ("jip_file_id", models.BigIntegerField(blank=True, null=True)),
+                ("fingerprint", models.CharField(blank=True, default="", max_length=64)),
+                ("batch_id", models.CharField(blank=True, default="", max_length=64)),
+                ("dataset_id", models.BigIntegerField(blank=True, null=True)),
+                ("priority", models.CharField(blank=True, default="", max_length=16)),
+                ("memory_gb", models.PositiveIntegerField(blank=True, null=True)),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("finished", "Finished"),
+                            ("failed", "Failed"),
+                            ("cancelled", "Cancelled"),
+                        ],
+                        default="queued",
+                        max_length=16,
+                    ),
+                ),
+                ("submitted_at", models.DateTimeField()),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("ended_at", models.DateTimeField(blank=True, null=True)),
+                ("exit_code", models.IntegerField(blank=True, null=True)),
+                ("worker", models.CharField(blank=True, default="", max_length=255)),
+                ("node", models.CharField(blank=True, default="", max_length=255)),
+                ("results_project_id", models.BigIntegerField(blank=True, null=True)),
+                ("log_file", models.CharField(blank=True, default="", max_length=1024)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["owner", "-submitted_at", "-id"],
+                        name="jipipe_job_owner_time",
+                    ),
+                    models.Index(
+                        fields=["owner", "state", "-submitted_at"],
+                        name="jipipe_job_owner_state",
+                    ),
+                    models.Index(
+                        fields=["state", "-submitted_at"],
+                        name="jipipe_job_state_time",
+                    ),
+                    models.Index(
+                        fields=["fingerprint"], name="jipipe_job_fingerprint"
+                    ),
+                ],
+            },
+        ),
+    ]
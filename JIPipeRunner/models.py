@@ -8,3 +8,47 @@ class IDs(models.Model):
     def __str__(self):
         return str(self.id_list_field)
 
+
+class Job(models.Model):
+    """
+    History record of a JIPipe job. The job registry in Redis holds the live
+    state of active jobs; its changes are written here in batches (see
+    job_history), so past runs can be queried without scanning the logs.
+    """
+    STATES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('finished', 'Finished'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    owner = models.CharField(max_length=255)
+    pipeline = models.CharField(max_length=255, blank=True, default='')
+    jip_file_id = models.BigIntegerField(null=True, blank=True)
+    fingerprint = models.CharField(max_length=64, blank=True, default='')
+    batch_id = models.CharField(max_length=64, blank=True, default='')
+    dataset_id = models.BigIntegerField(null=True, blank=True)
+    priority = models.CharField(max_length=16, blank=True, default='')
+    memory_gb = models.PositiveIntegerField(null=True, blank=True)
+    state = models.CharField(max_length=16, choices=STATES, default='queued')
+    submitted_at = models.DateTimeField()
+    started_at = models.DateTimeField(null=True, blank=True)
+    ended_at = models.DateTimeField(null=True, blank=True)
+    exit_code = models.IntegerField(null=True, blank=True)
+    worker = models.CharField(max_length=255, blank=True, default='')
+    node = models.CharField(max_length=255, blank=True, default='')
+    results_project_id = models.BigIntegerField(null=True, blank=True)
+    log_file = models.CharField(max_length=1024, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', '-submitted_at', '-id'], name='jipipe_job_owner_time'),
+            models.Index(fields=['owner', 'state', '-submitted_at'], name='jipipe_job_owner_state'),
+            models.Index(fields=['state', '-submitted_at'], name='jipipe_job_state_time'),
+            models.Index(fields=['fingerprint'], name='jipipe_job_fingerprint'),
+        ]
+
+    def __str__(self):
+        return f'{self.id} ({self.owner}, {self.state})'
@@ -0,0 +1,157 @@
+import json
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from django.conf import settings
+
+from JIPipeRunner.fingerprints import JIPIPE_VERSION
+from JIPipeRunner.redis_client import get_redis
+from JIPipeRunner.scheduler import JOB_CPUS, NODE_NAME, WORKER_CPUS, WORKER_MEMORY_GB, host_reservations_key
+
+# Seconds between two heartbeats of a worker node, and without heartbeat after which a node is considered lost
+HEARTBEAT_SECONDS = getattr(settings, 'JIPIPE_NODE_HEARTBEAT_SECONDS', 10)
+NODE_TIMEOUT = getattr(settings, 'JIPIPE_NODE_TIMEOUT', 60)
+
+# Directory for the temporary job folders of this node
+SCRATCH_DIR = getattr(settings, 'JIPIPE_SCRATCH_DIR', tempfile.gettempdir())
+
+# ImageJ launcher of this node (None == omero.web.imagej from the OMERO configuration)
+IMAGEJ_PATH: Optional[str] = getattr(settings, 'JIPIPE_IMAGEJ_PATH', None)
+
+NODES_KEY = 'jipipe_nodes'
+HEARTBEATS_KEY = 'jipipe_node_heartbeats'
+
+# Intialize the logger
+logger = logging.getLogger(__name__)
+
+
+def node_queue(node: str, priority: str) -> str:
+    return f'jipipe_node_{node}_{priority}'
+
+
+def node_priorities_key(node: str) -> str:
+    return f'jipipe_node_priorities_{node}'
+
+
+def node_capacity() -> Dict:
+    """
+    Get the capacity of this worker node: cores and memory that may be
+    committed to jobs, free scratch space and the installed JIPipe version.
+    """
+    return {
+        'cpus': WORKER_CPUS,
+        'memory_gb': WORKER_MEMORY_GB,
+        'scratch_free_gb': round(shutil.disk_usage(SCRATCH_DIR).free / 1024 ** 3, 1),
+        'jipipe_version': JIPIPE_VERSION,
+    }
+
+
+def register_node(priorities: Iterable[str]) -> None:
+    """
+    Store the capacity of this worker node and record a heartbeat for the
+    node and for every priority class its worker serves. Several workers
+    (e.g. one per priority class) may share a node.
+
+    param priorities: Priority classes whose node queues the worker consumes
+    """
+    now = time.time()
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.hset(NODES_KEY, NODE_NAME, json.dumps({**node_capacity(), 'heartbeat': now}))
+    pipe.zadd(HEARTBEATS_KEY, {NODE_NAME: now})
+    for priority in priorities:
+        pipe.zadd(node_priorities_key(NODE_NAME), {priority: now})
+    pipe.execute()
+
+
+def start_heartbeat(priorities: Iterable[str], on_heartbeat: Optional[Callable[[], None]] = None) -> threading.Thread:
+    """
+    Register this worker node and keep its heartbeat alive in a background thread.
+
+    param priorities: Priority classes whose node queues the worker consumes
+    param on_heartbeat: Called after every heartbeat (e.g. to requeue the jobs of lost nodes)
+    """
+    priorities = list(priorities)
+
+    def beat():
+        while True:
+            try:
+                register_node(priorities)
+                if on_heartbeat is not None:
+                    on_heartbeat()
+            except Exception:
+                logger.exception('Failed to send the heartbeat of JIPipe worker node %s', NODE_NAME)
+            time.sleep(HEARTBEAT_SECONDS)
+
+    thread = threading.Thread(target=beat, name='jipipe-node-heartbeat', daemon=True)
+    thread.start()
+    return thread
+
+
+def alive_nodes() -> Dict[str, Dict]:
+    """
+    Get the capacity of all worker nodes with a recent heartbeat, including
+    the priority classes served by a worker of the node ('priorities').
+    """
+    redis_client = get_redis()
+    since = time.time() - NODE_TIMEOUT
+    names = redis_client.zrangebyscore(HEARTBEATS_KEY, since, '+inf')
+    if not names:
+        return {}
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hmget(NODES_KEY, names)
+    for name in names:
+        pipe.zrangebyscore(node_priorities_key(name.decode('utf-8')), since, '+inf')
+    capacities, *priorities = pipe.execute()
+    return {
+        name.decode('utf-8'): {**json.loads(capacity), 'priorities': [priority.decode('utf-8') for priority in served]}
+        for name, capacity, served in zip(names, capacities, priorities)
+        if capacity is not None
+    }
+
+
+def lost_nodes() -> List[str]:
+    """
+    Get the names of the worker nodes whose heartbeat stopped.
+    """
+    names = get_redis().zrangebyscore(HEARTBEATS_KEY, '-inf', f'({time.time() - NODE_TIMEOUT}')
+    return [name.decode('utf-8') for name in names]
+
+
+def forget_node(node: str) -> None:
+    """
+    Remove a lost worker node and its reservations from the registry.
+
+    param node: Name of the worker node
+    """
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.zrem(HEARTBEATS_KEY, node)
+    pipe.hdel(NODES_KEY, node)
+    pipe.delete(host_reservations_key(node), node_priorities_key(node))
+    pipe.execute()
+
+
+def choose_node(nodes: Dict[str, Dict], load: Dict[str, Dict], memory_gb: int, priority: str) -> Optional[str]:
+    """
+    Choose the worker node for a job among the nodes serving its priority
+    class: the node with enough uncommitted memory and cores that has the
+    most free memory. If no node has capacity, the least loaded node is
+    chosen and the job waits there. Returns None if no node serves the class.
+
+    param nodes: Capacity of the alive worker nodes (see alive_nodes)
+    param load: Memory and cores of the jobs already routed to each node
+    param memory_gb: JVM heap of the job in GB
+    param priority: Priority class of the job
+    """
+    candidates = []
+    for name in nodes:
+        if priority not in nodes[name]['priorities']:
+            continue
+        free_memory = nodes[name]['memory_gb'] - load.get(name, {}).get('memory_gb', 0)
+        free_cpus = nodes[name]['cpus'] - load.get(name, {}).get('cpus', 0)
+        fits = free_memory >= memory_gb and free_cpus >= JOB_CPUS
+        candidates.append(((fits, free_memory), name))
+    return max(candidates)[1] if candidates else None
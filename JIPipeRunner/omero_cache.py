@@ -0,0 +1,162 @@
+from typing import Dict, List
+
+import omero.model
+from django.conf import settings
+from django.core.cache import cache
+from omero.rtypes import rstring
+
+from JIPipeRunner.redis_client import get_redis
+
+# Time (in seconds) to keep the user context (name, current group, group memberships) of an OMERO session
+USER_CONTEXT_TIMEOUT = getattr(settings, 'JIPIPE_USER_CONTEXT_TIMEOUT', 300)
+
+# Time (in seconds) to keep the ID of the results project of a user and group
+RESULTS_PROJECT_TIMEOUT = getattr(settings, 'JIPIPE_RESULTS_PROJECT_TIMEOUT', 24 * 60 * 60)
+
+# Name and description of the project JIPipe results are stored in
+RESULTS_PROJECT_NAME = 'JIPipeResults'
+RESULTS_PROJECT_DESCRIPTION = 'Project to save all JIPipe results'
+
+# Time (in seconds) a results project creation may hold its lock, and wait for it
+_CREATE_LOCK_TIMEOUT = 30
+
+
+def _user_context_key(session_key: str) -> str:
+    return f'jipipe_user_context_{session_key}'
+
+
+def _results_project_key(user_id: int, group_id: int) -> str:
+    return f'jipipe_results_project_{user_id}_{group_id}'
+
+
+def _missing_project_key(project_id: int) -> str:
+    return f'jipipe_missing_results_project_{project_id}'
+
+
+def user_context(conn) -> Dict:
+    """
+    Get the name, ID, current group and group memberships of the user of an
+    OMERO connection. The context is cached per OMERO session for
+    JIPIPE_USER_CONTEXT_TIMEOUT seconds, so endpoints do not query it again.
+    It is loaded again once the user works in a group missing from the cached
+    memberships, since the memberships changed.
+
+    param conn: OMERO connection object of the web request
+    """
+    key = _user_context_key(conn._getSessionId())
+    context = cache.get(key)
+    group_id = conn.SERVICE_OPTS.getOmeroGroup()
+    if context is not None and group_id is not None and int(group_id) >= 0 and int(group_id) not in context['member_of_groups']:
+        invalidate_user_metadata(conn)
+        context = None
+    if context is None:
+        event_context = conn.getEventContext()
+        context = {
+            'name': event_context.userName,
+            'user_id': event_context.userId,
+            'group_id': event_context.groupId,
+            'member_of_groups': list(event_context.memberOfGroups),
+        }
+        cache.set(key, context, timeout=USER_CONTEXT_TIMEOUT)
+    return context
+
+
+def owner_name(conn) -> str:
+    """
+    Get the name of the OMERO user of a connection (cached, see user_context).
+
+    param conn: OMERO connection object of the web request
+    """
+    return user_context(conn)['name']
+
+
+def member_of_groups(conn) -> List[int]:
+    """
+    Get the IDs of the groups the OMERO user of a connection is a member of (cached, see user_context).
+
+    param conn: OMERO connection object of the web request
+    """
+    return user_context(conn)['member_of_groups']
+
+
+def current_group_id(conn) -> int:
+    """
+    Get the ID of the OMERO group the user of a connection currently works in (cached, see user_context).
+
+    param conn: OMERO connection object of the web request
+    """
+    return _current_group_id(conn, user_context(conn))
+
+
+def results_project_id(conn) -> int:
+    """
+    Get the ID of the JIPipeResults project of the user in the current
+    group, creating the project if it does not exist. The ID is cached per
+    user and group. Creation holds a Redis lock and checks for the project
+    again after acquiring it, so concurrent first submissions of a user
+    create a single project. A cached project reported missing (see
+    forget_results_project) is looked up again.
+
+    param conn: OMERO connection object of the web request
+    """
+    context = user_context(conn)
+    key = _results_project_key(context['user_id'], _current_group_id(conn, context))
+    project_id = cache.get(key)
+    if project_id is not None and not cache.get(_missing_project_key(project_id)):
+        return project_id
+
+    project_id = _find_results_project(conn)
+    if project_id is None:
+        with get_redis().lock(f'{key}_lock', timeout=_CREATE_LOCK_TIMEOUT, blocking_timeout=_CREATE_LOCK_TIMEOUT):
+            project_id = _find_results_project(conn)
+            if project_id is None:
+                project_id = _create_results_project(conn)
+
+    cache.set(key, project_id, timeout=RESULTS_PROJECT_TIMEOUT)
+    return project_id
+
+
+def invalidate_user_metadata(conn) -> None:
+    """
+    Remove the cached user context and results project of the user of a
+    connection, e.g. after the results project was deleted or the group
+    memberships changed.
+
+    param conn: OMERO connection object of the web request
+    """
+    context = cache.get(_user_context_key(conn._getSessionId()))
+    if context is not None:
+        cache.delete(_results_project_key(context['user_id'], _current_group_id(conn, context)))
+    cache.delete(_user_context_key(conn._getSessionId()))
+
+
+def forget_results_project(project_id: int) -> None:
+    """
+    Report a results project as missing (e.g. deleted by its user), so the
+    next submission looks the project up again instead of using the cached ID.
+    Used by the workers, which do not know the user and group of the cache entry.
+
+    param project_id: ID of the missing results project
+    """
+    cache.set(_missing_project_key(project_id), True, timeout=RESULTS_PROJECT_TIMEOUT)
+
+
+def _current_group_id(conn, context: Dict) -> int:
+    # The group selected in OMERO.web is set on the connection, the cached default group is the fallback
+    group_id = conn.SERVICE_OPTS.getOmeroGroup()
+    if group_id is None or int(group_id) < 0:
+        return context['group_id']
+    return int(group_id)
+
+
+def _find_results_project(conn):
+    project = conn.getObject('Project', attributes={'name': RESULTS_PROJECT_NAME})
+    return int(project.getId()) if project else None
+
+
+def _create_results_project(conn) -> int:
+    project = omero.model.ProjectI()
+    project.setName(rstring(RESULTS_PROJECT_NAME))
+    project.setDescription(rstring(RESULTS_PROJECT_DESCRIPTION))
+    saved_project = conn.getUpdateService().saveAndReturnObject(project, conn.SERVICE_OPTS)
+    return int(saved_project.getId().getValue())
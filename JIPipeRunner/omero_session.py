@@ -0,0 +1,186 @@
+import json
+import logging
+from typing import Optional
+
+from django.conf import settings
+
+from JIPipeRunner.redis_client import get_redis
+
+# omero-py is only needed to close and keep alive job sessions, the web views create them through their own connection
+try:
+    from omero.gateway import BlitzGateway
+except ImportError:
+    BlitzGateway = None
+
+# Time (in seconds) the OMERO session created for jobs stays valid, it must cover the time jobs wait in the queue
+JOB_SESSION_TTL = getattr(settings, 'JIPIPE_JOB_SESSION_TTL', 24 * 60 * 60)
+
+# Time (in seconds) without activity after which OMERO closes a job session. Running workers keep the sessions
+# of queued jobs alive, so this mostly ends sessions that are no longer tracked in Redis
+JOB_SESSION_IDLE = getattr(settings, 'JIPIPE_JOB_SESSION_IDLE', 30 * 60)
+
+# Number of jobs using each job session, and the host and port of each session (by session key)
+JOB_SESSION_REFS_KEY = 'jipipe_job_session_refs'
+JOB_SESSIONS_KEY = 'jipipe_job_sessions'
+
+# Held by the worker that keeps the job sessions alive, so only one worker does it per period
+SESSION_KEEPALIVE_LOCK_KEY = 'jipipe_job_session_keepalive'
+
+# Intialize the logger
+logger = logging.getLogger(__name__)
+
+
+def job_session_key(job_uuid: str) -> str:
+    return f'jipipe_job_session_{job_uuid}'
+
+
+def session_info(conn) -> dict:
+    """
+    Create an OMERO session of the current web user for its jobs and get the
+    information a Celery worker needs to join it (host, port and session key).
+    The session lives for JIPIPE_JOB_SESSION_TTL seconds at most, so it does
+    not expire with the web session while jobs wait in the queue, and is
+    closed when the last job using it ends (see release_job_session). Falls
+    back to the web session if the server refuses to create one; that
+    session is never closed by the jobs.
+
+    param conn: OMERO connection object of the web request
+    """
+    try:
+        session = conn.getSessionService().createUserSession(
+            JOB_SESSION_TTL * 1000, JOB_SESSION_IDLE * 1000, conn.getGroupFromContext().getName())
+        session_key = session.getUuid().val
+        owned = True
+    except Exception:
+        logger.exception('Failed to create an OMERO session for JIPipe jobs, using the web session')
+        session_key = conn._getSessionId()
+        owned = False
+    return {
+        'host': conn.host,
+        'port': conn.port,
+        'session_key': session_key,
+        'owned': owned,
+    }
+
+
+def store_job_session(job_uuid: str, omero_session: dict) -> None:
+    """
+    Keep the OMERO session of a job in Redis until the job runs, so the
+    session key is not part of the task message in the broker, and count
+    the job as a user of the session.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param omero_session: Session information created by session_info
+    """
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.set(job_session_key(job_uuid), json.dumps(omero_session), ex=JOB_SESSION_TTL)
+    if omero_session.get('owned'):
+        session_key = omero_session['session_key']
+        pipe.hincrby(JOB_SESSION_REFS_KEY, session_key, 1)
+        pipe.hset(JOB_SESSIONS_KEY, session_key, json.dumps({'host': omero_session['host'], 'port': omero_session['port']}))
+    pipe.execute()
+
+
+def job_session(job_uuid: str) -> Optional[dict]:
+    """
+    Get the OMERO session stored for a job (see store_job_session), or None if there is none.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    """
+    value = get_redis().get(job_session_key(job_uuid))
+    return json.loads(value) if value is not None else None
+
+
+def release_job_session(job_uuid: str) -> None:
+    """
+    Forget the OMERO session of a job that finished, failed or was cancelled,
+    and close the session once no other job of the same submission uses it.
+    Releasing a job twice has no effect.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    """
+    redis_client = get_redis()
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.get(job_session_key(job_uuid))
+    pipe.delete(job_session_key(job_uuid))
+    value, _ = pipe.execute()
+    if value is None:
+        return
+    omero_session = json.loads(value)
+    if not omero_session.get('owned'):
+        return
+    session_key = omero_session['session_key']
+    if redis_client.hincrby(JOB_SESSION_REFS_KEY, session_key, -1) > 0:
+        return
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hdel(JOB_SESSION_REFS_KEY, session_key)
+    pipe.hdel(JOB_SESSIONS_KEY, session_key)
+    pipe.execute()
+    close_session(omero_session)
+
+
+def close_session(omero_session: dict) -> None:
+    """
+    Close an OMERO session created by session_info. Failures are logged,
+    the session then ends after JIPIPE_JOB_SESSION_IDLE seconds.
+
+    param omero_session: Session information created by session_info
+    """
+    conn = _join(omero_session)
+    if conn is None:
+        return
+    try:
+        service = conn.getSessionService()
+        service.closeSession(service.getSession(omero_session['session_key']))
+    except Exception:
+        logger.exception('Failed to close the OMERO session of JIPipe jobs')
+    finally:
+        _detach(conn)
+
+
+def keep_job_sessions_alive() -> None:
+    """
+    Keep the OMERO sessions of queued and running jobs from reaching their
+    idle timeout. Called on every worker heartbeat; only one worker touches
+    the sessions per third of JIPIPE_JOB_SESSION_IDLE. Sessions that can no
+    longer be joined (e.g. they reached JIPIPE_JOB_SESSION_TTL) are forgotten.
+    """
+    redis_client = get_redis()
+    if BlitzGateway is None or not redis_client.set(SESSION_KEEPALIVE_LOCK_KEY, 1, nx=True, ex=max(JOB_SESSION_IDLE // 3, 1)):
+        return
+    for session_key, value in redis_client.hgetall(JOB_SESSIONS_KEY).items():
+        session_key = session_key.decode('utf-8')
+        conn = _join({**json.loads(value), 'session_key': session_key})
+        if conn is None:
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.hdel(JOB_SESSION_REFS_KEY, session_key)
+            pipe.hdel(JOB_SESSIONS_KEY, session_key)
+            pipe.execute()
+            continue
+        try:
+            conn.keepAlive()
+        except Exception:
+            logger.exception('Failed to keep the OMERO session of JIPipe jobs alive')
+        finally:
+            _detach(conn)
+
+
+def _join(omero_session: dict):
+    # Join a session with a new connection, None if omero-py is missing or the session is gone
+    if BlitzGateway is None:
+        return None
+    conn = BlitzGateway(host=omero_session['host'], port=omero_session['port'])
+    try:
+        if conn.connect(sUuid=omero_session['session_key']):
+            return conn
+    except Exception:
+        logger.exception('Failed to join the OMERO session of JIPipe jobs')
+    return None
+
+
+def _detach(conn) -> None:
+    # Drop the connection without closing the session it joined
+    try:
+        conn.close(hard=False)
+    except Exception:
+        logger.exception('Failed to detach from the OMERO session of JIPipe jobs')
@@ -0,0 +1,97 @@
+import logging
+import re
+import time
+from typing import Dict, Optional
+
+from JIPipeRunner.logs import line_level
+from JIPipeRunner.registry import update_job
+
+# Minimum time (in seconds) between two progress updates of a job in the registry
+PROGRESS_UPDATE_SECONDS = 2
+
+# Progress counter printed by JIPipe in front of its log messages, e.g. "<12/40> Run | Gaussian blur | ..."
+_PROGRESS_PATTERN = re.compile(r'[<\[](\d+)/(\d+)[>\]]\s*(.*)')
+
+# Longest error message kept in the status record
+_MAX_ERROR_LENGTH = 300
+
+# Intialize the logger
+logger = logging.getLogger(__name__)
+
+
+def parse_progress_line(line: str) -> Optional[Dict]:
+    """
+    Parse the progress counter and the current node from a JIPipe log line.
+    Returns None for lines without a progress counter.
+
+    param line: Log line printed by JIPipe
+    """
+    match = _PROGRESS_PATTERN.search(line)
+    if match is None:
+        return None
+    done, total, message = int(match.group(1)), int(match.group(2)), match.group(3)
+
+    # Messages are "<runner> | <node> | <details>", the node is the second part if there is one
+    parts = [part.strip() for part in message.split('|') if part.strip()]
+    node = parts[1] if len(parts) > 1 else (parts[0] if parts else '')
+    return {'done': done, 'total': total, 'node': node}
+
+
+class ProgressTracker:
+    """
+    Extracts a compact status record (completed and total steps, percentage,
+    current node, number of error lines and the last error) from the output
+    of a running job and stores it in the job registry, at most every
+    PROGRESS_UPDATE_SECONDS seconds.
+    """
+
+    def __init__(self, job_uuid: str):
+        self.job_uuid = job_uuid
+        self.status = {
+            'progress_done': 0,
+            'progress_total': 0,
+            'progress_percent': 0.0,
+            'current_node': '',
+            'error_count': 0,
+            'last_error': '',
+        }
+        self.changed = False
+        self.last_update = 0.0
+
+    def feed(self, text: str) -> None:
+        """
+        Parse a batch of output lines and update the registry if the last update is old enough.
+        """
+        for line in text.splitlines():
+            if line_level(line.encode('utf-8')) == 'error':
+                self.status['error_count'] += 1
+                self.status['last_error'] = line.strip()[:_MAX_ERROR_LENGTH]
+                self.changed = True
+                continue
+
+            progress = parse_progress_line(line)
+            if progress is None or progress['total'] <= 0:
+                continue
+            self.status['progress_done'] = progress['done']
+            self.status['progress_total'] = progress['total']
+            self.status['progress_percent'] = round(100.0 * min(progress['done'], progress['total']) / progress['total'], 1)
+            if progress['node']:
+                self.status['current_node'] = progress['node']
+            self.changed = True
+
+        if self.changed and time.monotonic() - self.last_update >= PROGRESS_UPDATE_SECONDS:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Store the current status record in the registry if it changed.
+        Failures are only logged, the status record is best effort.
+        """
+        if not self.changed:
+            return
+        self.changed = False
+        self.last_update = time.monotonic()
+        try:
+            update_job(self.job_uuid, progress_updated_at=time.time(), **self.status)
+        except Exception:
+            logger.exception('Failed to update the progress of JIPipe job %s', self.job_uuid)
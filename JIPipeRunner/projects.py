@@ -0,0 +1,163 @@
+import contextlib
+import json
+import os
+import threading
+from typing import FrozenSet, List, Optional
+
+from django.conf import settings
+
+from JIPipeRunner.fingerprints import JIPIPE_VERSION
+
+# orjson is optional, the standard library json module is the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON file listing the node types of the installed JIPipe (None == node types are not checked)
+NODE_REGISTRY_FILE: Optional[str] = getattr(settings, 'JIPIPE_NODE_REGISTRY_FILE', None)
+
+# Largest number of validation errors reported for a project
+MAX_REPORTED_ERRORS = 20
+
+# Node types of the installed JIPipe, cached per JIPipe version and registry file version
+_node_types_cache = {}
+_node_types_lock = threading.Lock()
+
+
+class ProjectValidationError(ValueError):
+    """
+    Raised if a JIPipe project cannot run. Holds the list of all problems found.
+    """
+
+    def __init__(self, errors: List[str]):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def loads(data):
+    """
+    Parse JSON (bytes or str) with orjson if it is installed.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value) -> bytes:
+    """
+    Serialize a value to compact JSON bytes with orjson if it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def input_dataset_ids(jipipe_project_config: dict) -> List[int]:
+    """
+    Get the dataset IDs of all define-dataset-ids input nodes of a JIPipe project.
+
+    param jipipe_project_config: JSON configuration of the JIPipe project
+    """
+    dataset_ids = set()
+    for node in jipipe_project_config.get('graph', {}).get('nodes', {}).values():
+        if 'define-dataset-ids' in node.get('jipipe:alias-id', '').lower():
+            for dataset_id in node.get('dataset-ids', []):
+                with contextlib.suppress(TypeError, ValueError):
+                    dataset_ids.add(int(dataset_id))
+    return sorted(dataset_ids)
+
+
+def installed_node_types() -> Optional[FrozenSet[str]]:
+    """
+    Get the node type IDs of the installed JIPipe from JIPIPE_NODE_REGISTRY_FILE.
+    The file holds a JSON list of node type IDs, or an object whose keys (or
+    'node-types' entry) are the node type IDs. The parsed registry is cached
+    per JIPipe version and file modification time.
+    Returns None if no registry file is configured.
+    """
+    if not NODE_REGISTRY_FILE:
+        return None
+    cache_key = (JIPIPE_VERSION, os.path.getmtime(NODE_REGISTRY_FILE))
+    node_types = _node_types_cache.get(cache_key)
+    if node_types is None:
+        with _node_types_lock:
+            with open(NODE_REGISTRY_FILE, 'rb') as registry_file:
+                registry = loads(registry_file.read())
+            if isinstance(registry, dict):
+                registry = registry.get('node-types', registry)
+            node_types = frozenset(registry)
+            _node_types_cache.clear()
+            _node_types_cache[cache_key] = node_types
+    return node_types
+
+
+def prepare_project(jipipe_project_config, results_project_id: Optional[int] = None) -> dict:
+    """
+    Validate a JIPipe project and point its output nodes to the results
+    project in a single pass over the graph. Checks the project structure,
+    that every node has a type known to the installed JIPipe, that dataset
+    IDs of input nodes are integers and that edges connect existing nodes.
+    Raises a ProjectValidationError listing the problems if the project
+    cannot run, so it is rejected before a worker is occupied.
+    Returns the (modified) project.
+
+    param jipipe_project_config: Parsed JSON configuration of the JIPipe project
+    param results_project_id: ID of the project define-project-ids nodes are set to (None == unchanged)
+    """
+    if not isinstance(jipipe_project_config, dict):
+        raise ProjectValidationError(['The project must be a JSON object'])
+    graph = jipipe_project_config.get('graph')
+    if not isinstance(graph, dict) or not isinstance(graph.get('nodes'), dict):
+        raise ProjectValidationError(['The project has no graph nodes'])
+    nodes = graph['nodes']
+    if not nodes:
+        raise ProjectValidationError(['The project graph is empty'])
+
+    errors = []
+    node_types = installed_node_types()
+    for node_uuid, node in nodes.items():
+        if not isinstance(node, dict):
+            errors.append(f'Node {node_uuid} is not a JSON object')
+            continue
+
+        node_type = node.get('jipipe:node-info-id')
+        if not isinstance(node_type, str) or not node_type:
+            errors.append(f'Node {node_uuid} has no node type')
+        elif node_types is not None and node_type not in node_types:
+            errors.append(f'Node {node_uuid} has a node type unknown to JIPipe {JIPIPE_VERSION}: {node_type}')
+
+        # OMERO input and output nodes are identified by their alias
+        alias_id = node.get('jipipe:alias-id', '')
+        alias_id = alias_id.lower() if isinstance(alias_id, str) else ''
+        if 'define-dataset-ids' in alias_id:
+            dataset_ids = node.get('dataset-ids', [])
+            if not isinstance(dataset_ids, list) or not all(_is_id(dataset_id) for dataset_id in dataset_ids):
+                errors.append(f'Node {node_uuid} has invalid dataset IDs')
+        elif 'define-project-ids' in alias_id and results_project_id is not None:
+            node['dataset-ids'] = [results_project_id]
+
+        if len(errors) >= MAX_REPORTED_ERRORS:
+            break
+
+    edges = graph.get('edges', [])
+    if not isinstance(edges, list):
+        errors.append('The project edges must be a list')
+    else:
+        for edge in edges:
+            endpoints = [edge.get(key) for key in ('source-node', 'target-node') if key in edge] if isinstance(edge, dict) else [None]
+            if any(endpoint not in nodes for endpoint in endpoints):
+                errors.append(f'Edge does not connect two nodes of the project: {edge!r:.200}')
+                break
+
+    if errors:
+        raise ProjectValidationError(errors[:MAX_REPORTED_ERRORS])
+    return jipipe_project_config
+
+
+def _is_id(value) -> bool:
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return value > 0
+    return isinstance(value, str) and value.strip().isdigit()
@@ -0,0 +1,38 @@
+import redis
+import redis.asyncio
+from django.conf import settings
+
+# Synchronous Redis client, created lazily and shared per process
+_redis_client = None
+
+
+def get_redis_url() -> str:
+    """
+    Get the Redis URL of the default cache backend configured in OMERO
+    (omero.web.caches), which is also used as the Celery broker.
+    """
+    location = settings.CACHES['default']['LOCATION']
+
+    # django_redis allows a list of locations, the first one is the primary server
+    if isinstance(location, (list, tuple)):
+        location = location[0]
+    return location
+
+
+def get_redis() -> redis.Redis:
+    """
+    Get the shared synchronous Redis client for this process.
+    """
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(get_redis_url())
+    return _redis_client
+
+
+def create_async_redis() -> redis.asyncio.Redis:
+    """
+    Create a new asynchronous Redis client.
+    Async clients are bound to the event loop they are used in, so every
+    stream creates its own client and closes it when it is done.
+    """
+    return redis.asyncio.Redis.from_url(get_redis_url())
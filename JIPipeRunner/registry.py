@@ -0,0 +1,203 @@
+import json
+import time
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+from JIPipeRunner.redis_client import get_redis
+
+# Time (in seconds) to keep the metadata of finished jobs
+FINISHED_JOB_TTL = getattr(settings, 'JIPIPE_FINISHED_JOB_TTL', 7 * 24 * 60 * 60)
+
+# Return the metadata hashes of all jobs in a set (active jobs of a user, jobs of a batch) in a single round trip.
+# KEYS[1]: job set, ARGV[1]: prefix of the job metadata keys
+_LIST_JOBS_SCRIPT = """
+local result = {}
+for _, job_uuid in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    table.insert(result, job_uuid)
+    table.insert(result, redis.call('HGETALL', ARGV[1] .. job_uuid))
+end
+return result
+"""
+
+JOB_KEY_PREFIX = 'jipipe_job_'
+
+# List of job state changes not yet written to the job history in the database (see job_history)
+JOB_EVENTS_KEY = 'jipipe_job_events'
+
+
+def active_jobs_key(owner: str) -> str:
+    return f'jipipe_active_jobs_{owner}'
+
+
+def job_key(job_uuid: str) -> str:
+    return f'{JOB_KEY_PREFIX}{job_uuid}'
+
+
+def batch_key(batch_id: str) -> str:
+    return f'jipipe_batch_{batch_id}'
+
+
+def batch_jobs_key(batch_id: str) -> str:
+    return f'jipipe_batch_jobs_{batch_id}'
+
+
+def _decode(values: Dict[bytes, bytes]) -> Dict[str, str]:
+    return {key.decode('utf-8'): value.decode('utf-8') for key, value in values.items()}
+
+
+def _record_event(pipe, job_uuid: str, fields: Dict) -> None:
+    # Queue a state change of a job for the job history, in the same transaction as the registry update
+    pipe.rpush(JOB_EVENTS_KEY, json.dumps({'id': job_uuid, **fields}))
+
+
+def register_job(owner: str, job_uuid: str, **metadata) -> None:
+    """
+    Register a newly submitted job as active for its owner and store its metadata.
+
+    param owner: Name of the OMERO user owning the job
+    param job_uuid: Unique identifier for the JIPipe job
+    param metadata: Additional metadata fields (e.g. pipeline name)
+    """
+    fields = {'owner': owner, 'state': 'queued', 'submitted_at': time.time(), **metadata}
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.hset(job_key(job_uuid), mapping=fields)
+    pipe.sadd(active_jobs_key(owner), job_uuid)
+    _record_event(pipe, job_uuid, fields)
+    pipe.execute()
+
+
+def update_job(job_uuid: str, **fields) -> None:
+    """
+    Update metadata fields of a job. Changes of the state are also queued
+    for the job history, frequent updates (e.g. progress) are not.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param fields: Metadata fields to set
+    """
+    if 'state' not in fields:
+        get_redis().hset(job_key(job_uuid), mapping=fields)
+        return
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.hset(job_key(job_uuid), mapping=fields)
+    _record_event(pipe, job_uuid, fields)
+    pipe.execute()
+
+
+def mark_job_started(job_uuid: str, worker: str, **fields) -> Optional[str]:
+    """
+    Mark a job as running on a worker.
+    Returns the submission time of the job (UNIX timestamp) if it is known.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param worker: Name of the Celery worker running the job
+    param fields: Additional metadata fields (e.g. worker node)
+    """
+    fields = {'state': 'running', 'started_at': time.time(), 'worker': worker, **fields}
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.hset(job_key(job_uuid), mapping=fields)
+    pipe.hget(job_key(job_uuid), 'submitted_at')
+    _record_event(pipe, job_uuid, fields)
+    submitted_at = pipe.execute()[1]
+    return submitted_at.decode('utf-8') if submitted_at else None
+
+
+def finish_job(owner: str, job_uuid: str, state: str = 'finished', **fields) -> None:
+    """
+    Remove a job from the active jobs of its owner and record its final state.
+    The metadata of the job expires after FINISHED_JOB_TTL seconds, the job
+    history in the database keeps it afterwards.
+
+    param owner: Name of the OMERO user owning the job
+    param job_uuid: Unique identifier for the JIPipe job
+    param state: Final state of the job ('finished', 'failed', 'cancelled')
+    param fields: Additional metadata fields (e.g. exit code)
+    """
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.srem(active_jobs_key(owner), job_uuid)
+    fields = {'state': state, 'ended_at': time.time(), **{key: value for key, value in fields.items() if value is not None}}
+    pipe.hset(job_key(job_uuid), mapping=fields)
+    pipe.expire(job_key(job_uuid), FINISHED_JOB_TTL)
+    _record_event(pipe, job_uuid, {'owner': owner, **fields})
+    pipe.execute()
+
+
+def is_active_job(owner: str, job_uuid: str) -> bool:
+    """
+    Check whether a job is active and owned by the given user.
+
+    param owner: Name of the OMERO user
+    param job_uuid: Unique identifier for the JIPipe job
+    """
+    return bool(get_redis().sismember(active_jobs_key(owner), job_uuid))
+
+
+def list_active_jobs(owner: str) -> List[str]:
+    """
+    Get the IDs of all active jobs of a user.
+
+    param owner: Name of the OMERO user
+    """
+    return [job_uuid.decode('utf-8') for job_uuid in get_redis().smembers(active_jobs_key(owner))]
+
+
+def list_active_jobs_with_metadata(owner: str) -> Dict[str, Dict[str, str]]:
+    """
+    Get the metadata of all active jobs of a user in a single round trip.
+
+    param owner: Name of the OMERO user
+    """
+    return _jobs_with_metadata(active_jobs_key(owner))
+
+
+def _jobs_with_metadata(set_key: str) -> Dict[str, Dict[str, str]]:
+    result = get_redis().eval(_LIST_JOBS_SCRIPT, 1, set_key, JOB_KEY_PREFIX)
+    jobs = {}
+    for index in range(0, len(result), 2):
+        flat_fields = result[index + 1]
+        jobs[result[index].decode('utf-8')] = _decode(dict(zip(flat_fields[::2], flat_fields[1::2])))
+    return jobs
+
+
+def get_job(job_uuid: str) -> Optional[Dict[str, str]]:
+    """
+    Get the metadata of a job, or None if the job is unknown or expired.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    """
+    values = get_redis().hgetall(job_key(job_uuid))
+    return _decode(values) if values else None
+
+
+def register_batch(owner: str, batch_id: str, job_uuids: List[str]) -> None:
+    """
+    Register a batch of jobs (one per dataset) under a single batch ID.
+
+    param owner: Name of the OMERO user owning the batch
+    param batch_id: Unique identifier for the batch
+    param job_uuids: Unique identifiers of the jobs (shards) of the batch
+    """
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.hset(batch_key(batch_id), mapping={'owner': owner, 'submitted_at': time.time(), 'total': len(job_uuids)})
+    if job_uuids:
+        pipe.sadd(batch_jobs_key(batch_id), *job_uuids)
+    pipe.execute()
+
+
+def get_batch(batch_id: str) -> Optional[Dict[str, str]]:
+    """
+    Get the metadata of a batch, or None if the batch is unknown.
+
+    param batch_id: Unique identifier for the batch
+    """
+    values = get_redis().hgetall(batch_key(batch_id))
+    return _decode(values) if values else None
+
+
+def list_batch_jobs_with_metadata(batch_id: str) -> Dict[str, Dict[str, str]]:
+    """
+    Get the metadata of all jobs of a batch in a single round trip.
+
+    param batch_id: Unique identifier for the batch
+    """
+    return _jobs_with_metadata(batch_jobs_key(batch_id))
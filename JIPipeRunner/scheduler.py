@@ -0,0 +1,204 @@
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Optional
+
+from django.conf import settings
+
+from JIPipeRunner.redis_client import get_redis
+
+# Name of this worker node in the node registry and the key of its reservations (defaults to the host name)
+NODE_NAME = getattr(settings, 'JIPIPE_NODE_NAME', socket.gethostname())
+
+# JVM heap (in GB) of a job if none is requested, and the largest heap a job may request
+DEFAULT_JOB_MEMORY_GB = getattr(settings, 'JIPIPE_DEFAULT_MEMORY_GB', 8)
+MAX_JOB_MEMORY_GB = getattr(settings, 'JIPIPE_MAX_MEMORY_GB', 32)
+
+# CPU cores committed per job
+JOB_CPUS = getattr(settings, 'JIPIPE_JOB_CPUS', 1)
+
+# Memory (in GB) and CPU cores of a worker host that may be committed to jobs
+# (defaults to 90% of the physical memory and all cores)
+WORKER_MEMORY_GB = getattr(
+    settings,
+    'JIPIPE_WORKER_MEMORY_GB',
+    0.9 * os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 3,
+)
+WORKER_CPUS = getattr(settings, 'JIPIPE_WORKER_CPUS', os.cpu_count())
+
+# Seconds a job waits in the queue before it asks again for resources
+ADMISSION_RETRY_SECONDS = getattr(settings, 'JIPIPE_ADMISSION_RETRY_SECONDS', 15)
+
+# Seconds a job may wait for resources before the host stops admitting other jobs until it fits
+ADMISSION_STARVATION_SECONDS = getattr(settings, 'JIPIPE_ADMISSION_STARVATION_SECONDS', 300)
+
+# Seconds a reservation stays valid without being renewed by the task running the job,
+# so the resources of crashed worker processes are freed again
+RESERVATION_LEASE_SECONDS = getattr(settings, 'JIPIPE_RESERVATION_LEASE_SECONDS', 60)
+
+# Atomically reserve resources for a job if the host has enough uncommitted capacity.
+# Expired reservations are dropped first. While a starving job waits for the host, only it
+# may reserve; a starving job claims the host if no other starving job did.
+# KEYS[1]: reservation hash of the host, KEYS[2]: starving job of the host
+# ARGV: job UUID, memory, cpus, memory capacity, cpu capacity, now, lease seconds,
+#       starving (1/0), seconds the starving job keeps its claim between two attempts
+_RESERVE_SCRIPT = """
+local now = tonumber(ARGV[6])
+local lease = cjson.encode({memory_gb = tonumber(ARGV[2]), cpus = tonumber(ARGV[3]), expires_at = now + tonumber(ARGV[7])})
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    redis.call('HSET', KEYS[1], ARGV[1], lease)
+    return 1
+end
+local waiter = redis.call('GET', KEYS[2])
+if waiter and waiter ~= ARGV[1] then
+    return 0
+end
+if ARGV[8] == '1' then
+    redis.call('SET', KEYS[2], ARGV[1], 'EX', tonumber(ARGV[9]))
+end
+local memory = 0
+local cpus = 0
+local reservations = redis.call('HGETALL', KEYS[1])
+for index = 1, #reservations, 2 do
+    local reservation = cjson.decode(reservations[index + 1])
+    if (reservation['expires_at'] or 0) < now then
+        redis.call('HDEL', KEYS[1], reservations[index])
+    else
+        memory = memory + reservation['memory_gb']
+        cpus = cpus + reservation['cpus']
+    end
+end
+if memory + tonumber(ARGV[2]) > tonumber(ARGV[4]) or cpus + tonumber(ARGV[3]) > tonumber(ARGV[5]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], lease)
+if waiter then
+    redis.call('DEL', KEYS[2])
+end
+return 1
+"""
+
+# Extend the lease of an existing reservation.
+# KEYS[1]: reservation hash of the host, ARGV: job UUID, new expiry time
+_RENEW_SCRIPT = """
+local value = redis.call('HGET', KEYS[1], ARGV[1])
+if not value then
+    return 0
+end
+local reservation = cjson.decode(value)
+reservation['expires_at'] = tonumber(ARGV[2])
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(reservation))
+return 1
+"""
+
+# Intialize the logger
+logger = logging.getLogger(__name__)
+
+
+def resolve_job_memory_gb(requested: Optional[str]) -> int:
+    """
+    Get the JVM heap of a job from the requested value, using the admin-defined
+    default if nothing was requested and capping it at the admin-defined maximum.
+    Raises ValueError for values that are not positive integers.
+
+    param requested: Requested heap size in GB (e.g. from a query parameter)
+    """
+    if requested in (None, ''):
+        return DEFAULT_JOB_MEMORY_GB
+    memory_gb = int(requested)
+    if memory_gb < 1:
+        raise ValueError('Memory must be at least 1 GB')
+    return min(memory_gb, MAX_JOB_MEMORY_GB)
+
+
+def host_reservations_key(host: str) -> str:
+    return f'jipipe_reservations_{host}'
+
+
+def starving_job_key(host: str) -> str:
+    return f'jipipe_starving_job_{host}'
+
+
+def try_reserve_resources(job_uuid: str, memory_gb: int, cpus: int = JOB_CPUS, host: Optional[str] = None,
+                          waited_seconds: float = 0) -> bool:
+    """
+    Reserve memory and CPU cores for a job on a worker host if they are free.
+    Reserving is atomic across all worker processes and idempotent per job.
+    The reservation expires after JIPIPE_RESERVATION_LEASE_SECONDS unless it
+    is renewed (see start_reservation_lease). Once a job waited longer than
+    JIPIPE_ADMISSION_STARVATION_SECONDS, the host admits no other job until
+    it fits, so large jobs are not starved by a stream of small ones.
+    Returns True if the job was admitted.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param memory_gb: JVM heap of the job in GB
+    param cpus: CPU cores used by the job
+    param host: Worker node name (defaults to this node)
+    param waited_seconds: Seconds the job already waited for resources
+    """
+    host = host or NODE_NAME
+    admitted = get_redis().eval(
+        _RESERVE_SCRIPT,
+        2,
+        host_reservations_key(host),
+        starving_job_key(host),
+        job_uuid,
+        memory_gb,
+        cpus,
+        WORKER_MEMORY_GB,
+        WORKER_CPUS,
+        time.time(),
+        RESERVATION_LEASE_SECONDS,
+        1 if waited_seconds >= ADMISSION_STARVATION_SECONDS else 0,
+        max(3 * ADMISSION_RETRY_SECONDS, 1),
+    )
+    return bool(admitted)
+
+
+def renew_reservation(job_uuid: str, host: Optional[str] = None) -> bool:
+    """
+    Extend the lease of the reservation of a job by JIPIPE_RESERVATION_LEASE_SECONDS.
+    Returns False if the job holds no reservation (e.g. it already expired).
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param host: Worker node name (defaults to this node)
+    """
+    renewed = get_redis().eval(
+        _RENEW_SCRIPT, 1, host_reservations_key(host or NODE_NAME), job_uuid, time.time() + RESERVATION_LEASE_SECONDS)
+    return bool(renewed)
+
+
+def start_reservation_lease(job_uuid: str, on_renew: Optional[Callable[[], None]] = None) -> threading.Event:
+    """
+    Renew the reservation of a running job in a background thread until the
+    returned event is set or the reservation is gone.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param on_renew: Called after every renewal (e.g. to renew the fair-share slot of the job)
+    """
+    stopped = threading.Event()
+
+    def renew():
+        while not stopped.wait(RESERVATION_LEASE_SECONDS / 3):
+            try:
+                if not renew_reservation(job_uuid):
+                    return
+                if on_renew is not None:
+                    on_renew()
+            except Exception:
+                logger.exception('Failed to renew the resource reservation of JIPipe job %s', job_uuid)
+
+    threading.Thread(target=renew, name='jipipe-reservation-lease', daemon=True).start()
+    return stopped
+
+
+def release_resources(job_uuid: str, host: Optional[str] = None) -> None:
+    """
+    Release the resources reserved for a job.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param host: Worker node name (defaults to this node)
+    """
+    get_redis().hdel(host_reservations_key(host or NODE_NAME), job_uuid)
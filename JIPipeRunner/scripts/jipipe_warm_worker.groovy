@@ -0,0 +1,66 @@
+// Persistent JIPipe worker used by the warm execution mode of JIPipeRunner.
+// Reads one JSON request per line from stdin ({"args": [...CLI arguments...]}),
+// runs the JIPipe CLI inside this already initialized JVM and prints a
+// completion marker with the exit code after each run. If the JVM does not
+// allow installing a security manager (Java 18+ without
+// -Djava.security.manager=allow, Java 24+), System.exit of the CLI cannot be
+// trapped, so the script reports the warm mode as unsupported and exits.
+import groovy.json.JsonSlurper
+import java.security.Permission
+import org.hkijena.jipipe.cli.JIPipeCLIMain
+
+class ExitTrappedException extends SecurityException {
+    int status
+
+    ExitTrappedException(int status) {
+        super("System.exit(" + status + ") trapped")
+        this.status = status
+    }
+}
+
+// Prevent the CLI from terminating the JVM after a run
+class ExitTrappingSecurityManager extends SecurityManager {
+    void checkPermission(Permission permission) {}
+    void checkPermission(Permission permission, Object context) {}
+    void checkExit(int status) { throw new ExitTrappedException(status) }
+}
+
+def reader = new BufferedReader(new InputStreamReader(System.in, "UTF-8"))
+def slurper = new JsonSlurper()
+
+// Check once that System.exit can be trapped before accepting jobs
+try {
+    def previousSecurityManager = System.getSecurityManager()
+    System.setSecurityManager(new ExitTrappingSecurityManager())
+    System.setSecurityManager(previousSecurityManager)
+} catch (UnsupportedOperationException | SecurityException e) {
+    System.out.println("__JIPIPE_WARM_UNSUPPORTED__ Java " + System.getProperty("java.version") + " does not allow a security manager: " + e.getMessage())
+    System.out.flush()
+    System.exit(0)
+}
+
+System.out.println("__JIPIPE_WARM_READY__")
+System.out.flush()
+
+String line
+while ((line = reader.readLine()) != null) {
+    if (line.trim().isEmpty()) {
+        continue
+    }
+    def request = slurper.parseText(line)
+    int exitCode = 0
+    def previousSecurityManager = System.getSecurityManager()
+    try {
+        System.setSecurityManager(new ExitTrappingSecurityManager())
+        JIPipeCLIMain.main(request.args as String[])
+    } catch (ExitTrappedException e) {
+        exitCode = e.status
+    } catch (Throwable t) {
+        t.printStackTrace(System.out)
+        exitCode = 1
+    } finally {
+        System.setSecurityManager(previousSecurityManager)
+    }
+    System.out.println("__JIPIPE_WARM_DONE__ " + exitCode)
+    System.out.flush()
+}
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, List
+
+from JIPipeRunner.logs import log_has_exit_marker, read_log_from
+from JIPipeRunner.redis_client import create_async_redis, get_redis
+from JIPipeRunner.registry import get_job
+
+# Seconds without events after which a keep-alive comment is sent to the browser
+STREAM_HEARTBEAT_SECONDS = 15
+
+# Final states of a job in the registry
+ENDED_JOB_STATES = ('finished', 'failed', 'cancelled')
+
+# Intialize the logger
+logger = logging.getLogger(__name__)
+
+
+def job_channel(job_uuid: str) -> str:
+    """
+    Get the name of the Redis pub/sub channel used for the events of a job.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    """
+    return f'jipipe_job_events_{job_uuid}'
+
+
+def publish_log_lines(job_uuid: str, lines: List[str], start: int, cursor: int) -> None:
+    """
+    Publish new log lines of a job to its channel.
+    Publishing is best effort: a failure is logged but never interrupts the job,
+    since subscribers fall back to reading the log file.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param lines: Log lines without trailing newlines
+    param start: Byte offset of the first line in the log file
+    param cursor: Byte offset behind the last line in the log file
+    """
+    _publish(job_uuid, {'type': 'log', 'lines': lines, 'start': start, 'cursor': cursor})
+
+
+def publish_status(job_uuid: str, status: str) -> None:
+    """
+    Publish a status change ('running', 'finished', ...) of a job to its channel.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param status: New status of the job
+    """
+    _publish(job_uuid, {'type': 'status', 'status': status})
+
+
+def _publish(job_uuid: str, event: dict) -> None:
+    try:
+        get_redis().publish(job_channel(job_uuid), json.dumps(event))
+    except Exception:
+        logger.exception('Failed to publish JIPipe job event for %s', job_uuid)
+
+
+def _format_event(event: str, data: dict, event_id=None) -> str:
+    """
+    Format a server-sent event. The id is the log cursor, so a reconnecting
+    EventSource resumes from the last delivered line via Last-Event-ID.
+    """
+    message = f'event: {event}\n'
+    if event_id is not None:
+        message += f'id: {event_id}\n'
+    return message + f'data: {json.dumps(data)}\n\n'
+
+
+def _job_ended(job_uuid: str, log_file_path: str) -> bool:
+    """
+    Check whether a job ended: its log file has the exit message, or the
+    registry records a final state or no longer knows the job (e.g. a job
+    cancelled before it started or whose worker was lost).
+    """
+    if log_has_exit_marker(log_file_path):
+        return True
+    job = get_job(job_uuid)
+    return job is None or job.get('state') in ENDED_JOB_STATES
+
+
+async def stream_job_events(job_uuid: str, log_file_path: str, cursor: int) -> AsyncIterator[str]:
+    """
+    Stream the log lines and status changes of a job as server-sent events.
+    The channel is subscribed before the log file backlog is sent, so no line
+    written in between is lost. Published lines are forwarded directly if they
+    continue the current cursor; otherwise the missing part is read from the
+    log file. The stream ends with a 'finished' status event once the job
+    ended, which is also checked with every keep-alive (see _job_ended), so
+    the stream is closed even if the final status message was missed.
+
+    param job_uuid: Unique identifier for the JIPipe job
+    param log_file_path: Path to the log file of the JIPipe job
+    param cursor: Byte offset in the log file to start streaming from
+    """
+    client = create_async_redis()
+    pubsub = client.pubsub()
+
+    async def read_backlog(cursor):
+        # Read all complete lines after the cursor from the log file in chunks
+        events = []
+        has_more = True
+        while has_more:
+            lines, next_cursor, has_more = await asyncio.to_thread(read_log_from, log_file_path, cursor)
+            if next_cursor == cursor:
+                break
+            events.append(_format_event('log', {'lines': lines, 'cursor': next_cursor}, next_cursor))
+            cursor = next_cursor
+        return events, cursor
+
+    try:
+        await pubsub.subscribe(job_channel(job_uuid))
+
+        # Wait for the subscription to be confirmed, else the first read would return early without a message
+        await pubsub.get_message(timeout=STREAM_HEARTBEAT_SECONDS)
+
+        # Send everything written before the subscription from the log file
+        events, cursor = await read_backlog(cursor)
+        for event in events:
+            yield event
+
+        # Stop right away if the job already ended
+        if await asyncio.to_thread(_job_ended, job_uuid, log_file_path):
+            yield _format_event('status', {'status': 'finished'})
+            return
+
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=STREAM_HEARTBEAT_SECONDS)
+
+            # Without events, keep the connection alive and check whether the job ended without a message
+            if message is None:
+                if await asyncio.to_thread(_job_ended, job_uuid, log_file_path):
+                    events, cursor = await read_backlog(cursor)
+                    for event in events:
+                        yield event
+                    yield _format_event('status', {'status': 'finished'})
+                    return
+                yield ': keep-alive\n\n'
+                continue
+
+            data = json.loads(message['data'])
+
+            # Forward log lines directly if they continue the cursor, else catch up from the file
+            if data['type'] == 'log':
+                if data['cursor'] <= cursor:
+                    continue
+                if data['start'] == cursor:
+                    cursor = data['cursor']
+                    yield _format_event('log', {'lines': data['lines'], 'cursor': cursor}, cursor)
+                else:
+                    events, cursor = await read_backlog(cursor)
+                    for event in events:
+                        yield event
+
+            # Forward status changes and end the stream once the job finished
+            elif data['type'] == 'status':
+                if data['status'] == 'finished':
+                    events, cursor = await read_backlog(cursor)
+                    for event in events:
+                        yield event
+                yield _format_event('status', {'status': data['status']})
+                if data['status'] == 'finished':
+                    return
+
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+        await client.aclose()
@@ -1,107 +1,365 @@
 from celery import shared_task
-import json, os, tempfile, subprocess, shutil, logging
+from celery.signals import worker_ready
+import json, os, tempfile, subprocess, shutil, logging, time
 from pathlib import Path
-from django.core.cache import cache
 from omero.config import ConfigXml
-import signal
 from django.conf import settings
+from JIPipeRunner.fair_share import PRIORITY_QUEUES, claim_job, dispatch_jobs, reap_stale_jobs, release_job, renew_job_lease, requeue_lost_jobs
+from JIPipeRunner.cancellation import CancelWatcher, cancel_requested_at
+from JIPipeRunner.displays import display_for_job, start_display_pool
+from JIPipeRunner.job_history import flush_job_history_quietly
+from JIPipeRunner.log_pump import LogPump
+from JIPipeRunner.logs import LogWriter, archive_log, prune_logs
+from JIPipeRunner.metrics import (
+    CANCEL_SECONDS,
+    JOBS_FINISHED,
+    LOG_BYTES,
+    PhaseTimer,
+    job_span,
+    observe_queue_wait,
+    start_worker_metrics_server,
+)
+from JIPipeRunner.nodes import IMAGEJ_PATH, SCRATCH_DIR, node_queue, start_heartbeat
+from JIPipeRunner.omero_session import job_session, keep_job_sessions_alive, release_job_session
+from JIPipeRunner.progress import ProgressTracker
+from JIPipeRunner.projects import dumps as dump_project
+from JIPipeRunner.registry import finish_job, list_active_jobs, mark_job_started
+from JIPipeRunner.scheduler import (
+    ADMISSION_RETRY_SECONDS,
+    DEFAULT_JOB_MEMORY_GB,
+    NODE_NAME,
+    WORKER_MEMORY_GB,
+    release_resources,
+    start_reservation_lease,
+    try_reserve_resources,
+)
+from JIPipeRunner.streams import publish_log_lines, publish_status
+from JIPipeRunner.uploads import UPLOAD_OUTPUTS, OutputUploader, format_upload_summary
+from JIPipeRunner.warm_pool import WARM_WORKER_SCRIPT, WarmModeUnsupported, get_warm_worker
 
-# Turn SIGTERM into KeyboardInterrupt so it can be caught by the task (necessary to shutdown child processes)
-signal.signal(signal.SIGTERM, lambda signum, frame: (_ for _ in ()).throw(KeyboardInterrupt()))
+# Execution mode: 'cold' starts a new JVM per job, 'warm' reuses a long-lived JIPipe process per worker slot
+EXECUTION_MODE = getattr(settings, 'JIPIPE_EXECUTION_MODE', 'cold')
+
+# Number of jobs and resident memory (in MB) after which a warm JIPipe process is restarted
+WARM_MAX_JOBS = getattr(settings, 'JIPIPE_WARM_MAX_JOBS', 50)
+WARM_MAX_RSS_MB = getattr(settings, 'JIPIPE_WARM_MAX_RSS_MB', None)
+
+# Additional JVM options of warm JIPipe processes (e.g. ['-Djava.security.manager=allow'] on Java 18 to 23)
+WARM_JVM_OPTIONS = getattr(settings, 'JIPIPE_WARM_JVM_OPTIONS', [])
+
+# Serve the metrics of this worker host once the worker is ready (if JIPIPE_METRICS_WORKER_PORT is set)
+@worker_ready.connect
+def _serve_worker_metrics(**kwargs):
+    start_worker_metrics_server()
+
+# Start the pooled virtual displays of this host once the worker is ready instead of on the first lease
+@worker_ready.connect
+def _start_display_pool(**kwargs):
+    start_display_pool()
+
+# Register this worker node once the worker is ready, consume the node queues of the priority classes whose queues
+# it consumes (-Q) and keep its heartbeat alive.
+# Every heartbeat also requeues the jobs of lost nodes, so they are recovered without new submissions,
+# and writes the pending job state changes to the job history
+@worker_ready.connect
+def _register_worker_node(sender=None, **kwargs):
+    consumed = set(sender.app.amqp.queues.consume_from)
+    priorities = [priority for priority, queue in PRIORITY_QUEUES.items() if queue in consumed]
+    for priority in priorities:
+        sender.app.control.add_consumer(node_queue(NODE_NAME, priority), destination=[sender.hostname], reply=False)
+    start_heartbeat(priorities, _recover_lost_jobs)
 
 """
 This task runs a JIPipe project in the background using ImageJ CLI.
 It creates temporary directories for input and output, runs the JIPipe 
 project using xvfb-run to handle GUI elements, and logs the output to a 
-specified log file. When the task is interrupted or fails, it cleans up 
-the temporary directories and logs the error.
+specified log file. When the job is cancelled (see cancellation), its
+JIPipe process group is terminated; whether the job finished, failed or
+was cancelled, the temporary directories are cleaned up exactly once.
 
 param jipipe_project_config: JSON configuration of the JIPipe project
 param job_uuid: Unique identifier for the JIPipe job
 param omero_user_name: Username of the OMERO user running the job
 param jipipe_log_file_path: Path to the log file for the JIPipe job
+param memory_gb: JVM heap of the job in GB; the job waits in the queue until
+                 this much memory is uncommitted on the worker host
+param omero_session: OMERO session of the user used to upload the outputs (None == the
+                     session stored for the job, see omero_session.store_job_session)
+param results_project_id: ID of the JIPipeResults project outputs are uploaded to
+param trace_context: Trace context of the submitting request (see metrics.current_trace_context)
 """
 @shared_task(bind=True)
-def run_jipipe_task(self, jipipe_project_config, job_uuid, omero_user_name, jipipe_log_file_path):
+def run_jipipe_task(self, jipipe_project_config, job_uuid, omero_user_name, jipipe_log_file_path, memory_gb=DEFAULT_JOB_MEMORY_GB, omero_session=None, results_project_id=None, trace_context=None):
+
+    # Continue the trace of the request that submitted the job
+    with job_span(job_uuid, trace_context):
+        _run_jipipe_job(self, jipipe_project_config, job_uuid, omero_user_name, jipipe_log_file_path, memory_gb, omero_session, results_project_id)
+
+
+def _run_jipipe_job(self, jipipe_project_config, job_uuid, omero_user_name, jipipe_log_file_path, memory_gb, omero_session, results_project_id):
 
     # Initialize logging
     log = logging.getLogger(__name__)
 
+    # Skip the job if it was requeued after this node was considered lost, was routed to another node or was cancelled
+    if not claim_job(job_uuid, NODE_NAME):
+        log.warning(f"Skipping JIPipe job {job_uuid}, it was cancelled or is no longer assigned to node {NODE_NAME}")
+        return
+
+    # Skip the job if it was cancelled after it was claimed
+    if cancel_requested_at(job_uuid) is not None:
+        _end_job_early(omero_user_name, job_uuid, jipipe_log_file_path, 'cancelled', None, ["[ Job cancelled before it started ]"])
+        return
+
+    # Fail right away if the job can never fit on this worker host
+    if memory_gb > WORKER_MEMORY_GB:
+        _end_job_early(omero_user_name, job_uuid, jipipe_log_file_path, 'failed', 1, [
+            f"ERROR: Requested {memory_gb} GB exceed the {WORKER_MEMORY_GB:.0f} GB available on this worker",
+            "[ JIPipe exited with code 1 ]",
+        ])
+        return
+
+    # Only start the job if its memory and CPU can be committed on this host, else requeue it
+    if not try_reserve_resources(job_uuid, memory_gb, waited_seconds=self.request.retries * ADMISSION_RETRY_SECONDS):
+        if self.request.retries == 0:
+            _append_log_line(jipipe_log_file_path, job_uuid, f"[ Waiting for {memory_gb} GB of free worker memory ]")
+        raise self.retry(countdown=ADMISSION_RETRY_SECONDS, max_retries=None)
+
+    # Keep the reservation and the fair-share slot alive while the job runs, both expire if this process dies
+    reservation_lease = start_reservation_lease(job_uuid, on_renew=lambda: renew_job_lease(job_uuid, NODE_NAME))
+
+    # Record that the job is running on this worker
+    observe_queue_wait(mark_job_started(job_uuid, self.request.hostname, node=NODE_NAME))
+    phases = PhaseTimer()
+    progress = ProgressTracker(job_uuid)
+    final_state = 'failed'
+    returncode = None
+    cfg = None
+    worker = None
+
+    # Terminate the JIPipe process group as soon as the job is cancelled
+    cancel_watcher = CancelWatcher(job_uuid).start()
+
     # Create temporary directories for handling input and output
-    temp_input = tempfile.mkdtemp()
-    temp_output = tempfile.mkdtemp()
+    temp_input = tempfile.mkdtemp(dir=SCRATCH_DIR)
+    temp_output = tempfile.mkdtemp(dir=SCRATCH_DIR)
 
     try:
         # Save the JIPipe project configuration to a file to access it via ImageJ CLI
         jip_project_file = Path(temp_input) / 'JIPipeProject.jip'
-        with open(jip_project_file, 'w') as f:
-            json.dump(jipipe_project_config, f)
+        with open(jip_project_file, 'wb') as f:
+            f.write(dump_project(jipipe_project_config))
 
-        # Get the ImageJ path from the OMERO configuration to run JIPipe on
+        # Get the ImageJ path of this node, or from the OMERO configuration, to run JIPipe on
         cfg_file = os.path.join(os.environ["OMERODIR"], "etc", "grid", "config.xml")
         cfg = ConfigXml(cfg_file, read_only=True)
-        imagej_path = cfg.as_map().get("omero.web.imagej")
+        imagej_path = IMAGEJ_PATH or cfg.as_map().get("omero.web.imagej")
 
-        # Define the command to run JIPipe using ImageJ CLI
-        # TODO: Make memory configurable
-        command = [
-            'xvfb-run', '-a', imagej_path,
+        # Define the JVM options and JIPipe CLI arguments to run the project
+        jvm_options = [
             '-Dorg.apache.logging.log4j.simplelog.StatusLogger.level=ERROR',
             '-Dorg.apache.logging.log4j.simplelog.level=ERROR',
-            '--memory', '8G',
-            '--pass-classpath', '--full-classpath',
-            '--main-class', 'org.hkijena.jipipe.cli.JIPipeCLIMain',
+            '--memory', f'{memory_gb}G',
+        ]
+        jipipe_args = [
             'run', '--project', str(jip_project_file),
             '--output-folder', temp_output,
         ]
-        # Run the command and log the output
-        with open(jipipe_log_file_path, 'w') as log_file:
-            log_file.write("Executable ImageJ at: " + imagej_path + "\n")
-
-            process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                preexec_fn=os.setsid,
-            )
-
-            # Write the output of the process to the log file
-            for line in process.stdout:
-                log_file.write(line)
-                log_file.flush()
-
-            # Wait for the process to complete
-            process.wait()
-
-            log_file.write(f"\n[ JIPipe exited with code {process.returncode} ]\n")
-
-    except KeyboardInterrupt:
-        # On receiving SIGTERM, close cfg and clean up cache and temporary directories before exiting
-        cfg.close()
-        user_key = f"active_jipipe_jobs_{omero_user_name}"
-        active = set(cache.get(user_key, []))
-        active.discard(job_uuid)
-        cache.set(user_key, active, timeout=None)
-        shutil.rmtree(temp_input)
-        shutil.rmtree(temp_output)
-        os.killpg(process.pid, signal.SIGTERM)
-        
+
+        # Run the command and log the output (appending to the lines written while the job was queued)
+        with LogWriter(jipipe_log_file_path) as log_file:
+            header = "Executable ImageJ at: " + imagej_path + "\n"
+            log_file.write(header)
+            publish_status(job_uuid, 'running')
+
+            # Do not start JIPipe for a job cancelled during the preparation
+            cancel_watcher.raise_if_cancelled()
+
+            # Write the output of the process to the log file and publish it to live subscribers
+            def write_output(text):
+                # A warm process may have been restarted after the cancel request, stop forwarding its output
+                if worker is not None:
+                    cancel_watcher.raise_if_cancelled()
+                line_start, log_cursor = log_file.write(text)
+                LOG_BYTES.inc(log_cursor - line_start)
+                publish_log_lines(job_uuid, text.splitlines(), line_start, log_cursor)
+                progress.feed(text)
+
+            # Upload finished outputs to OMERO while JIPipe is still running
+            uploader = None
+            omero_session = omero_session or job_session(job_uuid)
+            if UPLOAD_OUTPUTS and omero_session and results_project_id:
+                uploader = OutputUploader(omero_session, results_project_id, temp_output, time.time())
+                uploader.start()
+
+            try:
+                if EXECUTION_MODE == 'warm':
+                    # Run the project in the already initialized JIPipe process of this worker slot
+                    worker = get_warm_worker(
+                        [imagej_path, *jvm_options, *WARM_JVM_OPTIONS, '--console', '--run', str(WARM_WORKER_SCRIPT)],
+                        WARM_MAX_JOBS,
+                        WARM_MAX_RSS_MB,
+                    )
+                    phases.mark('setup')
+                    try:
+                        if worker.ensure_started(write_output):
+                            write_output("[ Started new warm JIPipe worker ]\n")
+                    except WarmModeUnsupported as unsupported:
+                        # Run the job in a fresh JVM instead (the worker remembers this, so later jobs skip the attempt)
+                        write_output(f"[ Warm execution mode unavailable, starting a new JIPipe process: {unsupported} ]\n")
+                        worker = None
+                if worker is not None:
+                    phases.mark('startup')
+                    cancel_watcher.attach(worker.process)
+                    cancel_watcher.raise_if_cancelled()
+                    returncode = worker.run(jipipe_args, write_output)
+                else:
+                    # Start a fresh ImageJ/JIPipe process for this job on a virtual display (or headless)
+                    with display_for_job(jipipe_project_config) as display:
+                        command = [
+                            *display.prefix, imagej_path, *display.options, *jvm_options,
+                            '--pass-classpath', '--full-classpath',
+                            '--main-class', 'org.hkijena.jipipe.cli.JIPipeCLIMain',
+                            *jipipe_args,
+                        ]
+                        phases.mark('setup')
+                        process = subprocess.Popen(
+                            command,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            bufsize=0,
+                            preexec_fn=os.setsid,
+                            env={**os.environ, **display.env},
+                        )
+                        cancel_watcher.attach(process)
+
+                        # The first output of the process ends the JVM (and display) startup
+                        def write_process_output(text):
+                            phases.mark('startup')
+                            write_output(text)
+
+                        LogPump(process.stdout, write_process_output).run()
+
+                        # Wait for the process to complete
+                        process.wait()
+                        returncode = process.returncode
+                phases.mark('execution')
+            finally:
+                # Wait for the remaining uploads (only those in progress if the job was cancelled) and write the upload summary to the log
+                if uploader is not None:
+                    if cancel_watcher.cancelled:
+                        log_file.write(format_upload_summary(uploader.abort()))
+                    else:
+                        write_output(format_upload_summary(uploader.finish()))
+                    phases.mark('upload')
+
+            # Do not report the results of a cancelled run
+            cancel_watcher.raise_if_cancelled()
+
+            log_file.write(f"\n[ JIPipe exited with code {returncode} ]\n")
+            final_state = 'finished' if returncode == 0 else 'failed'
+
     except Exception as e:
-        # Log any exceptions that occur during the task and throw an exception in OMERO log
-        with open(jipipe_log_file_path, 'a') as log_file:
-            log_file.write(f"\nERROR in JIPipe background job: {e}\n")
-        log.exception("Error in Celery JIPipe task")
+        if cancel_watcher.cancelled:
+            # JobCancelled, or reading from the terminated process failed (e.g. WarmWorkerDied)
+            final_state = 'cancelled'
+            if worker is not None:
+                worker.stop()
+            _append_log_line(jipipe_log_file_path, job_uuid, f"[ Job cancelled, JIPipe {'killed' if cancel_watcher.forced else 'terminated'} ]")
+        else:
+            # Log any exceptions that occur during the task and throw an exception in OMERO log
+            with open(jipipe_log_file_path, 'a') as log_file:
+                log_file.write(f"\nERROR in JIPipe background job: {e}\n")
+            log.exception("Error in Celery JIPipe task")
 
     finally:
-        # Close cfg and clean up cache and temporary directories
-        cfg.close()
-        user_key = f"active_jipipe_jobs_{omero_user_name}"
-        active = set(cache.get(user_key, []))
-        log.info(f"Previous active JIPipe jobs for user {omero_user_name}: {active}")
-        active.discard(job_uuid)
-        cache.set(user_key, active, timeout=None)
-        log.info(f"Updated active JIPipe jobs for user {omero_user_name}: {cache.get(user_key, [])}")
-        shutil.rmtree(temp_input)
-        shutil.rmtree(temp_output)
+        # Free the resources and the fair-share slot of the job first, then close cfg and clean up temporary directories
+        cancel_watcher.stop()
+        if cfg is not None:
+            cfg.close()
+        reservation_lease.set()
+        release_resources(job_uuid)
+        _release_slot(job_uuid)
+        cancel_seconds = None
+        if cancel_watcher.cancelled:
+            cancel_seconds = round(max(time.time() - cancel_watcher.requested_at, 0), 3)
+            CANCEL_SECONDS.observe(cancel_seconds)
+        progress.flush()
+        _archive_job_log(jipipe_log_file_path)
+        finish_job(omero_user_name, job_uuid, state=final_state, exit_code=returncode, cancel_seconds=cancel_seconds)
+        release_job_session(job_uuid)
+        flush_job_history_quietly()
+        log.info(f"Active JIPipe jobs for user {omero_user_name}: {list_active_jobs(omero_user_name)}")
+        shutil.rmtree(temp_input, ignore_errors=True)
+        shutil.rmtree(temp_output, ignore_errors=True)
+        phases.mark('cleanup')
+        JOBS_FINISHED.labels(final_state).inc()
+
+        # Notify live log subscribers that the job finished
+        publish_status(job_uuid, 'finished')
+
+
+def _append_log_line(jipipe_log_file_path, job_uuid, text):
+    """
+    Append a single line to the log file of a job and publish it to live subscribers.
+    """
+    with open(jipipe_log_file_path, 'a') as log_file:
+        line_start = log_file.tell()
+        log_file.write(text + "\n")
+    publish_log_lines(job_uuid, [text], line_start, os.path.getsize(jipipe_log_file_path))
+
+
+
+def _end_job_early(omero_user_name, job_uuid, jipipe_log_file_path, state, exit_code, lines):
+    """
+    End a job that never started JIPipe: write the reason to its log, record
+    the final state and free its fair-share slot.
+    """
+    for line in lines:
+        _append_log_line(jipipe_log_file_path, job_uuid, line)
+    _archive_job_log(jipipe_log_file_path)
+    finish_job(omero_user_name, job_uuid, state=state, exit_code=exit_code)
+    release_job_session(job_uuid)
+    _release_slot(job_uuid)
+    flush_job_history_quietly()
+    publish_status(job_uuid, 'finished')
+
+
+def _release_slot(job_uuid):
+    """
+    Free the fair-share slot of a finished job and dispatch the next pending jobs.
+    Failures are logged, they never fail the job.
+    """
+    try:
+        release_job(job_uuid, NODE_NAME)
+        dispatch_jobs()
+    except Exception:
+        logging.getLogger(__name__).exception("Failed to dispatch JIPipe jobs after %s", job_uuid)
+
+
+def _recover_lost_jobs():
+    """
+    Requeue the jobs of worker nodes without heartbeat and free the slots (and OMERO sessions) of stale
+    jobs, dispatch the requeued jobs and the freed slots, keep the OMERO sessions of the remaining jobs
+    alive, then write the pending job state changes to the job history.
+    """
+    requeued = requeue_lost_jobs()
+    reaped = reap_stale_jobs()
+    for job_uuid in reaped:
+        release_job_session(job_uuid)
+    if requeued or reaped:
+        dispatch_jobs()
+    keep_job_sessions_alive()
+    flush_job_history_quietly()
+
+
+def _archive_job_log(jipipe_log_file_path):
+    """
+    Compress the log of a finished job and enforce the log retention.
+    Failures only keep the plain log, they never fail the job.
+    """
+    try:
+        archive_log(jipipe_log_file_path)
+        prune_logs(os.path.dirname(jipipe_log_file_path))
+    except Exception:
+        logging.getLogger(__name__).exception("Failed to archive JIPipe log %s", jipipe_log_file_path)
@@ -1,3 +1,599 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import inspect
+import json
+import os
+import signal
+import stat
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.db import DatabaseError
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from celery import signature
+from celery.canvas import Signature
+
+from JIPipeRunner import (
+    cancellation, displays, fair_share, fingerprints, job_history, logs, nodes, omero_session, redis_client, registry, scheduler, streams,
+)
+from JIPipeRunner.config_cache import ByteLRUCache
+from JIPipeRunner.forms import RangeInputForm
+from JIPipeRunner.log_pump import LogPump
+from JIPipeRunner.models import Job
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+# The views need OMERO.web and the OMERO Python bindings
+try:
+    from JIPipeRunner import views
+except ImportError:
+    views = None
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+class RedisMixin:
+    # Replace the shared Redis client by an empty fakeredis for every test
+
+    def setUp(self):
+        super().setUp()
+        self.redis_server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=self.redis_server)
+        patcher = mock.patch.object(redis_client, '_redis_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class ByteLRUCacheTests(SimpleTestCase):
+
+    def test_evicts_least_recently_used_entries_beyond_budget(self):
+        cache = ByteLRUCache(10)
+        cache.set('a', b'1234')
+        cache.set('b', b'1234')
+        cache.get('a')
+        cache.set('c', b'1234')
+        self.assertEqual(cache.get('a'), b'1234')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), b'1234')
+
+    def test_replacing_an_entry_updates_the_size(self):
+        cache = ByteLRUCache(10)
+        cache.set('a', b'12345678')
+        cache.set('a', b'12')
+        cache.set('b', b'12345678')
+        self.assertEqual(cache.get('a'), b'12')
+        self.assertEqual(cache.get('b'), b'12345678')
+
+    def test_values_larger_than_the_budget_are_not_cached(self):
+        cache = ByteLRUCache(4)
+        cache.set('a', b'12345')
+        self.assertIsNone(cache.get('a'))
+
+
+@mock.patch.multiple(scheduler, WORKER_MEMORY_GB=10, WORKER_CPUS=4, ADMISSION_STARVATION_SECONDS=300)
+class ReservationTests(RedisMixin, SimpleTestCase):
+
+    def test_reserves_only_uncommitted_capacity(self):
+        self.assertTrue(scheduler.try_reserve_resources('a', 6, host='node'))
+        self.assertFalse(scheduler.try_reserve_resources('b', 6, host='node'))
+        self.assertTrue(scheduler.try_reserve_resources('a', 6, host='node'))
+        scheduler.release_resources('a', host='node')
+        self.assertTrue(scheduler.try_reserve_resources('b', 6, host='node'))
+
+    def test_expired_reservations_are_freed(self):
+        self.assertTrue(scheduler.try_reserve_resources('a', 6, host='node'))
+        with mock.patch.object(scheduler.time, 'time', return_value=time.time() + scheduler.RESERVATION_LEASE_SECONDS + 1):
+            self.assertTrue(scheduler.try_reserve_resources('b', 6, host='node'))
+        self.assertEqual(self.redis.hkeys(scheduler.host_reservations_key('node')), [b'b'])
+
+    def test_renewing_extends_the_lease(self):
+        self.assertFalse(scheduler.renew_reservation('a', host='node'))
+        self.assertTrue(scheduler.try_reserve_resources('a', 6, host='node'))
+        later = time.time() + scheduler.RESERVATION_LEASE_SECONDS / 2
+        with mock.patch.object(scheduler.time, 'time', return_value=later):
+            self.assertTrue(scheduler.renew_reservation('a', host='node'))
+        with mock.patch.object(scheduler.time, 'time', return_value=later + scheduler.RESERVATION_LEASE_SECONDS - 1):
+            self.assertFalse(scheduler.try_reserve_resources('b', 6, host='node'))
+
+    def test_starving_job_is_admitted_before_smaller_jobs(self):
+        self.assertTrue(scheduler.try_reserve_resources('small-1', 6, host='node'))
+        self.assertFalse(scheduler.try_reserve_resources('large', 8, host='node', waited_seconds=300))
+        scheduler.release_resources('small-1', host='node')
+        self.assertFalse(scheduler.try_reserve_resources('small-2', 2, host='node'))
+        self.assertTrue(scheduler.try_reserve_resources('large', 8, host='node', waited_seconds=315))
+        self.assertTrue(scheduler.try_reserve_resources('small-2', 2, host='node'))
+
+
+@mock.patch.multiple(fair_share, MAX_DISPATCHED_JOBS=2, USER_MAX_JOBS=2, GROUP_MAX_JOBS=0, BATCH_PARALLELISM=0, USER_WEIGHTS={})
+@mock.patch.object(Signature, 'apply_async')
+class FairShareTests(RedisMixin, SimpleTestCase):
+
+    def enqueue(self, owner, *job_uuids, priority='interactive'):
+        for job_uuid in job_uuids:
+            registry.register_job(owner, job_uuid)
+        signatures = [
+            signature('JIPipeRunner.tasks.run_jipipe_task', args=[{}, job_uuid, owner, ''], kwargs={'memory_gb': 1}).set(task_id=job_uuid)
+            for job_uuid in job_uuids
+        ]
+        fair_share.enqueue_jobs(signatures, owner, 1, priority)
+
+    def test_dispatches_in_fair_share_order_within_the_caps(self, apply_async):
+        self.enqueue('alice', 'a1', 'a2', 'a3')
+        self.enqueue('bob', 'b1')
+        self.assertEqual(fair_share.dispatch_jobs(), ['a1', 'b1'])
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertEqual(fair_share.queue_position('a2'), 1)
+        self.assertTrue(fair_share.release_job('b1'))
+        self.assertFalse(fair_share.release_job('b1'))
+        self.assertEqual(fair_share.dispatch_jobs(), ['a2'])
+
+    def test_claim_and_release_are_bound_to_the_node(self, apply_async):
+        self.enqueue('alice', 'a1')
+        fair_share.dispatch_jobs()
+        self.assertTrue(fair_share.claim_job('a1', 'node-1'))
+        self.assertFalse(fair_share.claim_job('a1', 'node-2'))
+        self.assertFalse(fair_share.release_job('a1', 'node-2'))
+        self.assertTrue(fair_share.release_job('a1', 'node-1'))
+        self.assertEqual(fair_share.dispatched_jobs(), {})
+
+    def test_jobs_of_lost_nodes_are_requeued(self, apply_async):
+        self.enqueue('alice', 'a1')
+        fair_share.dispatch_jobs()
+        fair_share.claim_job('a1', 'lost')
+        self.redis.zadd(nodes.HEARTBEATS_KEY, {'lost': time.time() - nodes.NODE_TIMEOUT - 1})
+        self.assertEqual(fair_share.requeue_lost_jobs(), ['a1'])
+        self.assertFalse(fair_share.claim_job('a1', 'lost'))
+        self.assertEqual(registry.get_job('a1')['state'], 'queued')
+        self.assertEqual(fair_share.dispatch_jobs(), ['a1'])
+
+    def test_nodes_only_get_jobs_of_the_priority_classes_they_serve(self, apply_async):
+        with mock.patch.object(nodes, 'NODE_NAME', 'node-1'):
+            nodes.register_node(['interactive'])
+        self.enqueue('alice', 'a1')
+        self.enqueue('bob', 'b1', priority='batch')
+        queues = {}
+        with mock.patch.object(Signature, 'apply_async', lambda sig: queues.update({sig.id: sig.options['queue']})):
+            self.assertEqual(fair_share.dispatch_jobs(), ['a1', 'b1'])
+        self.assertEqual(queues, {'a1': 'jipipe_node_node-1_interactive', 'b1': 'jipipe_batch'})
+        self.assertEqual(fair_share.dispatched_jobs()['a1']['node'], 'node-1')
+        self.assertNotIn('node', fair_share.dispatched_jobs()['b1'])
+
+    def test_stale_slots_are_reaped(self, apply_async):
+        self.enqueue('alice', 'a1', 'a2')
+        fair_share.dispatch_jobs()
+        fair_share.claim_job('a1', 'node-1')
+        fair_share.claim_job('a2', 'node-1')
+        registry.mark_job_started('a1', 'worker', node='node-1')
+        self.assertTrue(fair_share.renew_job_lease('a1', 'node-1'))
+        self.assertFalse(fair_share.renew_job_lease('a1', 'node-2'))
+        self.assertEqual(fair_share.reap_stale_jobs(), [])
+
+        # a1 stopped renewing its lease, a2 is still waiting for a worker
+        later = time.time() + scheduler.RESERVATION_LEASE_SECONDS + 1
+        with mock.patch.object(fair_share.time, 'time', return_value=later):
+            self.assertEqual(fair_share.reap_stale_jobs(), ['a1'])
+        self.assertEqual(list(fair_share.dispatched_jobs()), ['a2'])
+        self.assertEqual(registry.get_job('a1')['state'], 'failed')
+        self.assertIsNone(self.redis.hget(fair_share.JOB_SIGNATURES_KEY, 'a1'))
+
+    def test_cancelling_frees_only_slots_no_worker_claimed(self, apply_async):
+        self.enqueue('alice', 'a1', 'a2', 'a3')
+        fair_share.dispatch_jobs()
+        fair_share.claim_job('a1', 'node-1')
+        self.assertEqual(fair_share.cancel_job('a3'), 'pending')
+        self.assertEqual(fair_share.cancel_job('a2'), 'dispatched')
+        self.assertEqual(fair_share.cancel_job('a1'), 'claimed')
+        self.assertEqual(fair_share.cancel_job('a1'), 'claimed')
+        self.assertFalse(fair_share.claim_job('a2', 'node-1'))
+        self.assertEqual(list(fair_share.dispatched_jobs()), ['a1'])
+        self.assertIsNone(fair_share.queue_position('a3'))
+        self.assertIsNotNone(cancellation.cancel_requested_at('a1'))
+        self.assertEqual(fair_share.dispatch_jobs(), [])
+
+
+class FingerprintTests(RedisMixin, SimpleTestCase):
+    project = {'graph': {'nodes': {'input': {'jipipe:alias-id': 'define-dataset-ids', 'dataset-ids': [1]}}}}
+
+    def test_input_images_are_part_of_the_fingerprint(self):
+        fingerprint = fingerprints.compute_fingerprint(self.project, 'alice', {1: [[10, 1000]]})
+        self.assertEqual(fingerprint, fingerprints.compute_fingerprint(self.project, 'alice', {1: [[10, 1000]]}))
+        self.assertNotEqual(fingerprint, fingerprints.compute_fingerprint(self.project, 'alice', {1: [[10, 2000]]}))
+        self.assertNotEqual(fingerprint, fingerprints.compute_fingerprint(self.project, 'alice', {1: [[10, 1000], [11, 1000]]}))
+
+    def test_concurrent_submission_joins_the_unregistered_claim(self):
+        self.assertIsNone(fingerprints.claim_fingerprint('f', 'alice', 'first'))
+        self.assertEqual(fingerprints.claim_fingerprint('f', 'alice', 'second'), ('first', {'state': 'queued'}))
+
+    def test_abandoned_claim_is_replaced(self):
+        self.assertIsNone(fingerprints.claim_fingerprint('f', 'alice', 'first'))
+        later = time.time() + fingerprints.CLAIM_REGISTRATION_SECONDS + 1
+        with mock.patch.object(fingerprints.time, 'time', return_value=later):
+            self.assertIsNone(fingerprints.claim_fingerprint('f', 'alice', 'second'))
+        self.assertEqual(self.redis.hget(fingerprints.fingerprint_key('f'), 'job_uuid'), b'second')
+
+    def test_successful_jobs_are_reused_and_failed_jobs_replaced(self):
+        self.assertIsNone(fingerprints.claim_fingerprint('f', 'alice', 'first'))
+        registry.register_job('alice', 'first')
+        registry.finish_job('alice', 'first', exit_code=0)
+        self.assertEqual(fingerprints.claim_fingerprint('f', 'alice', 'second')[0], 'first')
+        registry.finish_job('alice', 'first', state='failed')
+        self.assertIsNone(fingerprints.claim_fingerprint('f', 'alice', 'second'))
+
+
+class RangeInputFormTests(SimpleTestCase):
+
+    def test_expands_ranges_and_single_ids(self):
+        form = RangeInputForm(data={'raw_number_list': '5-7, 2, 6-8'}, max_count=10)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['raw_number_list'], [2, 5, 6, 7, 8])
+
+    def test_rejects_huge_ranges_without_expanding_them(self):
+        form = RangeInputForm(data={'raw_number_list': '1-1000000000'}, max_count=1000)
+        with mock.patch('JIPipeRunner.forms.range', side_effect=AssertionError('expanded'), create=True):
+            self.assertFalse(form.is_valid())
+
+    def test_overlapping_ranges_are_counted_once(self):
+        self.assertTrue(RangeInputForm(data={'raw_number_list': '1-10, 5-10, 10'}, max_count=10).is_valid())
+        self.assertFalse(RangeInputForm(data={'raw_number_list': '1-10, 11'}, max_count=10).is_valid())
+
+
+class JobSessionTests(RedisMixin, SimpleTestCase):
+
+    def test_job_sessions_are_kept_in_redis_until_released(self):
+        session = {'host': 'omero', 'port': 4064, 'session_key': 'key', 'owned': True}
+        omero_session.store_job_session('job', session)
+        self.assertEqual(omero_session.job_session('job'), session)
+        self.assertGreater(self.redis.ttl(omero_session.job_session_key('job')), 0)
+        with mock.patch.object(omero_session, 'close_session'):
+            omero_session.release_job_session('job')
+        self.assertIsNone(omero_session.job_session('job'))
+
+    def test_shared_session_is_closed_after_the_last_job(self):
+        session = {'host': 'omero', 'port': 4064, 'session_key': 'key', 'owned': True}
+        for job_uuid in ('job-1', 'job-2'):
+            omero_session.store_job_session(job_uuid, session)
+        with mock.patch.object(omero_session, 'close_session') as close_session:
+            omero_session.release_job_session('job-1')
+            omero_session.release_job_session('job-1')
+            close_session.assert_not_called()
+            omero_session.release_job_session('job-2')
+            close_session.assert_called_once_with(session)
+        self.assertFalse(self.redis.exists(omero_session.JOB_SESSION_REFS_KEY, omero_session.JOB_SESSIONS_KEY))
+
+    def test_web_session_is_never_closed(self):
+        omero_session.store_job_session('job', {'host': 'omero', 'port': 4064, 'session_key': 'web', 'owned': False})
+        with mock.patch.object(omero_session, 'close_session') as close_session:
+            omero_session.release_job_session('job')
+        close_session.assert_not_called()
+
+    def test_job_sessions_idle_out_before_their_lifetime(self):
+        conn = mock.Mock(host='omero', port=4064)
+        conn.getSessionService.return_value.createUserSession.return_value.getUuid.return_value.val = 'job'
+        self.assertEqual(omero_session.session_info(conn)['session_key'], 'job')
+        time_to_live, time_to_idle, _ = conn.getSessionService.return_value.createUserSession.call_args[0]
+        self.assertLess(time_to_idle, time_to_live)
+
+    def test_sessions_that_cannot_be_joined_are_forgotten(self):
+        omero_session.store_job_session('job', {'host': 'omero', 'port': 4064, 'session_key': 'gone', 'owned': True})
+        with mock.patch.object(omero_session, 'BlitzGateway') as gateway:
+            gateway.return_value.connect.return_value = False
+            omero_session.keep_job_sessions_alive()
+        self.assertFalse(self.redis.hexists(omero_session.JOB_SESSIONS_KEY, 'gone'))
+
+    def test_falls_back_to_the_web_session(self):
+        conn = mock.Mock(host='omero', port=4064)
+        conn.getSessionService.side_effect = RuntimeError('no session service')
+        conn._getSessionId.return_value = 'web'
+        with self.assertLogs(omero_session.logger, 'ERROR'):
+            self.assertEqual(omero_session.session_info(conn)['session_key'], 'web')
+
+
+JOB_IDS = ['00000000-0000-0000-0000-00000000000%d' % index for index in range(1, 6)]
+
+
+class JobHistoryTests(RedisMixin, TestCase):
+
+    def test_changes_of_a_job_are_merged(self):
+        registry.register_job('alice', JOB_IDS[0], pipeline='p')
+        registry.mark_job_started(JOB_IDS[0], 'worker', node='node-1')
+        registry.finish_job('alice', JOB_IDS[0], exit_code=0)
+        self.assertEqual(job_history.flush_job_history(), 3)
+        job = Job.objects.get()
+        self.assertEqual((job.owner, job.pipeline, job.node, job.state, job.exit_code), ('alice', 'p', 'node-1', 'finished', 0))
+        self.assertEqual(job_history.flush_job_history(), 0)
+
+    def test_events_are_kept_when_the_database_write_fails(self):
+        registry.register_job('alice', JOB_IDS[0])
+        with mock.patch.object(Job.objects, 'bulk_create', side_effect=DatabaseError('locked')):
+            with self.assertRaises(DatabaseError):
+                job_history.flush_job_history()
+        registry.finish_job('alice', JOB_IDS[0], state='failed')
+        self.assertEqual(job_history.flush_job_history(), 1)
+        self.assertEqual(job_history.flush_job_history(), 1)
+        self.assertEqual(Job.objects.get().state, 'failed')
+
+    def test_jobs_without_submission_event_are_created_from_the_registry(self):
+        registry.register_job('alice', JOB_IDS[0], pipeline='p')
+        self.redis.delete(registry.JOB_EVENTS_KEY)
+        registry.finish_job('alice', JOB_IDS[0], state='cancelled')
+        job_history.flush_job_history()
+        job = Job.objects.get()
+        self.assertEqual((job.owner, job.pipeline, job.state), ('alice', 'p', 'cancelled'))
+
+    def test_flushes_wait_for_each_other(self):
+        registry.register_job('alice', JOB_IDS[0])
+        lock = self.redis.lock(job_history.HISTORY_LOCK_KEY)
+        lock.acquire()
+        with mock.patch.object(job_history, 'HISTORY_LOCK_WAIT', 0.1):
+            self.assertEqual(job_history.flush_job_history(), 0)
+        lock.release()
+        self.assertEqual(job_history.flush_job_history(), 1)
+
+    def test_pages_follow_the_cursor_without_gaps(self):
+        submitted_at = job_history.datetime(2024, 1, 1, tzinfo=job_history.timezone.utc)
+        for index, job_id in enumerate(JOB_IDS):
+            # Two jobs share each submission time, so the ID breaks the tie
+            Job.objects.create(id=job_id, owner='alice', submitted_at=submitted_at.replace(minute=index // 2))
+        Job.objects.create(id='00000000-0000-0000-0000-000000000009', owner='bob', submitted_at=submitted_at)
+
+        pages, cursor = [], None
+        while True:
+            jobs, cursor = job_history.list_job_history('alice', limit=2, cursor=cursor)
+            pages.append([job['job_id'][-1] for job in jobs])
+            if cursor is None:
+                break
+        self.assertEqual(pages, [['5', '4'], ['3', '2'], ['1']])
+        self.assertEqual(job_history.list_job_history('alice', states=['running'])[0], [])
+
+
+class LogStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.log_dir = temp_dir.name
+        self.log_file = os.path.join(self.log_dir, 'job.log')
+        with open(self.log_file, 'w') as log_file:
+            log_file.writelines(f'line {number}\n' for number in range(20))
+            log_file.write('ERROR: (a+)+$ failed\n')
+
+    @mock.patch.object(logs, 'LOG_SEGMENT_BYTES', 32)
+    def test_archived_logs_keep_lines_and_cursors(self):
+        lines, cursor, _ = logs.read_log_from(self.log_file, 0, max_bytes=16)
+        logs.archive_log(self.log_file)
+        self.assertFalse(os.path.exists(self.log_file))
+        self.assertGreater(len(logs._load_archive(self.log_file)['segments']), 1)
+        has_more = True
+        while has_more:
+            rest, cursor, has_more = logs.read_log_from(self.log_file, cursor)
+            lines += rest
+        self.assertEqual(lines, [f'line {number}' for number in range(20)] + ['ERROR: (a+)+$ failed'])
+
+    def test_search_matches_the_pattern_literally(self):
+        matches, _, _ = logs.search_log(self.log_file, pattern='(a+)+$')
+        self.assertEqual([match['line'] for match in matches], [20])
+        self.assertEqual(logs.search_log(self.log_file, pattern='line.1')[0], [])
+        self.assertEqual(len(logs.search_log(self.log_file, level='error')[0]), 1)
+
+    def test_prune_deletes_logs_that_were_never_archived(self):
+        fresh_log = os.path.join(self.log_dir, 'fresh.log')
+        open(fresh_log, 'w').close()
+        expired = time.time() - (logs.LOG_RETENTION_DAYS + 1) * 86400
+        os.utime(self.log_file, (expired, expired))
+        self.assertEqual(logs.prune_logs(self.log_dir, force=True), 1)
+        self.assertFalse(os.path.exists(self.log_file))
+        self.assertTrue(os.path.exists(fresh_log))
+
+
+@skipIf(views is None, 'omeroweb is not installed')
+class LogViewTests(RedisMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.log_file = os.path.join(temp_dir.name, 'job-1.log')
+        with open(self.log_file, 'w') as log_file:
+            log_file.writelines(f'line {number}\n' for number in range(20))
+        registry.register_job('alice', 'job-1')
+        for name, value in (('LOG_DIR', temp_dir.name), ('owner_name', lambda conn: 'alice')):
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fetch(self, cursor):
+        # Follow the cursors returned by the view (called without the OMERO.web login) as the log window does
+        lines, has_more = [], True
+        while has_more:
+            request = RequestFactory().get('/JIPipeRunner/fetch_jipipe_logs/job-1/', {'cursor': cursor})
+            response = inspect.unwrap(views.fetch_jipipe_logs)(request, 'job-1', conn=mock.Mock())
+            self.assertEqual(response.status_code, 200)
+            content = json.loads(response.content)
+            lines += content['logs']
+            cursor, has_more = content['cursor'], content['has_more']
+        return lines, cursor
+
+    @mock.patch.object(logs, 'LOG_SEGMENT_BYTES', 32)
+    def test_cursors_return_the_same_lines_after_archiving(self):
+        middle = len(''.join(f'line {number}\n' for number in range(7)))
+        live = [self.fetch(cursor) for cursor in (0, middle)]
+        logs.archive_log(self.log_file)
+        self.assertFalse(os.path.exists(self.log_file))
+        self.assertEqual([self.fetch(cursor) for cursor in (0, middle)], live)
+        self.assertEqual(live[1][0], [f'line {number}' for number in range(7, 20)])
+
+
+class LogPumpTests(SimpleTestCase):
+
+    @mock.patch('JIPipeRunner.log_pump.LOG_PUMP_QUEUE_BYTES', 8)
+    def test_all_lines_pass_a_full_queue(self):
+        read_end, write_end = os.pipe()
+        written = []
+
+        def child():
+            with os.fdopen(write_end, 'wb', buffering=0) as output:
+                for number in range(200):
+                    output.write(f'line {number}\n'.encode())
+
+        def slow_write(text):
+            time.sleep(0.001)
+            written.append(text)
+
+        thread = threading.Thread(target=child)
+        thread.start()
+        with os.fdopen(read_end, 'rb') as pipe:
+            LogPump(pipe, slow_write).run()
+        thread.join()
+        self.assertEqual(''.join(written).splitlines(), [f'line {number}' for number in range(200)])
+
+
+# Stands in for Xvfb: creates the display socket, then idles with "Xvfb :<display>" as command line.
+# The display in FAKE_XVFB_BROKEN exits right away instead
+FAKE_XVFB = """#!/bin/bash
+[ "$1" = ":$FAKE_XVFB_BROKEN" ] && exit 1
+touch "$FAKE_X11_DIR/X${1#:}"
+exec -a Xvfb %s -c 'import time; time.sleep(60)' "$1"
+""" % sys.executable
+
+
+@skipIf(not sys.platform.startswith('linux'), 'the display pool checks processes through /proc')
+@mock.patch.object(streams, 'STREAM_HEARTBEAT_SECONDS', 0.05)
+class StreamTests(RedisMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.log_file = os.path.join(temp_dir.name, 'job.log')
+        with open(self.log_file, 'w') as log_file:
+            log_file.write('line 0\n')
+        registry.register_job('alice', 'job-1')
+        registry.mark_job_started('job-1', 'worker')
+        patcher = mock.patch.object(streams, 'create_async_redis', lambda: fakeredis.FakeAsyncRedis(server=self.redis_server))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def collect(self, *steps):
+        # Read the events of the stream, running each step once the events before it were sent
+        async def run():
+            stream = streams.stream_job_events('job-1', self.log_file, 0)
+            events = [await stream.__anext__()]
+            for step in steps:
+                await asyncio.to_thread(step)
+                events.append(await stream.__anext__())
+            events += [event async for event in stream]
+            return events
+        return asyncio.run(run())
+
+    def test_stream_ends_with_the_finished_status(self):
+        def finish():
+            with open(self.log_file, 'a') as log_file:
+                log_file.write('line 1\n')
+            streams.publish_log_lines('job-1', ['line 1'], 7, 14)
+            streams.publish_status('job-1', 'finished')
+        events = self.collect(finish)
+        self.assertEqual(events, [
+            streams._format_event('log', {'lines': ['line 0'], 'cursor': 7}, 7),
+            streams._format_event('log', {'lines': ['line 1'], 'cursor': 14}, 14),
+            streams._format_event('status', {'status': 'finished'}),
+        ])
+
+    def test_stream_ends_on_keep_alive_once_the_job_ended_without_message(self):
+        for end_job in (lambda: registry.finish_job('alice', 'job-1', state='cancelled'), lambda: self.redis.delete(registry.job_key('job-1'))):
+            with self.subTest(end_job=end_job):
+                registry.update_job('job-1', state='running')
+                events = self.collect(lambda: None, end_job)
+                self.assertEqual(events[1:], [': keep-alive\n\n', streams._format_event('status', {'status': 'finished'})])
+
+
+class DisplayPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.pool_dir = os.path.join(temp_dir.name, 'pool')
+        self.x11_dir = os.path.join(temp_dir.name, 'x11')
+        bin_dir = os.path.join(temp_dir.name, 'bin')
+        os.makedirs(self.x11_dir)
+        os.makedirs(bin_dir)
+        xvfb = os.path.join(bin_dir, 'Xvfb')
+        with open(xvfb, 'w') as script:
+            script.write(FAKE_XVFB)
+        os.chmod(xvfb, os.stat(xvfb).st_mode | stat.S_IEXEC)
+
+        self.addCleanup(self.stop_servers)
+        for patcher in (
+            mock.patch.dict(os.environ, {
+                'PATH': bin_dir + os.pathsep + os.environ.get('PATH', ''),
+                'FAKE_X11_DIR': self.x11_dir,
+                'FAKE_XVFB_BROKEN': '',
+            }),
+            mock.patch.object(displays, 'DISPLAY_POOL_DIR', self.pool_dir),
+            mock.patch.object(displays, 'DISPLAY_POOL_FIRST', 190),
+            mock.patch.object(displays, 'DISPLAY_POOL_SIZE', 2),
+            mock.patch.object(displays, '_display_socket', lambda display_number: os.path.join(self.x11_dir, f'X{display_number}')),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def server_pid(self, display_number):
+        return displays._read_pid(os.path.join(self.pool_dir, f'display_{display_number}.pid'))
+
+    def stop_servers(self):
+        for display_number in (190, 191):
+            pid = self.server_pid(display_number)
+            if pid is not None and displays._is_display_server(pid, display_number):
+                os.kill(pid, signal.SIGKILL)
+                with contextlib.suppress(ChildProcessError):
+                    os.waitpid(pid, 0)
+
+    def test_leases_are_exclusive_and_returned(self):
+        with displays.lease_display() as first:
+            with displays.lease_display() as second:
+                self.assertEqual((first, second), (190, 191))
+            pid = self.server_pid(191)
+            with displays.lease_display() as again:
+                self.assertEqual(again, 191)
+        self.assertEqual(self.server_pid(191), pid)
+
+    def test_dead_display_is_restarted(self):
+        with displays.lease_display():
+            pid = self.server_pid(190)
+        os.kill(pid, signal.SIGKILL)
+        with contextlib.suppress(ChildProcessError):
+            os.waitpid(pid, 0)
+        with displays.lease_display() as display_number:
+            self.assertEqual(display_number, 190)
+            self.assertNotEqual(self.server_pid(190), pid)
+            self.assertTrue(displays._is_display_server(self.server_pid(190), 190))
+
+    def test_reused_pid_is_never_signalled(self):
+        os.makedirs(self.pool_dir)
+        with open(os.path.join(self.pool_dir, 'display_190.pid'), 'w') as pid_file:
+            pid_file.write(str(os.getpid()))
+        with mock.patch.object(displays.os, 'kill') as kill, displays.lease_display():
+            kill.assert_not_called()
+        self.assertNotEqual(self.server_pid(190), os.getpid())
+
+    def test_display_failing_to_start_is_skipped(self):
+        with mock.patch.dict(os.environ, {'FAKE_XVFB_BROKEN': '190'}):
+            with self.assertLogs(displays.logger, 'ERROR'), displays.lease_display() as display_number:
+                self.assertEqual(display_number, 191)
+
+    def test_headless_only_without_gui_nodes(self):
+        macro = {'graph': {'nodes': {'a': {'jipipe:node-info-id': 'ij1-run-macro'}}}}
+        table = {'graph': {'nodes': {'a': {'jipipe:node-info-id': 'table-column-to-string'}}}}
+        self.assertTrue(displays.project_requires_gui(macro))
+        self.assertFalse(displays.project_requires_gui(table))
+        with mock.patch.object(displays, 'DISPLAY_MODE', 'auto'):
+            with displays.display_for_job(table) as display:
+                self.assertEqual(display.options, ['--headless'])
+            with displays.display_for_job(macro) as display:
+                self.assertEqual(display.env, {'DISPLAY': ':190'})
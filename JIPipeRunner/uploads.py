@@ -0,0 +1,234 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+import omero.model
+from django.conf import settings
+from omero.gateway import BlitzGateway
+from omero.rtypes import rlong, rstring
+
+from JIPipeRunner.omero_cache import forget_results_project
+
+# Upload the files written to the output folder of a job to the results project in OMERO
+UPLOAD_OUTPUTS = getattr(settings, 'JIPIPE_UPLOAD_OUTPUTS', False)
+
+# Number of parallel uploads (each with its own OMERO connection)
+UPLOAD_WORKERS = getattr(settings, 'JIPIPE_UPLOAD_WORKERS', 4)
+
+# Size of the chunks written to the OMERO raw file store
+UPLOAD_CHUNK_BYTES = getattr(settings, 'JIPIPE_UPLOAD_CHUNK_BYTES', 1024 * 1024)
+
+# Seconds between scans of the output folder and seconds a file must be unchanged to count as finished
+UPLOAD_SCAN_SECONDS = 2
+UPLOAD_SETTLE_SECONDS = 5
+
+# Namespace of the file annotations created for uploaded outputs
+OUTPUT_NAMESPACE = 'hki-jena.de/jipipe-runner/output'
+
+# Intialize the logger
+logger = logging.getLogger(__name__)
+
+
+class OutputUploader:
+    """
+    Uploads the outputs of a running JIPipe job to OMERO while the job runs.
+    A watcher thread scans the output folder and hands every file that stopped
+    changing to a bounded pool of upload threads. Each upload thread joins the
+    OMERO session of the user with its own connection, writes the file in
+    chunks to a raw file store, verifies the SHA-1 checksum computed by OMERO
+    and attaches the file to the results project.
+    """
+
+    def __init__(self, omero_session: dict, results_project_id: int, output_dir: str, started_at: float):
+        """
+        param omero_session: OMERO session of the user (see omero_session.session_info)
+        param results_project_id: ID of the project the outputs are attached to
+        param output_dir: Output folder of the JIPipe job
+        param started_at: Start time of the job, older files are skipped
+        """
+        self.omero_session = omero_session
+        self.results_project_id = results_project_id
+        self.output_dir = output_dir
+        self.started_at = started_at
+        self.executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='jipipe-upload')
+        self.futures = []
+        self.submitted = set()
+        self.candidates: Dict[str, Tuple[int, float]] = {}
+        self.results: List[Tuple[str, int, Optional[str]]] = []
+        self.results_lock = threading.Lock()
+        self.connections: List[BlitzGateway] = []
+        self.thread_state = threading.local()
+        self.stop_event = threading.Event()
+        self.watcher = threading.Thread(target=self._watch, name='jipipe-upload-watcher', daemon=True)
+
+    def start(self) -> None:
+        """
+        Start watching the output folder.
+        """
+        self.watcher.start()
+
+    def finish(self) -> dict:
+        """
+        Upload all remaining outputs after the job finished, wait for all
+        uploads and close the OMERO connections.
+        Returns a summary with the number of uploaded and failed files.
+        """
+        finish_started = time.monotonic()
+        self.stop_event.set()
+        self.watcher.join()
+
+        # All files are final once the job exited
+        self._scan(settled_only=False)
+        wait(self.futures)
+        return self._close(finish_started)
+
+    def abort(self) -> dict:
+        """
+        Stop uploading after the job was cancelled: outputs not yet uploaded
+        are dropped, only the uploads already in progress are completed.
+        Returns the same summary as finish.
+        """
+        finish_started = time.monotonic()
+        self.stop_event.set()
+        self.watcher.join()
+        for future in self.futures:
+            future.cancel()
+        wait(self.futures)
+        return self._close(finish_started)
+
+    def _close(self, finish_started: float) -> dict:
+        # Close the upload threads and OMERO connections and summarize the uploads
+        self.executor.shutdown()
+        for conn in self.connections:
+            conn.close(hard=False)
+
+        failed = [(path, error) for path, _, error in self.results if error]
+        return {
+            'uploaded': len(self.results) - len(failed),
+            'bytes': sum(size for _, size, error in self.results if not error),
+            'failed': failed,
+            'seconds_after_job': round(time.monotonic() - finish_started, 1),
+        }
+
+    def _watch(self) -> None:
+        while not self.stop_event.wait(UPLOAD_SCAN_SECONDS):
+            try:
+                self._scan(settled_only=True)
+            except Exception:
+                logger.exception('Failed to scan JIPipe output folder %s', self.output_dir)
+
+    def _scan(self, settled_only: bool) -> None:
+        # Submit every new output file that did not change since the last scan
+        now = time.time()
+        for directory, _, file_names in os.walk(self.output_dir):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                if path in self.submitted:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime < self.started_at:
+                    continue
+
+                signature = (stat.st_size, stat.st_mtime)
+                previous = self.candidates.get(path)
+                self.candidates[path] = signature
+                if settled_only and (previous != signature or now - stat.st_mtime < UPLOAD_SETTLE_SECONDS):
+                    continue
+
+                self.submitted.add(path)
+                self.futures.append(self.executor.submit(self._upload, path))
+
+    def _connection(self) -> BlitzGateway:
+        # Every upload thread joins the session of the user with its own connection
+        conn = getattr(self.thread_state, 'conn', None)
+        if conn is None:
+            conn = BlitzGateway(host=self.omero_session['host'], port=self.omero_session['port'])
+            if not conn.connect(sUuid=self.omero_session['session_key']):
+                raise ConnectionError('Failed to join the OMERO session of the user')
+            self.thread_state.conn = conn
+            with self.results_lock:
+                self.connections.append(conn)
+        return conn
+
+    def _upload(self, path: str) -> None:
+        size = os.path.getsize(path)
+        error = None
+        try:
+            self._upload_file(self._connection(), path, size)
+        except Exception as upload_error:
+            logger.exception('Failed to upload JIPipe output %s', path)
+            error = str(upload_error)
+        with self.results_lock:
+            self.results.append((os.path.relpath(path, self.output_dir), size, error))
+
+    def _upload_file(self, conn: BlitzGateway, path: str, size: int) -> None:
+        relative_path = os.path.relpath(path, self.output_dir)
+        update_service = conn.getUpdateService()
+
+        # Create the original file entry
+        original_file = omero.model.OriginalFileI()
+        original_file.setName(rstring(os.path.basename(path)))
+        original_file.setPath(rstring(os.path.dirname(relative_path)))
+        original_file.setSize(rlong(size))
+        original_file.setMimetype(rstring(mimetypes.guess_type(path)[0] or 'application/octet-stream'))
+        original_file = update_service.saveAndReturnObject(original_file, conn.SERVICE_OPTS)
+
+        # Write the file content in chunks and compute the checksum on the way
+        checksum = hashlib.sha1()
+        raw_file_store = conn.c.sf.createRawFileStore()
+        try:
+            raw_file_store.setFileId(original_file.getId().getValue(), conn.SERVICE_OPTS)
+            offset = 0
+            with open(path, 'rb') as file_handle:
+                while True:
+                    chunk = file_handle.read(UPLOAD_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    raw_file_store.write(chunk, offset, len(chunk), conn.SERVICE_OPTS)
+                    checksum.update(chunk)
+                    offset += len(chunk)
+            original_file = raw_file_store.save(conn.SERVICE_OPTS)
+        finally:
+            raw_file_store.close()
+
+        # Verify the checksum computed by the OMERO server
+        server_hash = original_file.getHash().getValue() if original_file.getHash() else None
+        if server_hash and server_hash != checksum.hexdigest():
+            raise IOError(f'Checksum mismatch for {relative_path}')
+
+        # Attach the file to the results project
+        file_annotation = omero.model.FileAnnotationI()
+        file_annotation.setFile(omero.model.OriginalFileI(original_file.getId().getValue(), False))
+        file_annotation.setNs(rstring(OUTPUT_NAMESPACE))
+        file_annotation.setDescription(rstring(relative_path))
+        project_link = omero.model.ProjectAnnotationLinkI()
+        project_link.setParent(omero.model.ProjectI(self.results_project_id, False))
+        project_link.setChild(file_annotation)
+        try:
+            update_service.saveObject(project_link, conn.SERVICE_OPTS)
+        except Exception:
+            # Let the next submission find or create the project again if the user deleted it
+            if conn.getObject('Project', self.results_project_id) is None:
+                forget_results_project(self.results_project_id)
+            raise
+
+
+def format_upload_summary(summary: dict) -> str:
+    """
+    Format the summary of an OutputUploader for the job log.
+    """
+    lines = [
+        f"[ Uploaded {summary['uploaded']} output files ({summary['bytes'] / 1024 ** 2:.1f} MB) to OMERO, "
+        f"{len(summary['failed'])} failed, {summary['seconds_after_job']} s after the job finished ]"
+    ]
+    for path, error in summary['failed']:
+        lines.append(f"[ Upload failed: {path}: {error} ]")
+    return '\n'.join(lines) + '\n'
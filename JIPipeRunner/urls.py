@@ -5,8 +5,17 @@ urlpatterns = [
     path('jipipe_runner_index/', views.jipipe_runner_index, name='jipipe_runner_index'),
     path('get_jipipe_config/<int:jip_file_id>/', views.get_jipipe_config, name='get_jipipe_config'),
     path("jipipe_start_job/", views.start_jipipe_job, name="jipipe_start_job"),
+    path("job_status/<str:job_uuid>/", views.jipipe_job_status, name="jipipe_job_status"),
+    path("jobs_status/", views.jipipe_jobs_status, name="jipipe_jobs_status"),
+    path("job_history/", views.jipipe_job_history, name="jipipe_job_history"),
     path("fetch_jipipe_logs/<str:job_uuid>/", views.fetch_jipipe_logs, name="fetch_jipipe_logs"),
+    path("stream_jipipe_logs/<str:job_uuid>/", views.stream_jipipe_logs, name="stream_jipipe_logs"),
+    path("search_jipipe_logs/<str:job_uuid>/", views.search_jipipe_logs, name="search_jipipe_logs"),
     path("stop_jipipe_job/", views.stop_jipipe_job, name="stop_jipipe_job"),
+    path("jipipe_start_batch/", views.start_jipipe_batch, name="jipipe_start_batch"),
+    path("jipipe_batch_status/<str:batch_id>/", views.jipipe_batch_status, name="jipipe_batch_status"),
+    path("stop_jipipe_batch/", views.stop_jipipe_batch, name="stop_jipipe_batch"),
     path("list_jipipe_jobs/", views.list_jipipe_jobs, name="list_jipipe_jobs"),
     path("list_jipipe_files/", views.list_jipipe_files, name="list_jipipe_files"),
+    path("metrics/", views.jipipe_metrics, name="jipipe_metrics"),
 ]
\ No newline at end of file
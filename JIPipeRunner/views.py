@@ -1,32 +1,80 @@
+import copy
+import functools
+import hmac
 import json
 import logging
 import os
-import signal
+import time
 import uuid
-from typing import Optional
+from typing import Callable, Optional
 
 from django.conf import settings
 from django.core.cache import cache
-from django.http import Http404, HttpResponse, JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.views.decorators.gzip import gzip_page
 from django.views.decorators.http import require_GET, require_POST
 
 from JIPipePlugin.celery import app
+from JIPipeRunner.cancellation import CANCEL_GRACE_SECONDS
+from JIPipeRunner.config_cache import ByteLRUCache
+from JIPipeRunner.fair_share import cancel_job, dispatch_jobs, enqueue_jobs, job_priority, queue_position
+from JIPipeRunner.forms import RangeInputForm
+from JIPipeRunner.fingerprints import claim_fingerprint, compute_fingerprint
+from JIPipeRunner.job_history import HISTORY_MAX_PAGE_SIZE, HISTORY_PAGE_SIZE, flush_job_history_quietly, get_history_job, list_job_history
+from JIPipeRunner.logs import LOG_DIR, log_exists, log_has_exit_marker, log_stat, read_log_from, read_log_tail, search_log
+from JIPipeRunner.metrics import METRICS_TOKEN, current_trace_context, instrument_view, metrics_registry, prometheus_client
+from JIPipeRunner.models import IDs
+from JIPipeRunner.omero_cache import current_group_id, member_of_groups, owner_name
+from JIPipeRunner.omero_cache import results_project_id as get_results_project_id
+from JIPipeRunner.omero_session import release_job_session, session_info, store_job_session
+from JIPipeRunner.projects import ProjectValidationError, input_dataset_ids, prepare_project
+from JIPipeRunner.projects import loads as load_project
+from JIPipeRunner.registry import (
+    finish_job,
+    get_batch,
+    get_job,
+    is_active_job,
+    list_active_jobs_with_metadata,
+    list_batch_jobs_with_metadata,
+    register_batch,
+    register_job,
+)
+from JIPipeRunner.scheduler import resolve_job_memory_gb
+from JIPipeRunner.streams import stream_job_events
 from JIPipeRunner.tasks import run_jipipe_task
 from celery.result import AsyncResult
 
 import omero
-import omero.model
-from omero.rtypes import rstring
+import omero.sys
+from omero.rtypes import rlist, rlong
 from omeroweb.decorators import login_required
 
 
-# Directory where JIPipe log files are stored (customize via Django settings)
-LOG_DIR = getattr(settings, 'JIPIPE_LOG_ROOT', '/tmp/jipipe_logs')
-os.makedirs(LOG_DIR, exist_ok=True)
+# Maximum number of lines returned by a tail request on the first log load
+LOG_TAIL_MAX_LINES = getattr(settings, 'JIPIPE_LOG_TAIL_MAX_LINES', 5000)
 
-# Time (in seconds) to keep PIDs in cache before expiring (None == never expire)
-CACHE_TIMEOUT: Optional[int] = None
+# Time (in seconds) to keep the .jip file catalog of a user in cache
+FILES_CACHE_TIMEOUT: Optional[int] = getattr(settings, 'JIPIPE_FILES_CACHE_TIMEOUT', 300)
+
+# In-process cache of validated .jip files (size budget in bytes, customize via Django settings)
+CONFIG_CACHE = ByteLRUCache(getattr(settings, 'JIPIPE_CONFIG_CACHE_BYTES', 64 * 1024 * 1024))
+
+# Time (in seconds) the status of the active jobs of a user is shared between requests (e.g. several open tabs)
+STATUS_CACHE_SECONDS = getattr(settings, 'JIPIPE_STATUS_CACHE_SECONDS', 1)
+
+# Bounds of the poll delay suggested to clients (in milliseconds), and the time (in seconds)
+# without log output after which a running job counts as idle
+POLL_MIN_MS = getattr(settings, 'JIPIPE_POLL_MIN_MS', 1000)
+POLL_MAX_MS = getattr(settings, 'JIPIPE_POLL_MAX_MS', 30000)
+POLL_IDLE_SECONDS = getattr(settings, 'JIPIPE_POLL_IDLE_SECONDS', 60)
+
+# Largest number of finished jobs a client may ask for in one status request
+MAX_STATUS_JOB_IDS = 100
+
+# Largest number of datasets per batch
+MAX_BATCH_SIZE = getattr(settings, 'JIPIPE_MAX_BATCH_SIZE', 1000)
 
 # Intialize the logger
 logger = logging.getLogger(__name__)
@@ -43,62 +91,239 @@ def jipipe_runner_index(request, conn=None, **kwargs) -> HttpResponse:
 
 @require_POST
 @login_required()
+@instrument_view
 def start_jipipe_job(request, conn=None, **kwargs) -> JsonResponse:
     """
     Start a JIPipe job in the background using Celery.
-    Expects a JSON payload containing the .jip file content.
-    Returns JSON with the unique job ID of the started job.
-
-    URL: JIPipeRunner/start_jipipe_job/
+    Expects a JSON payload containing the .jip file content and accepts an
+    optional 'memory_gb' query parameter for the JVM heap of the job and an
+    optional 'priority' query parameter ('interactive' or 'batch').
+    The job waits in the fair-share queue of the user until it is dispatched
+    to Celery (see fair_share.dispatch_jobs).
+    Returns JSON with the unique job ID, the priority class and the
+    estimated queue position of the started job.
+    If an identical job (same normalized project, inputs, owner and JIPipe
+    version) is still running or already succeeded, no new job is started
+    and the response links the existing job instead ('reused' is set to its
+    state). Pass 'force=1' to always start a new job.
+
+    URL: JIPipeRunner/start_jipipe_job/?memory_gb=<int>&priority=<interactive|batch>&force=<0|1>
     param request: Django HTTP request object
     param conn: OMERO connection object (optional, used for user context)
     """
 
     # Parse the incoming configuration
-    jipipe_json = json.loads(request.body.decode('utf-8'))
+    try:
+        jipipe_json = load_project(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    # Get the requested JVM heap of the job (admin-defined default and cap apply)
+    try:
+        memory_gb = resolve_job_memory_gb(request.GET.get('memory_gb'))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid memory_gb'}, status=400)
+
+    # Get the priority class of the job (large jobs always run as batch jobs)
+    try:
+        priority = job_priority(memory_gb, request.GET.get('priority'))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid priority'}, status=400)
 
     cache.set('test_key', 'from_view', timeout=120)
 
-    # TODO: Validate the JIPipe JSON structure here for security and correctness
+    # Ensure there is a JIPipeResults project to store outputs, then validate the
+    # project and point its output nodes to the results project in one pass
+    results_project_id = get_results_project_id(conn)
+    try:
+        prepare_project(jipipe_json, results_project_id)
+    except ProjectValidationError as validation_error:
+        return JsonResponse({'error': 'Invalid JIPipe project', 'details': validation_error.errors}, status=400)
+
+    # Register the job, or link an identical job that is still running or already succeeded
+    owner = owner_name(conn)
+    omero_session = functools.cache(functools.partial(session_info, conn))
+    job_uuid, reused_state, signature = _prepare_job(
+        owner,
+        jipipe_json,
+        memory_gb,
+        omero_session,
+        results_project_id,
+        input_versions=_input_versions(conn, input_dataset_ids(jipipe_json)),
+        force=request.GET.get('force') == '1',
+        jip_file_id=request.GET.get('jip_file_id', ''),
+        priority=priority,
+    )
+    if reused_state is not None:
+        return JsonResponse({
+            'job_id': job_uuid,
+            'reused': reused_state,
+            'results_project_id': results_project_id,
+        })
 
-    # Ensure there is a JIPipeResults project to store outputs
-    results_project = _get_or_create_results_project(conn)
-    results_project_id = int(results_project.getId())
+    # Queue the job for its owner and hand the next jobs to Celery in fair-share order
+    enqueue_jobs([signature], owner, current_group_id(conn), priority)
+    dispatch_jobs()
 
-    # Assign dataset IDs of target output dataset to the define-project-ids nodes to save outputs to
-    for node in jipipe_json.get('graph', {}).get('nodes', {}).values():
-        node_alias_id = node.get('jipipe:alias-id', '').lower()
-        if 'define-project-ids' in node_alias_id:
-            node['dataset-ids'] = [results_project_id]
+    return JsonResponse({'job_id': job_uuid, 'priority': priority, 'queue_position': queue_position(job_uuid)})
 
-    # Prepare the log file path and unique job identifier to reference the job later on
-    job_uuid = uuid.uuid4().hex
-    log_file = os.path.join(LOG_DIR, f'{job_uuid}.log')
+@require_POST
+@login_required()
+@instrument_view
+def start_jipipe_batch(request, conn=None, **kwargs) -> JsonResponse:
+    """
+    Start one JIPipe job per dataset for a pipeline and a range of dataset IDs.
+    Expects a JSON payload with the .jip file content as 'pipeline' and the
+    dataset IDs as 'dataset_ids' (e.g. "1-3, 5-8"). Each job gets one dataset
+    in all of its define-dataset-ids input nodes. The jobs are queued in the
+    batch priority class, so at most JIPIPE_BATCH_PARALLELISM batch jobs of
+    a user run at the same time and interactive jobs go first. Accepts the
+    same query parameters as start_jipipe_job (except 'priority').
+    Returns JSON with the batch ID and the job ID of every dataset.
+
+    URL: JIPipeRunner/jipipe_start_batch/?memory_gb=<int>&force=<0|1>
+    param request: Django HTTP request object
+    param conn: OMERO connection object (optional, used for user context)
+    """
+    try:
+        batch_request = load_project(request.body)
+        jipipe_json = batch_request['pipeline']
+        memory_gb = resolve_job_memory_gb(request.GET.get('memory_gb'))
+    except (KeyError, TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid batch request'}, status=400)
+
+    # Ensure there is a JIPipeResults project to store outputs and validate the pipeline once for all shards
+    results_project_id = get_results_project_id(conn)
+    try:
+        prepare_project(jipipe_json, results_project_id)
+    except ProjectValidationError as validation_error:
+        return JsonResponse({'error': 'Invalid JIPipe project', 'details': validation_error.errors}, status=400)
+
+    # Parse the dataset ID ranges and store them, the stored ID list identifies the batch
+    form = RangeInputForm(data={'raw_number_list': str(batch_request.get('dataset_ids', ''))}, max_count=MAX_BATCH_SIZE)
+    if not form.is_valid() or not form.cleaned_data['raw_number_list']:
+        return JsonResponse({'error': f'A batch needs between 1 and {MAX_BATCH_SIZE} datasets'}, status=400)
+    dataset_ids = form.cleaned_data['raw_number_list']
+    batch_id = str(IDs.objects.create(id_list_field=dataset_ids).id)
+
+    # Prepare one job (shard) per dataset
+    owner = owner_name(conn)
+    omero_session = functools.cache(functools.partial(session_info, conn))
+    input_versions = _input_versions(conn, dataset_ids)
+    shard_jobs = {}
+    signatures = []
+    for dataset_id in dataset_ids:
+        shard_json = copy.deepcopy(jipipe_json)
+        for node in shard_json.get('graph', {}).get('nodes', {}).values():
+            if 'define-dataset-ids' in node.get('jipipe:alias-id', '').lower():
+                node['dataset-ids'] = [dataset_id]
+
+        job_uuid, _, signature = _prepare_job(
+            owner,
+            shard_json,
+            memory_gb,
+            omero_session,
+            results_project_id,
+            input_versions={dataset_id: input_versions.get(dataset_id, [])},
+            force=request.GET.get('force') == '1',
+            jip_file_id=request.GET.get('jip_file_id', ''),
+            batch_id=batch_id,
+            dataset_id=dataset_id,
+            priority='batch',
+        )
+        shard_jobs[str(dataset_id)] = job_uuid
+        if signature is not None:
+            signatures.append(signature)
+    register_batch(owner, batch_id, list(shard_jobs.values()))
 
-    # Update the cache to track active jobs for the user
-    owner = conn.getUser().getName()
-    user_key = f"active_jipipe_jobs_{owner}"
-    active = set(cache.get(user_key, []))
-    active.add(job_uuid)
-    cache.set(user_key, active, timeout=CACHE_TIMEOUT)
+    # Queue the shards in submission order, the fair share decides when each of them runs
+    enqueue_jobs(signatures, owner, current_group_id(conn), 'batch')
+    dispatch_jobs()
 
-    # Launch the background thread to run the JIPipe task using Celery and attach the unique job ID for reference
-    run_jipipe_task.apply_async(
-        args=[jipipe_json, job_uuid, owner, log_file],
-        task_id=job_uuid,
-        ignore_result=True,
-    )
+    return JsonResponse({'batch_id': batch_id, 'jobs': shard_jobs})
+
+@require_GET
+@login_required()
+@instrument_view
+def jipipe_batch_status(request, batch_id: str, conn=None, **kwargs) -> JsonResponse:
+    """
+    Get the progress of a batch: the number of jobs per state and the
+    state of every job (shard) of the batch.
+
+    URL: JIPipeRunner/jipipe_batch_status/<str:batch_id>/
+    param request: Django HTTP request object
+    param batch_id: Unique identifier for the batch
+    param conn: OMERO connection object (optional, used for user context)
+    """
+    batch = get_batch(batch_id)
+    if batch is None or batch['owner'] != owner_name(conn):
+        return JsonResponse({'error': 'Batch not found or not owned by you'}, status=404)
+
+    # Summarize the states of all shards
+    jobs = list_batch_jobs_with_metadata(batch_id)
+    counts = {}
+    for job in jobs.values():
+        counts[job.get('state', 'unknown')] = counts.get(job.get('state', 'unknown'), 0) + 1
+    finished = sum(counts.get(state, 0) for state in ('finished', 'failed', 'cancelled'))
+
+    return JsonResponse({
+        'batch_id': batch_id,
+        'total': int(batch['total']),
+        'done': finished,
+        'counts': counts,
+        'jobs': jobs,
+    })
+
+@require_POST
+@login_required()
+@instrument_view
+def stop_jipipe_batch(request, conn=None, **kwargs) -> JsonResponse:
+    """
+    Cancel all unfinished jobs of a batch.
+    Expects a JSON payload containing the batch_id to stop.
+    Jobs are cancelled as by stop_jipipe_job; 'cancelled' lists all of
+    them, 'cancelling' the running ones their workers still terminate.
+
+    URL: JIPipeRunner/stop_jipipe_batch/
+    param request: Django HTTP request object
+    param conn: OMERO connection object (optional, used for user context)
+    """
+    try:
+        batch_id = json.loads(request.body).get('batch_id')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    owner = owner_name(conn)
+    batch = get_batch(batch_id) if batch_id else None
+    if batch is None or batch['owner'] != owner:
+        return JsonResponse({'error': 'Batch not found or not owned by you'}, status=404)
 
-    return JsonResponse({'job_id': job_uuid})
+    # Cancel all shards that did not finish yet (only jobs of this batch, not reused jobs of other batches)
+    cancelled = []
+    cancelling = []
+    for job_uuid, job in list_batch_jobs_with_metadata(batch_id).items():
+        if job.get('batch_id') != batch_id or job.get('state') not in ('queued', 'running'):
+            continue
+        if _cancel_job(owner, job_uuid) == 'cancelling':
+            cancelling.append(job_uuid)
+        cancelled.append(job_uuid)
+    dispatch_jobs()
+
+    return JsonResponse({'status': 'terminated', 'batch_id': batch_id, 'cancelled': cancelled, 'cancelling': cancelling})
 
 @require_POST
 @login_required()
+@instrument_view
 def stop_jipipe_job(request, conn=None, **kwargs) -> JsonResponse:
     """
-    Stop a running JIPipe job by revoking the Celery task.
+    Cancel a JIPipe job. Queued jobs are removed right away. Running jobs
+    are flagged for their worker, which sends SIGTERM to the JIPipe process
+    group, SIGKILL after JIPIPE_CANCEL_GRACE_SECONDS, then frees the slot;
+    the job status reports the state 'cancelled' and the seconds from the
+    request until the slot was free as 'cancel_seconds'.
     Expects a JSON payload containing the job_id to stop.
-    Returns JSON with the status and job_id of the stopped 
-    job if successful, or an error otherwise.
+    Returns JSON with the status ('terminated' or 'cancelling') and job_id
+    of the stopped job if successful, or an error otherwise.
 
     URL: JIPipeRunner/stop_jipipe_job/
     param request: Django HTTP request object
@@ -111,20 +336,15 @@ def stop_jipipe_job(request, conn=None, **kwargs) -> JsonResponse:
         if not job_id:
             return JsonResponse({'error': 'Missing job_id'}, status=400)
         
-        # Get the current user and their active jobs from cache to verify ownership
-        owner = conn.getUser().getName()
-        user_key = f"active_jipipe_jobs_{owner}"
-        active = set(cache.get(user_key, []))
-        if job_id not in active:
+        # Verify that the job is active and owned by the current user
+        owner = owner_name(conn)
+        if not is_active_job(owner, job_id):
             return JsonResponse({'error': 'Job not found or not owned by you'}, status=404)
 
-        # Revoke the Celery task (terminate immediately with SIGTERM)
-        result = AsyncResult(job_id)
-        result.revoke(terminate=True, signal=signal.SIGTERM)
-
-        # Remove the job from the active jobs cache after successful revoke
-        active.discard(job_id)
-        cache.set(user_key, active, timeout=CACHE_TIMEOUT)
+        # Cancel the job and dispatch the next jobs into a freed slot
+        if _cancel_job(owner, job_id) == 'cancelling':
+            return JsonResponse({'status': 'cancelling', 'job_id': job_id, 'grace_seconds': CANCEL_GRACE_SECONDS})
+        dispatch_jobs()
 
         return JsonResponse({'status': 'terminated', 'job_id': job_id})
 
@@ -133,64 +353,208 @@ def stop_jipipe_job(request, conn=None, **kwargs) -> JsonResponse:
 
 @require_GET
 @login_required()
+@instrument_view
 def list_jipipe_jobs(request, conn=None, **kwargs):
     """
     List all active JIPipe jobs for the current user.
     Returns a JSON response with job IDs of currently 
-    running jobs owned by the current user.
+    running jobs owned by the current user and their
+    metadata (state, submit/start time, worker, pipeline,
+    queue position of jobs waiting to be dispatched).
     
     param request: Django HTTP request object
     param conn: OMERO connection object (optional, used for user context)
     """
 
-    # Get the current user and their active jobs from cache
-    owner = conn.getUser().getName()
-    user_key = f"active_jipipe_jobs_{owner}"
-    job_ids = cache.get(user_key, [])
-    return JsonResponse({'job_ids': list(job_ids)})
+    # Get the current user and their active jobs from the job registry
+    owner = owner_name(conn)
+    jobs = list_active_jobs_with_metadata(owner)
+    for job_uuid, job in jobs.items():
+        if job.get('state') == 'queued':
+            job['queue_position'] = queue_position(job_uuid)
+    return JsonResponse({'job_ids': list(jobs), 'jobs': jobs})
+
+@require_GET
+@login_required()
+@instrument_view
+def jipipe_job_history(request, conn=None, **kwargs) -> JsonResponse:
+    """
+    List the past and active JIPipe jobs of the current user from the job
+    history in the database, newest first. Pending state changes are written
+    to the history before reading. Pages are requested with the 'cursor'
+    returned as 'next_cursor' with the previous page ('next_cursor' is null
+    on the last page), so deep pages cost the same as the first one.
+
+    URL: JIPipeRunner/job_history/?limit=<int>&cursor=<str>&state=<state>,<state>
+    param request: Django HTTP request object
+    param conn: OMERO connection object (optional, used for user context)
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        states = [state for state in request.GET.get('state', '').split(',') if state]
+        flush_job_history_quietly()
+        jobs, next_cursor = list_job_history(owner_name(conn), limit, request.GET.get('cursor') or None, states)
+    except ValueError as parse_error:
+        return JsonResponse({'error': f'Invalid job history request: {parse_error}'}, status=400)
+    return JsonResponse({'jobs': jobs, 'next_cursor': next_cursor})
+
+# Helper: registry (or history) record of a job of the given user, 404 for unknown jobs and jobs of other users
+def _owned_job(job_uuid: str, owner: str) -> dict:
+    job = get_job(job_uuid) or get_history_job(job_uuid)
+    if job is None or job.get('owner') != owner:
+        raise Http404(f'Job not found: {job_uuid}')
+    return job
+
+# Helper: cancel a job, returns 'cancelling' while its worker terminates it, else the final state of the job
+def _cancel_job(owner: str, job_uuid: str) -> str:
+    # Flag the job and free its slot in one atomic step, unless a worker claimed it
+    outcome = cancel_job(job_uuid)
+
+    # The worker running the job terminates JIPipe, cleans up, frees the slot and records the end
+    if outcome == 'claimed':
+        return 'cancelling'
+
+    # Jobs without slot are ending on their worker already, or were lost before they started
+    if outcome == 'unknown':
+        state = (get_job(job_uuid) or {}).get('state')
+        if state == 'running':
+            return 'cancelling'
+        if state in ('finished', 'failed', 'cancelled'):
+            return state
+
+    # Pending and unclaimed jobs never start, workers skip their tasks
+    if outcome == 'dispatched':
+        AsyncResult(job_uuid).revoke()
+    finish_job(owner, job_uuid, state='cancelled', cancel_seconds=0)
+    release_job_session(job_uuid)
+    return 'cancelled'
+
+# Fields of the job registry returned by the job status endpoint
+JOB_STATUS_FIELDS = (
+    'state', 'pipeline', 'priority', 'submitted_at', 'started_at', 'ended_at', 'exit_code', 'cancel_seconds',
+    'progress_done', 'progress_total', 'progress_percent', 'current_node',
+    'error_count', 'last_error', 'progress_updated_at',
+)
+
+@require_GET
+@login_required()
+@instrument_view
+def jipipe_job_status(request, job_uuid: str, conn=None, **kwargs) -> JsonResponse:
+    """
+    Get the compact status record of a JIPipe job (state, progress, current
+    node and errors) from the job registry without reading its log. Jobs
+    waiting to be dispatched also report their estimated queue position.
+    The end of the log is returned as 'log_cursor'.
+    Jobs whose registry record expired are read from the job history.
+    If the job is unknown or owned by another user, returns a 404 error.
+
+    URL: JIPipeRunner/job_status/<str:job_uuid>/
+    param request: Django HTTP request object
+    param job_uuid: Unique identifier for the JIPipe job
+    param conn: OMERO connection object (optional, used for user context)
+    """
+    job = _owned_job(job_uuid, owner_name(conn))
+    return JsonResponse({'job_id': job_uuid, **_job_status_record(job_uuid, job)})
 
 @require_GET
 @login_required()
+@instrument_view
+def jipipe_jobs_status(request, conn=None, **kwargs) -> JsonResponse:
+    """
+    Get the status records (see jipipe_job_status) of all active jobs of the
+    current user in one response, plus the jobs listed in 'job_ids' (e.g.
+    jobs a page follows until their final state). Clients compare the
+    returned 'log_cursor' with their own cursor and only fetch the logs of
+    jobs with new output. The records of the active jobs are cached for
+    JIPIPE_STATUS_CACHE_SECONDS, so several open pages share one computation.
+    'next_poll_ms' suggests when to ask again: soon while jobs write output,
+    later for idle and queued jobs (by queue position) or without jobs.
+
+    URL: JIPipeRunner/jobs_status/?job_ids=<uuid>,<uuid>
+    param request: Django HTTP request object
+    param conn: OMERO connection object (optional, used for user context)
+    """
+    owner = owner_name(conn)
+    cache_key = f'jipipe_jobs_status_{owner}'
+    jobs = cache.get(cache_key)
+    if jobs is None:
+        jobs = {
+            job_uuid: _job_status_record(job_uuid, job)
+            for job_uuid, job in list_active_jobs_with_metadata(owner).items()
+        }
+        cache.set(cache_key, jobs, timeout=STATUS_CACHE_SECONDS)
+
+    # Add the requested jobs that are no longer active (unknown jobs and jobs of other users count as unknown)
+    requested = [job_uuid for job_uuid in request.GET.get('job_ids', '').split(',') if job_uuid]
+    for job_uuid in requested[:MAX_STATUS_JOB_IDS]:
+        if job_uuid not in jobs:
+            job = get_job(job_uuid) or get_history_job(job_uuid)
+            if job is None or job.get('owner') != owner:
+                jobs[job_uuid] = {'state': 'unknown'}
+            else:
+                jobs[job_uuid] = _job_status_record(job_uuid, job)
+
+    return JsonResponse({'jobs': jobs, 'next_poll_ms': _next_poll_ms(jobs)})
+
+@require_GET
+@login_required()
+@instrument_view
 def fetch_jipipe_logs(request, job_uuid: str, conn=None, **kwargs) -> JsonResponse:
     """
     Fetch the logs for a specific JIPipe job using its UUID.
     Expects the job UUID as a URL parameter.
-    Returns a JSON response with the job status and log lines.
-    If the job is not found, returns a 404 error.
-
-    URL: JIPipeRunner/fetch_jipipe_logs/<str:job_uuid>/
+    Accepts an optional 'cursor' query parameter (byte offset returned by the
+    previous call) to only return new log lines, or a 'tail' query parameter
+    to return the last N lines on the first load.
+    Returns a JSON response with the job status, the new log lines, the
+    cursor for the next call and whether more lines are already available.
+    If the job is unknown or owned by another user, returns a 404 error.
+
+    URL: JIPipeRunner/fetch_jipipe_logs/<str:job_uuid>/?cursor=<int>|tail=<int>
     param request: Django HTTP request object
     param job_uuid: Unique identifier for the JIPipe job
     param conn: OMERO connection object (optional, used for user context)
     """
     try:
+        # Only the owner of the job may read its log
+        owner = owner_name(conn)
+        _owned_job(job_uuid, owner)
+
         # Get the log file from LOG_DIR using the job UUID
         log_file = os.path.join(LOG_DIR, f'{job_uuid}.log')
         
-        # Raise an error if the log file does not exist
-        if not os.path.exists(log_file):
+        # Raise an error if neither a live nor an archived log exists
+        if not log_exists(log_file):
             raise Http404(f'Job not found: {job_uuid}')
 
-        # Get the log lines from the file to return them
-        with open(log_file, 'r') as file_handle:
-            log_lines = file_handle.read().splitlines()
+        # Read either the bounded tail of the log or the lines written after the cursor
+        tail = request.GET.get('tail')
+        has_more = False
+        if tail is not None:
+            line_count = min(max(int(tail), 0), LOG_TAIL_MAX_LINES)
+            log_lines, cursor = read_log_tail(log_file, line_count)
+        else:
+            cursor = int(request.GET.get('cursor', 0))
+            log_lines, cursor, has_more = read_log_from(log_file, cursor)
         
-        # Check if the job is still active by looking in the cache
-        owner = conn.getUser().getName()
-        user_key = f"active_jipipe_jobs_{owner}"
-        active = set(cache.get(user_key, []))
+        # Check if the job is still active by looking in the job registry
+        active = is_active_job(owner, job_uuid)
 
-        # Determine if the job finished by checking the exit code message or if it is still in the active set
-        finished = any('JIPipe exited with code' in line for line in log_lines[-3:]) or (job_uuid not in active)
+        # Determine if the job finished by checking the exit code message or if it is no longer active,
+        # recording its final state is left to the worker
+        finished = (not active) or log_has_exit_marker(log_file)
         status = 'finished' if finished else 'running'
 
-        # Remove the job from active cache if it has finished but not removed yet
-        if finished and job_uuid in active:
-            active.discard(job_uuid)
-            cache.set(user_key, active, timeout=CACHE_TIMEOUT)
-
-        return JsonResponse({'status': status, 'logs': log_lines})
+        return JsonResponse({
+            'status': status,
+            'logs': log_lines,
+            'cursor': cursor,
+            'has_more': has_more,
+        })
     
+    except Http404:
+        raise
+
     except Exception as parse_error:
         logger.exception('Failed to retrieve jipipe log: %s', parse_error)
         return HttpResponse(
@@ -198,12 +562,100 @@ def fetch_jipipe_logs(request, job_uuid: str, conn=None, **kwargs) -> JsonRespon
             status=400,
         )
 
+@require_GET
+@login_required()
+@instrument_view
+def search_jipipe_logs(request, job_uuid: str, conn=None, **kwargs) -> JsonResponse:
+    """
+    Search the log of a specific JIPipe job on the server.
+    Accepts the optional query parameters 'level' (minimum level: info,
+    warning or error), 'pattern' (text the lines contain), 'since' and 'until'
+    (UNIX timestamps), 'cursor' (returned by the previous call) and 'limit'.
+    Returns a JSON response with the matching lines, the cursor to continue
+    the search from and whether the log was not fully searched yet.
+    If the job is unknown or owned by another user, returns a 404 error.
+
+    URL: JIPipeRunner/search_jipipe_logs/<str:job_uuid>/?level=error&pattern=<text>&cursor=<int>
+    param request: Django HTTP request object
+    param job_uuid: Unique identifier for the JIPipe job
+    param conn: OMERO connection object (optional, used for user context)
+    """
+    _owned_job(job_uuid, owner_name(conn))
+    log_file = os.path.join(LOG_DIR, f'{job_uuid}.log')
+    if not log_exists(log_file):
+        raise Http404(f'Job not found: {job_uuid}')
+
+    try:
+        since = request.GET.get('since')
+        until = request.GET.get('until')
+        matches, cursor, has_more = search_log(
+            log_file,
+            level=request.GET.get('level') or None,
+            pattern=request.GET.get('pattern') or None,
+            since=float(since) if since else None,
+            until=float(until) if until else None,
+            cursor=int(request.GET.get('cursor', 0)),
+            limit=min(max(int(request.GET.get('limit', 1000)), 1), LOG_TAIL_MAX_LINES),
+        )
+    except ValueError as search_error:
+        return HttpResponse(f'Invalid log search: {search_error}', status=400)
+
+    return JsonResponse({'matches': matches, 'cursor': cursor, 'has_more': has_more})
+
+@require_GET
+@login_required()
+@instrument_view
+def stream_jipipe_logs(request, job_uuid: str, conn=None, **kwargs) -> HttpResponse:
+    """
+    Stream the logs and status changes of a specific JIPipe job as server-sent events.
+    Expects the job UUID as a URL parameter. The stream starts at the byte offset
+    given by the 'Last-Event-ID' header (set by reconnecting EventSources) or the
+    'cursor' query parameter and ends once the job finished.
+    If the job is unknown or owned by another user, returns a 404 error.
+    Streaming is only available when served through the ASGI application
+    (JIPipePlugin/asgi.py); otherwise a 501 error is returned and clients
+    fall back to polling fetch_jipipe_logs.
+
+    URL: JIPipeRunner/stream_jipipe_logs/<str:job_uuid>/?cursor=<int>
+    param request: Django HTTP request object
+    param job_uuid: Unique identifier for the JIPipe job
+    param conn: OMERO connection object (optional, used for user context)
+    """
+    # Long-lived streams would block a WSGI worker for the whole job, so only serve them via ASGI
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse('Log streaming requires the ASGI application.', status=501)
+
+    # Get the log file from LOG_DIR using the job UUID (only for jobs of the current user)
+    _owned_job(job_uuid, owner_name(conn))
+    log_file = os.path.join(LOG_DIR, f'{job_uuid}.log')
+    if not log_exists(log_file):
+        raise Http404(f'Job not found: {job_uuid}')
+
+    # Resume from the last delivered event or the requested cursor
+    try:
+        cursor = int(request.headers.get('Last-Event-ID') or request.GET.get('cursor', 0))
+    except ValueError:
+        return HttpResponse('Invalid cursor', status=400)
+
+    response = StreamingHttpResponse(
+        stream_job_events(job_uuid, log_file, cursor),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@gzip_page
 @login_required()
-def get_jipipe_config(request, jip_file_id: int, conn=None, **kwargs) -> JsonResponse:
+@instrument_view
+def get_jipipe_config(request, jip_file_id: int, conn=None, **kwargs) -> HttpResponse:
     """
     Fetch the .jip file based on its file ID in OMERO.
     Expects the file ID as a URL parameter.
-    Returns a JSON response with the parsed content of the .jip file.
+    Returns a JSON response with the content of the .jip file.
+    The file content is validated once and then cached by file ID, size and
+    hash, so unchanged pipelines are served from memory. Responses carry an
+    ETag; a matching If-None-Match header returns 304 without a body.
 
     URL: JIPipeRunner/get_jipipe_config/<jip_file_id>/
     param request: Django HTTP request object
@@ -213,81 +665,90 @@ def get_jipipe_config(request, jip_file_id: int, conn=None, **kwargs) -> JsonRes
     # Get the .jip file from OMERO using the provided file ID
     jip_file = conn.getObject('originalfile', jip_file_id)
 
-    # If the file does not exist, return a 404 error
+    # If the file does not exist (e.g. deleted since the catalog was cached), drop the cached catalog and return a 404 error
     if jip_file is None or not jip_file.getName().endswith('.jip'):
+        invalidate_jipipe_files_cache(owner_name(conn))
         return HttpResponse(f'.jip file with ID {jip_file_id} not found.', status=404)
-    
-    try:
-        # Read and parse the JSON data from the annotation
-        raw_bytes = b''.join(jip_file.getFileInChunks())
-        config_text = raw_bytes.decode('utf-8')
-        config_data = json.loads(config_text)
-    except Exception as parse_error:
-        logger.error('Failed to parse JIPipe JSON: %s', parse_error)
-        return HttpResponse(
-            f'Error parsing JIPipe JSON: {parse_error}',
-            status=400,
-        )
 
-    return JsonResponse(config_data, safe=False)
+    # Identify the file content by its size and hash (or modification time if no hash is set)
+    content_version = jip_file.getHash() or jip_file.getMtime()
+    cache_key = (int(jip_file_id), jip_file.getSize(), content_version)
+    etag = f'"jip-{jip_file_id}-{jip_file.getSize()}-{content_version}"'
+
+    # Return 304 if the client already has this version (gzip turns the ETag into a weak one)
+    if_none_match = request.headers.get('If-None-Match', '')
+    if etag in (tag.strip().removeprefix('W/') for tag in if_none_match.split(',')):
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+
+    raw_bytes = CONFIG_CACHE.get(cache_key)
+    if raw_bytes is None:
+        try:
+            # Read the file and validate that it contains JSON before caching it
+            raw_bytes = b''.join(jip_file.getFileInChunks())
+            load_project(raw_bytes)
+        except Exception as parse_error:
+            logger.error('Failed to parse JIPipe JSON: %s', parse_error)
+            return HttpResponse(
+                f'Error parsing JIPipe JSON: {parse_error}',
+                status=400,
+            )
+        CONFIG_CACHE.set(cache_key, raw_bytes)
+
+    # Pass the validated bytes straight through and let the browser revalidate via the ETag
+    response = HttpResponse(raw_bytes, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
 @login_required()
+@instrument_view
 def list_jipipe_files(request, conn=None, **kwargs) -> JsonResponse:
     """
     List all unique JIPipe-related files attached to projects in 
     all OMERO groups of the current user. 
     Returns a JSON response with file IDs and names.
+    The catalog is cached per user for JIPIPE_FILES_CACHE_TIMEOUT seconds;
+    pass 'refresh=1' (the reload button of the file selector) to bypass and
+    rebuild the cached catalog. It is also dropped when a listed file no
+    longer exists.
 
-    URL: JIPipeRunner/list_jipipe_files/
+    URL: JIPipeRunner/list_jipipe_files/?refresh=<0|1>
     param request: Django HTTP request object
     param conn: OMERO connection object (optional, used for user context)
     """
     try:
-        # Store the JIPipe files attached to projects in groups of current user
-        owned_project_annotation_files = []
-
-        # Set of seen file IDs to prevent duplicates
-        seen_file_ids = set()
-
-        # Get the list of groups the user is a member of to prevent unauthorized access
-        user_groups = conn.getGroupsMemberOf()
-
-        # Save the current group so we can switch back later
-        current_group = conn.getEventContext().groupId
-
-        # Iterate through each group the user is a member of
-        for group in user_groups:
-            group_id = group.getId()
-
-            # Switch to the group for accessing its projects
-            conn.setGroupForSession(group_id)
-
-            # Get all projects in the group
-            projects = list(conn.getObjects("Project"))
-
-            # Iterate through each project in the group
-            for project in projects:
-
-                # Get annotations (can include files, tags, etc.)
-                annotations = project.listAnnotations()
-
-                # Iterate through each annotation in the project to find JIPipe files
-                for ann in annotations:
-                    # Filter for file annotations that are JIPipe files
-                    if ann.OMERO_TYPE == omero.model.FileAnnotationI and ann.getFile().getName().endswith('.jip'):
-                        file_obj = ann.getFile()
-                        file_id = file_obj.getId()
-
-                        # If the file ID has not been seen before, add it to the list
-                        if file_id not in seen_file_ids:
-                            seen_file_ids.add(file_id)
-                            owned_project_annotation_files.append({
-                                "file_id": file_id,
-                                "file_name": file_obj.getName()
-                            })
+        # Return the cached catalog of the user unless a refresh is requested
+        owner = owner_name(conn)
+        files_key = _jipipe_files_cache_key(owner)
+        if request.GET.get('refresh') != '1':
+            cached_files = cache.get(files_key)
+            if cached_files is not None:
+                return JsonResponse({'files': cached_files})
+
+        # Get the IDs of the groups the user is a member of to prevent unauthorized access
+        group_ids = member_of_groups(conn)
+
+        # Find all .jip file annotations linked to projects in these groups with a single cross-group query
+        params = omero.sys.ParametersI()
+        params.addString('pattern', '%.jip')
+        params.add('gids', rlist([rlong(group_id) for group_id in group_ids]))
+        rows = conn.getQueryService().projection(
+            'select distinct f.id, f.name from ProjectAnnotationLink link '
+            'join link.child ann join ann.file f '
+            'where f.name like :pattern and link.details.group.id in (:gids) '
+            'order by f.name',
+            params,
+            {'omero.group': '-1'},
+        )
+        owned_project_annotation_files = [
+            {'file_id': row[0].val, 'file_name': row[1].val}
+            for row in rows
+        ]
 
-        # Switch back to the original group
-        conn.setGroupForSession(current_group)
+        # Cache the catalog so the next panel load is a single cache lookup
+        cache.set(files_key, owned_project_annotation_files, timeout=FILES_CACHE_TIMEOUT)
 
         return JsonResponse({'files': owned_project_annotation_files})
     
@@ -299,32 +760,133 @@ def list_jipipe_files(request, conn=None, **kwargs) -> JsonResponse:
             status=500
         )
 
-# Helper: ensure the results project exists
-def _get_or_create_results_project(conn) -> omero.gateway.ProjectWrapper:
+@require_GET
+def jipipe_metrics(request) -> HttpResponse:
     """
-    Ensure that a project named 'JIPipeResults' exists on the 
-    OMERO server and in the current group of the active user.
-    If it does not exist, create it with a description.
-    Returns the Project object if it exists or was created successfully.
+    Export the JIPipeRunner metrics in the Prometheus text format.
+    Requires 'Authorization: Bearer <JIPIPE_METRICS_TOKEN>'; without a
+    configured token the endpoint is disabled, since the metrics name users.
+
+    URL: JIPipeRunner/metrics/
+    param request: Django HTTP request object
     """
+    if prometheus_client is None:
+        return HttpResponse('Metrics require the prometheus_client package.', status=501)
+    if not METRICS_TOKEN:
+        return HttpResponse('Metrics require JIPIPE_METRICS_TOKEN to be configured.', status=403)
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'), f'Bearer {METRICS_TOKEN}'.encode('utf-8')):
+        return HttpResponse('Unauthorized', status=401)
+    return HttpResponse(
+        prometheus_client.generate_latest(metrics_registry()),
+        content_type=prometheus_client.CONTENT_TYPE_LATEST,
+    )
 
-    # Define the project name to look for or create
-    project_name = 'JIPipeResults'
+# Helper: status record of a job from its registry metadata and the end of its log
+def _job_status_record(job_uuid: str, job: dict) -> dict:
+    record = {field: job[field] for field in JOB_STATUS_FIELDS if field in job}
+    if job.get('state') == 'queued':
+        record['queue_position'] = queue_position(job_uuid)
+    log = log_stat(os.path.join(LOG_DIR, f'{job_uuid}.log'))
+    if log is not None:
+        record['log_cursor'], record['log_updated_at'] = log
+    return record
+
+# Helper: poll delay suggested for a set of job status records (in milliseconds)
+def _next_poll_ms(jobs: dict) -> int:
+    delay = POLL_MAX_MS
+    now = time.time()
+    for job in jobs.values():
+        if job['state'] == 'running':
+            idle = now - job.get('log_updated_at', now) > POLL_IDLE_SECONDS
+            delay = min(delay, 5 * POLL_MIN_MS if idle else POLL_MIN_MS)
+        elif job['state'] == 'queued':
+            delay = min(delay, 5 * POLL_MIN_MS * (job.get('queue_position') or 1))
+    return max(delay, POLL_MIN_MS)
+
+# Helper: cache key of the .jip file catalog of a user
+def _jipipe_files_cache_key(owner: str) -> str:
+    return f"jipipe_files_{owner}"
+
+def invalidate_jipipe_files_cache(owner: str) -> None:
+    """
+    Remove the cached .jip file catalog of a user, so the next
+    call to list_jipipe_files queries OMERO again.
 
-    # Attempt to find an existing project
-    existing_results_project = conn.getObject('Project', attributes={'name': project_name})
-    if existing_results_project:
-        return existing_results_project
+    param owner: Name of the OMERO user
+    """
+    cache.delete(_jipipe_files_cache_key(owner))
+
+# Helper: [image ID, update time] of every image of the given datasets, keyed by dataset ID
+def _input_versions(conn, dataset_ids: list) -> dict:
+    versions = {dataset_id: [] for dataset_id in dataset_ids}
+    if not dataset_ids:
+        return versions
+    params = omero.sys.ParametersI()
+    params.add('dids', rlist([rlong(dataset_id) for dataset_id in dataset_ids]))
+    rows = conn.getQueryService().projection(
+        'select link.parent.id, image.id, image.details.updateEvent.time from DatasetImageLink link '
+        'join link.child image where link.parent.id in (:dids)',
+        params,
+        {'omero.group': '-1'},
+    )
+    for row in rows:
+        versions.setdefault(row[0].val, []).append([row[1].val, row[2].val])
+    return versions
 
-    # Create a new Project with the specified name if it does not exist
-    new_project_model = omero.model.ProjectI()
-    new_project_model.setName(rstring(project_name))
-    new_project_model.setDescription(rstring('Project to save all JIPipe results'))
-    saved_model = conn.getUpdateService().saveAndReturnObject(
-        new_project_model,
-        conn.SERVICE_OPTS,
+# Helper: register a job and build its Celery task signature
+def _prepare_job(owner: str, jipipe_json: dict, memory_gb: int, omero_session: Callable[[], dict], results_project_id: int,
+                 input_versions: Optional[dict] = None, force: bool = False, **metadata):
+    """
+    Prepare a JIPipe job for submission: register it for its owner, create
+    its log file, store its OMERO session in Redis (session keys are not
+    sent through the broker; omero_session creates it on first use) and
+    build the signature of its Celery task.
+    If an identical job (same project and same input images, see
+    _input_versions) is still running or already succeeded (and the
+    submission is not forced), nothing is registered and the existing job
+    is returned instead.
+    Returns the job ID, the state of the reused job (None for a new job)
+    and the task signature (None for a reused job).
+    """
+    # Prepare the log file path and unique job identifier to reference the job later on
+    job_uuid = uuid.uuid4().hex
+    log_file = os.path.join(LOG_DIR, f'{job_uuid}.log')
+
+    # Reuse an identical job that is still running or already succeeded, unless a re-run is forced
+    fingerprint = compute_fingerprint(jipipe_json, owner, input_versions)
+    if not force:
+        existing = claim_fingerprint(fingerprint, owner, job_uuid)
+        if existing is not None:
+            existing_uuid, existing_job = existing
+            return existing_uuid, existing_job['state'], None
+
+    # Register the job as active for the user
+    register_job(
+        owner,
+        job_uuid,
+        pipeline=jipipe_json.get('metadata', {}).get('name', ''),
+        memory_gb=memory_gb,
+        fingerprint=fingerprint,
+        results_project_id=results_project_id,
+        log_file=log_file,
+        **metadata,
     )
 
-    # Get the ID of the newly created project and return the Project object
-    new_id = saved_model.getId().getValue()
-    return conn.getObject('Project', new_id)
+    store_job_session(job_uuid, omero_session())
+
+    # Create the log file right away so the job can be followed while it is queued
+    with open(log_file, 'w') as file_handle:
+        file_handle.write(f'[ Job queued with {memory_gb} GB memory ]\n')
+
+    signature = run_jipipe_task.signature(
+        args=[jipipe_json, job_uuid, owner, log_file],
+        kwargs={
+            'memory_gb': memory_gb,
+            'results_project_id': results_project_id,
+            'trace_context': current_trace_context(),
+        },
+        task_id=job_uuid,
+        ignore_result=True,
+        immutable=True,
+    )
+    return job_uuid, None, signature
@@ -0,0 +1,204 @@
+import contextlib
+import json
+import logging
+import os
+import signal
+import subprocess
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from JIPipeRunner.displays import display_for_job
+
+# Groovy script that keeps an initialized JIPipe running and accepts projects on stdin
+WARM_WORKER_SCRIPT = Path(__file__).resolve().parent / 'scripts' / 'jipipe_warm_worker.groovy'
+
+# Markers printed by the warm worker script
+READY_MARKER = '__JIPIPE_WARM_READY__'
+DONE_MARKER = '__JIPIPE_WARM_DONE__'
+UNSUPPORTED_MARKER = '__JIPIPE_WARM_UNSUPPORTED__'
+
+# Intialize the logger
+logger = logging.getLogger(__name__)
+
+
+class WarmWorkerDied(RuntimeError):
+    """
+    Raised when the warm JIPipe process exits while starting or running a job.
+    """
+
+
+class WarmModeUnsupported(WarmWorkerDied):
+    """
+    Raised when the JVM cannot trap System.exit (no security manager allowed),
+    so JIPipe cannot run in a warm process and jobs need a fresh JVM.
+    """
+
+
+class WarmJIPipeWorker:
+    """
+    Long-lived ImageJ/JIPipe process that runs JIPipe CLI requests in an
+    already started JVM, so the JVM, the Fiji classpath and the JIPipe plugin
+    registry are only initialized once instead of for every job.
+    Each Celery worker process (i.e. each worker slot) owns one instance.
+    The process is recycled after a number of jobs or when its resident
+    memory grew beyond a limit. It runs on a display provided according to
+    JIPIPE_DISPLAY_MODE (a pooled display stays leased while it runs).
+    """
+
+    def __init__(self, command: List[str], max_jobs: int, max_rss_mb: Optional[int]):
+        """
+        param command: Command that starts ImageJ running the warm worker script (without display wrapper)
+        param max_jobs: Number of jobs after which the process is restarted
+        param max_rss_mb: Resident memory (in MB) after which the process is restarted (None == no limit)
+        """
+        self.command = command
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.process: Optional[subprocess.Popen] = None
+        self.display_lease = contextlib.ExitStack()
+        self.jobs_run = 0
+        self.unsupported: Optional[str] = None
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def ensure_started(self, on_output: Callable[[str], None]) -> bool:
+        """
+        Start the warm process if it is not running and wait until it is ready.
+        Output printed during startup is passed to on_output.
+        Returns True if a new process had to be started (cold start).
+        Raises WarmModeUnsupported (without starting another process once it
+        was raised) if the JVM does not support the warm mode.
+
+        param on_output: Callback receiving every output line of the process
+        """
+        if self.is_alive():
+            return False
+        if self.unsupported is not None:
+            raise WarmModeUnsupported(self.unsupported)
+
+        # Clean up after a process that exited on its own, then start a new one on a display.
+        # Projects of later jobs are not known yet, so the process always gets a display
+        self.stop()
+        with contextlib.ExitStack() as display_lease:
+            display = display_lease.enter_context(display_for_job(None))
+            self.process = subprocess.Popen(
+                [*display.prefix, self.command[0], *display.options, *self.command[1:]],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=1,
+                preexec_fn=os.setsid,
+                env={**os.environ, **display.env},
+            )
+            self.display_lease = display_lease.pop_all()
+        self.jobs_run = 0
+
+        # Forward the startup output until the worker script reports that it is ready
+        for line in self.process.stdout:
+            if line.strip() == READY_MARKER:
+                return True
+            if line.startswith(UNSUPPORTED_MARKER):
+                self.unsupported = line[len(UNSUPPORTED_MARKER):].strip()
+                self.stop()
+                raise WarmModeUnsupported(self.unsupported)
+            on_output(line)
+        self.stop()
+        raise WarmWorkerDied('Warm JIPipe worker exited during startup')
+
+    def run(self, args: List[str], on_output: Callable[[str], None]) -> int:
+        """
+        Run the JIPipe CLI with the given arguments in the warm process.
+        Every output line of the run is passed to on_output.
+        Returns the exit code of the JIPipe CLI.
+
+        param args: JIPipe CLI arguments (e.g. ['run', '--project', ...])
+        param on_output: Callback receiving every output line of the run
+        """
+        self.ensure_started(on_output)
+
+        # Send the request as a single JSON line
+        self.process.stdin.write(json.dumps({'args': args}) + '\n')
+        self.process.stdin.flush()
+
+        # Forward the output until the completion marker with the exit code arrives
+        exit_code = None
+        for line in self.process.stdout:
+            if line.startswith(DONE_MARKER):
+                exit_code = int(line[len(DONE_MARKER):].strip())
+                break
+            on_output(line)
+        if exit_code is None:
+            self.stop()
+            raise WarmWorkerDied('Warm JIPipe worker exited while running a job')
+
+        # Recycle the process after too many jobs or too much memory growth
+        self.jobs_run += 1
+        if self.jobs_run >= self.max_jobs or self._exceeds_memory_limit():
+            logger.info('Recycling warm JIPipe worker after %s jobs', self.jobs_run)
+            self.stop()
+        return exit_code
+
+    def stop(self) -> None:
+        """
+        Terminate the warm process and all of its children and return its display.
+        """
+        if self.process is None:
+            self.display_lease.close()
+            return
+        if self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+                self.process.wait()
+            except ProcessLookupError:
+                pass
+        self.process = None
+        self.display_lease.close()
+
+    def _exceeds_memory_limit(self) -> bool:
+        if self.max_rss_mb is None or not self.is_alive():
+            return False
+        return _process_group_rss_mb(self.process.pid) > self.max_rss_mb
+
+
+def _process_group_rss_mb(pgid: int) -> float:
+    """
+    Sum the resident memory of all processes in a process group (Linux only).
+    The JVM is a child of the launcher and xvfb-run, so the whole group is measured.
+    """
+    total_kb = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            if os.getpgid(int(pid)) != pgid:
+                continue
+            with open(f'/proc/{pid}/status') as status_file:
+                for status_line in status_file:
+                    if status_line.startswith('VmRSS:'):
+                        total_kb += int(status_line.split()[1])
+                        break
+        except (OSError, ProcessLookupError):
+            continue
+    return total_kb / 1024
+
+
+# Warm worker of this Celery worker process (one per worker slot)
+_warm_worker: Optional[WarmJIPipeWorker] = None
+
+
+def get_warm_worker(command: List[str], max_jobs: int, max_rss_mb: Optional[int]) -> WarmJIPipeWorker:
+    """
+    Get the warm worker of the current process, replacing it if the
+    command used to start it changed (e.g. a different ImageJ installation).
+    """
+    global _warm_worker
+    if _warm_worker is None or _warm_worker.command != command:
+        if _warm_worker is not None:
+            _warm_worker.stop()
+        _warm_worker = WarmJIPipeWorker(command, max_jobs, max_rss_mb)
+    return _warm_worker
@@ -0,0 +1,98 @@
+"""
+Micro-benchmark of the log handling in run_jipipe_task.
+
+Starts a fake JIPipe process that prints a given number of log lines as fast
+as it can and moves its output into a log file, once with the former
+line-buffered loop (write and flush per line) and once with LogPump.
+Reports lines per second and the CPU time used by the worker process.
+
+Usage: python benchmarks/bench_log_pump.py [--lines 1000000] [--line-bytes 80]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from JIPipeRunner.log_pump import LogPump
+
+# Fake JIPipe process writing numbered log lines to stdout
+SPAM_SCRIPT = """
+import sys
+line_count, line_bytes = int(sys.argv[1]), int(sys.argv[2])
+padding = 'x' * max(line_bytes - 32, 0)
+write = sys.stdout.write
+for number in range(line_count):
+    write(f'[INFO] Node {number % 97} processed item {number} {padding}\\n')
+"""
+
+
+def _start_child(line_count, line_bytes, **popen_kwargs):
+    return subprocess.Popen(
+        [sys.executable, '-c', SPAM_SCRIPT, str(line_count), str(line_bytes)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        **popen_kwargs,
+    )
+
+
+def run_legacy(log_path, line_count, line_bytes):
+    # Former loop: text pipe with line buffering, write and flush for every line
+    process = _start_child(line_count, line_bytes, text=True, bufsize=1)
+    with open(log_path, 'a') as log_file:
+        for line in process.stdout:
+            log_file.write(line)
+            log_file.flush()
+    process.wait()
+
+
+def run_pump(log_path, line_count, line_bytes):
+    process = _start_child(line_count, line_bytes, bufsize=0)
+    with open(log_path, 'ab', buffering=0) as log_file:
+        LogPump(process.stdout, lambda text: log_file.write(text.encode('utf-8'))).run()
+    process.wait()
+
+
+def measure(name, function, line_count, line_bytes):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_path = os.path.join(temp_dir, 'job.log')
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        function(log_path, line_count, line_bytes)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        with open(log_path, 'rb') as log_file:
+            written_lines = sum(chunk.count(b'\n') for chunk in iter(lambda: log_file.read(1024 * 1024), b''))
+    return {
+        'variant': name,
+        'lines': written_lines,
+        'seconds': round(wall, 3),
+        'lines_per_second': round(written_lines / wall),
+        'worker_cpu_seconds': round(cpu, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lines', type=int, default=1_000_000, help='Number of lines printed by the fake process')
+    parser.add_argument('--line-bytes', type=int, default=80, help='Approximate length of a log line')
+    arguments = parser.parse_args()
+
+    results = [
+        measure('legacy', run_legacy, arguments.lines, arguments.line_bytes),
+        measure('pump', run_pump, arguments.lines, arguments.line_bytes),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
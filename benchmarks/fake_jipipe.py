@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Scripted stand-in for the ImageJ/JIPipe command line used by run_jipipe_task.
+
+Accepts (and ignores) the ImageJ launcher options, reads the project given by
+--project, prints a JIPipe-like log and writes a result file to the folder
+given by --output-folder. Started with --run <script> (as in the warm
+execution mode), it emulates the warm worker script instead: it prints the
+ready marker and runs one JSON request per stdin line, each followed by the
+completion marker. The log is configured via environment variables:
+
+FAKE_JIPIPE_LINES: Number of log lines (default 1000)
+FAKE_JIPIPE_RATE: Lines per second, 0 prints as fast as possible (default 0)
+FAKE_JIPIPE_STEPS: Number of progress steps (default 20)
+FAKE_JIPIPE_EXIT_CODE: Exit code of the process (default 0)
+FAKE_JIPIPE_STARTUP_MS: Simulated JVM and plugin startup time per process (default 0)
+"""
+import json
+import os
+import sys
+import time
+
+
+def _option(arguments, name):
+    return arguments[arguments.index(name) + 1] if name in arguments else None
+
+
+def _run(arguments):
+    # Print the log of one JIPipe run and write its result, returns the exit code
+    line_count = int(os.environ.get('FAKE_JIPIPE_LINES', 1000))
+    rate = float(os.environ.get('FAKE_JIPIPE_RATE', 0))
+    steps = max(int(os.environ.get('FAKE_JIPIPE_STEPS', 20)), 1)
+
+    project_path = _option(arguments, '--project')
+    nodes = ['Import images', 'Gaussian blur', 'Threshold', 'Analyze particles', 'Export to OMERO']
+    if project_path:
+        with open(project_path) as project_file:
+            project = json.load(project_file)
+        nodes = [node.get('jipipe:node:name', uuid) for uuid, node in project.get('graph', {}).get('nodes', {}).items()] or nodes
+
+    write = sys.stdout.write
+    started = time.monotonic()
+    write('Running JIPipe project ' + str(project_path) + '\n')
+    for number in range(line_count):
+        step = number * steps // max(line_count, 1)
+        node = nodes[step % len(nodes)]
+        if number % 500 == 499:
+            write(f'[WARN] <{step}/{steps}> Run | {node} | Slow operation on item {number}\n')
+        else:
+            write(f'<{step}/{steps}> Run | {node} | Processing item {number} of {line_count}\n')
+
+        # Keep the configured rate without sleeping for every single line
+        if rate > 0 and number % 100 == 99:
+            delay = started + (number + 1) / rate - time.monotonic()
+            if delay > 0:
+                sys.stdout.flush()
+                time.sleep(delay)
+    write(f'<{steps}/{steps}> Run | {nodes[-1]} | Done\n')
+    sys.stdout.flush()
+
+    output_folder = _option(arguments, '--output-folder')
+    if output_folder:
+        with open(os.path.join(output_folder, 'result.csv'), 'w') as result_file:
+            result_file.write('item,value\n' + ''.join(f'{index},{index * 0.5}\n' for index in range(100)))
+    return int(os.environ.get('FAKE_JIPIPE_EXIT_CODE', 0))
+
+
+def _serve_warm_requests():
+    # Protocol of JIPipeRunner/scripts/jipipe_warm_worker.groovy
+    sys.stdout.write('__JIPIPE_WARM_READY__\n')
+    sys.stdout.flush()
+    for line in sys.stdin:
+        if line.strip():
+            exit_code = _run(json.loads(line)['args'])
+            sys.stdout.write(f'__JIPIPE_WARM_DONE__ {exit_code}\n')
+            sys.stdout.flush()
+
+
+def main():
+    arguments = sys.argv[1:]
+    time.sleep(float(os.environ.get('FAKE_JIPIPE_STARTUP_MS', 0)) / 1000)
+    if '--run' in arguments:
+        _serve_warm_requests()
+        sys.exit(0)
+    sys.exit(_run(arguments))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""
+In-process stand-in for the OMERO BlitzGateway used by the JIPipeRunner views.
+
+Only the calls made by the views are implemented. The catalog of groups,
+projects and .jip file annotations is generated from the configured counts,
+every service call is counted and can be delayed to model the round trip to
+an OMERO server.
+
+If omero-py and omero-web are not installed, install_omero_stubs provides
+the few OMERO modules JIPipeRunner imports, so the benchmarks run offline.
+"""
+import functools
+import hashlib
+import json
+import sys
+import time
+import uuid
+from types import ModuleType, SimpleNamespace
+
+
+class _Value:
+    # Mimics omero.rtypes wrappers (.val and getValue())
+    def __init__(self, value):
+        self.val = value
+
+    def getValue(self):
+        return self.val
+
+
+class FakeOriginalFile:
+    def __init__(self, file_id, name, content):
+        self.file_id = file_id
+        self.name = name
+        self.content = content
+
+    def getId(self):
+        return self.file_id
+
+    def getName(self):
+        return self.name
+
+    def getSize(self):
+        return len(self.content)
+
+    def getHash(self):
+        return hashlib.sha1(self.content).hexdigest()
+
+    def getMtime(self):
+        return 0
+
+    def getFileInChunks(self, buf=2621440):
+        for offset in range(0, len(self.content), buf):
+            yield self.content[offset:offset + buf]
+
+
+class FakeProject:
+    def __init__(self, project_id, name):
+        self.project_id = project_id
+        self.name = name
+
+    def getId(self):
+        return self.project_id
+
+    def getName(self):
+        return self.name
+
+
+class FakeGateway:
+    """
+    Fake OMERO connection of a single user.
+
+    param groups: Number of groups the user is a member of
+    param projects_per_group: Number of projects in every group
+    param files_per_project: Number of .jip file annotations linked to every project
+    param latency_ms: Delay added to every service call to model the server round trip
+    param pipeline: JIPipe project stored in every .jip file
+    """
+
+    def __init__(self, groups=1, projects_per_group=10, files_per_project=1, latency_ms=0.0, pipeline=None, user_name='benchmark'):
+        self.latency = latency_ms / 1000.0
+        self.user_name = user_name
+        self.calls = {}
+        self.session_id = str(uuid.uuid4())
+        self.host = 'localhost'
+        self.port = 4064
+        self.SERVICE_OPTS = SimpleNamespace(setOmeroGroup=lambda group: None, getOmeroGroup=lambda: None)
+        self.group_ids = list(range(1, groups + 1))
+        self.projects = {}
+        self.files = {}
+        content = json.dumps(pipeline or {}).encode('utf-8')
+        for group_id in self.group_ids:
+            for project_index in range(projects_per_group):
+                project_id = len(self.projects) + 1
+                self.projects[project_id] = FakeProject(project_id, f'Project {group_id}-{project_index}')
+                for file_index in range(files_per_project):
+                    file_id = len(self.files) + 1
+                    self.files[file_id] = (group_id, FakeOriginalFile(file_id, f'pipeline-{project_id}-{file_index}.jip', content))
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reset_calls(self):
+        self.calls = {}
+
+    def getUser(self):
+        return SimpleNamespace(getName=lambda: self.user_name, getId=lambda: 1)
+
+    def getEventContext(self):
+        self._call('getEventContext')
+        return SimpleNamespace(memberOfGroups=list(self.group_ids), groupId=self.group_ids[0], userId=1, userName=self.user_name)
+
+    def _getSessionId(self):
+        return self.session_id
+
+    def getGroupFromContext(self):
+        return SimpleNamespace(getName=lambda: f'Group {self.group_ids[0]}', getId=lambda: self.group_ids[0])
+
+    def getSessionService(self):
+        gateway = self
+
+        class SessionService:
+            def createUserSession(self, time_to_live, time_to_idle, group_name):
+                gateway._call('createUserSession')
+                return SimpleNamespace(getUuid=lambda: _Value(str(uuid.uuid4())))
+
+        return SessionService()
+
+    def getObject(self, object_type, object_id=None, attributes=None):
+        self._call('getObject')
+        object_type = object_type.lower()
+        if object_type == 'originalfile':
+            entry = self.files.get(int(object_id))
+            return entry[1] if entry else None
+        if object_type == 'project':
+            if attributes is not None:
+                return next((project for project in self.projects.values() if project.getName() == attributes.get('name')), None)
+            return self.projects.get(int(object_id))
+        return None
+
+    def getUpdateService(self):
+        gateway = self
+
+        class UpdateService:
+            def saveAndReturnObject(self, model, options=None):
+                gateway._call('saveAndReturnObject')
+                project_id = max(gateway.projects, default=0) + 1
+                gateway.projects[project_id] = FakeProject(project_id, model.getName().getValue())
+                return SimpleNamespace(getId=lambda: _Value(project_id))
+
+        return UpdateService()
+
+    def getQueryService(self):
+        gateway = self
+
+        class QueryService:
+            def projection(self, query, params, options=None):
+                # Supports the .jip catalog query of list_jipipe_files and the input image query of
+                # the start views (every dataset holds one image that never changes)
+                gateway._call('projection')
+                if 'DatasetImageLink' in query:
+                    return [[_Value(dataset_id.val), _Value(dataset_id.val), _Value(0)] for dataset_id in params.map['dids'].val]
+                rows = [
+                    [_Value(file_id), _Value(original_file.getName())]
+                    for file_id, (_, original_file) in gateway.files.items()
+                    if original_file.getName().endswith('.jip')
+                ]
+                return sorted(rows, key=lambda row: row[1].val)
+
+        return QueryService()
+
+
+class _ModelObject:
+    # Mimics omero.model objects (setX/getX accessors, optional ID and loaded flag)
+    def __init__(self, object_id=None, loaded=True):
+        self._fields = {}
+        self._id = object_id
+
+    def getId(self):
+        return _Value(self._id)
+
+    def __getattr__(self, name):
+        if name.startswith('set'):
+            return lambda value: self._fields.__setitem__(name[3:], value)
+        if name.startswith('get'):
+            return lambda: self._fields.get(name[3:])
+        raise AttributeError(name)
+
+
+class _ConfigXml:
+    # Mimics omero.config.ConfigXml, storing the properties as JSON instead of XML
+    def __init__(self, path, read_only=False):
+        self.path = path
+        try:
+            with open(path) as config_file:
+                self.properties = json.load(config_file)
+        except FileNotFoundError:
+            self.properties = {}
+
+    def __setitem__(self, key, value):
+        self.properties[key] = value
+
+    def as_map(self):
+        return dict(self.properties)
+
+    def close(self):
+        with open(self.path, 'w') as config_file:
+            json.dump(self.properties, config_file)
+
+
+class _ParametersI:
+    # Mimics omero.sys.ParametersI (named parameters in map)
+    def __init__(self):
+        self.map = {}
+
+    def addString(self, name, value):
+        self.map[name] = value
+
+    def add(self, name, value):
+        self.map[name] = value
+
+
+class _BlitzGateway:
+    # Workers only join sessions to upload outputs, which is disabled in the benchmarks
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def connect(self, sUuid=None):
+        return False
+
+    def close(self, hard=True):
+        pass
+
+
+def _login_required(*args, **kwargs):
+    # Mimics omeroweb.decorators.login_required, the benchmarks pass the connection themselves
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(request, *view_args, **view_kwargs):
+            return view(request, *view_args, **view_kwargs)
+        return wrapped
+    return decorator
+
+
+def install_omero_stubs():
+    """
+    Register stand-ins for the omero and omeroweb modules imported by
+    JIPipeRunner, unless omero-py is installed. Must be called before
+    JIPipeRunner or the Celery app is imported.
+    """
+    try:
+        import omero.config  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    def module(name, **attributes):
+        stub = ModuleType(name)
+        stub.__dict__.update(attributes)
+        sys.modules[name] = stub
+        return stub
+
+    model = module(
+        'omero.model',
+        ProjectI=_ModelObject,
+        OriginalFileI=_ModelObject,
+        FileAnnotationI=_ModelObject,
+        ProjectAnnotationLinkI=_ModelObject,
+    )
+    rtypes = module('omero.rtypes', rlong=_Value, rstring=_Value, rlist=_Value)
+    omero_sys = module('omero.sys', ParametersI=_ParametersI)
+    config = module('omero.config', ConfigXml=_ConfigXml)
+    gateway = module('omero.gateway', BlitzGateway=_BlitzGateway)
+    module('omero', model=model, rtypes=rtypes, sys=omero_sys, config=config, gateway=gateway)
+    decorators = module('omeroweb.decorators', login_required=_login_required)
+    module('omeroweb', decorators=decorators)
@@ -0,0 +1,149 @@
+"""
+Offline environment for the JIPipeRunner benchmarks.
+
+Creates a temporary OMERODIR with a config.xml pointing omero.web.imagej to
+the fake JIPipe CLI (plus an xvfb-run without a display), configures Django with a local-memory cache, replaces
+the shared Redis client by fakeredis and routes Celery through the in-memory
+broker. Nothing outside the temporary directory is touched, and no OMERO
+server, Redis server or JIPipe installation is needed. Without omero-py,
+stand-ins for the OMERO modules are used (see fake_omero.install_omero_stubs).
+
+Requires the benchmark extra: pip install -e .[benchmarks]
+"""
+import inspect
+import json
+import os
+import stat
+import sys
+from types import SimpleNamespace
+
+from fake_omero import install_omero_stubs
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIR = os.path.dirname(BENCHMARK_DIR)
+if REPOSITORY_DIR not in sys.path:
+    sys.path.insert(0, REPOSITORY_DIR)
+
+
+def _write_omero_config(omero_dir, imagej_path):
+    from omero.config import ConfigXml
+
+    config_dir = os.path.join(omero_dir, 'etc', 'grid')
+    os.makedirs(config_dir, exist_ok=True)
+    os.makedirs(os.path.join(omero_dir, 'var', 'log'), exist_ok=True)
+    config = ConfigXml(os.path.join(config_dir, 'config.xml'))
+    config['omero.web.caches'] = json.dumps({
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'jipipe-benchmark'},
+    })
+    config['omero.web.imagej'] = imagej_path
+    config.close()
+
+
+def _write_fake_imagej(directory):
+    # Launch the fake JIPipe CLI with the interpreter running the benchmark
+    launcher = os.path.join(directory, 'fake-imagej')
+    with open(launcher, 'w') as launcher_file:
+        launcher_file.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCHMARK_DIR, "fake_jipipe.py")}" "$@"\n')
+    os.chmod(launcher, os.stat(launcher).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return launcher
+
+
+def _write_fake_xvfb_run(directory):
+    # Run the command without a display, for hosts without Xvfb (the fake JIPipe CLI needs none)
+    bin_dir = os.path.join(directory, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    launcher = os.path.join(bin_dir, 'xvfb-run')
+    with open(launcher, 'w') as launcher_file:
+        launcher_file.write('#!/bin/sh\nif [ "$1" = "-a" ]; then shift; fi\nexec "$@"\n')
+    os.chmod(launcher, os.stat(launcher).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return bin_dir
+
+
+def setup_environment(temp_dir, execution_mode='cold', imagej_path=None, display_mode='auto'):
+    """
+    Configure the offline environment and import the JIPipeRunner modules.
+    Must be called once per process before anything else imports Django.
+    Returns a namespace with the views (unwrapped from their decorators),
+    the task module, the registry and the log directory.
+
+    param temp_dir: Directory for all files created by the benchmarks
+    param execution_mode: JIPIPE_EXECUTION_MODE of the worker ('cold' or 'warm')
+    param imagej_path: ImageJ launcher to run jobs with (default: the fake JIPipe CLI)
+    param display_mode: JIPIPE_DISPLAY_MODE of the worker
+    """
+    omero_dir = os.path.join(temp_dir, 'omero')
+    log_dir = os.path.join(temp_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    install_omero_stubs()
+    _write_omero_config(omero_dir, imagej_path or _write_fake_imagej(temp_dir))
+    if imagej_path is None:
+        os.environ['PATH'] = _write_fake_xvfb_run(temp_dir) + os.pathsep + os.environ.get('PATH', '')
+    os.environ['OMERODIR'] = omero_dir
+
+    import django
+    from django.conf import settings
+
+    settings.configure(
+        DEBUG=False,
+        SECRET_KEY='jipipe-benchmark',
+        ALLOWED_HOSTS=['*'],
+        INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'JIPipeRunner'],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(temp_dir, 'db.sqlite3')}},
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'jipipe-benchmark'}},
+        USE_TZ=True,
+        JIPIPE_LOG_ROOT=log_dir,
+        JIPIPE_EXECUTION_MODE=execution_mode,
+        JIPIPE_DISPLAY_MODE=display_mode,
+        JIPIPE_DEFAULT_MEMORY_GB=1,
+        JIPIPE_ADMISSION_RETRY_SECONDS=1,
+    )
+    django.setup()
+
+    # Create the job history table in the benchmark database
+    from django.core.management import call_command
+    call_command('migrate', 'JIPipeRunner', verbosity=0)
+
+    # Replace the shared Redis client before any module talks to Redis
+    import fakeredis
+    from JIPipeRunner import redis_client
+    redis_client._redis_client = fakeredis.FakeRedis()
+
+    # Keep submitted tasks in the in-memory broker instead of a Redis server
+    from JIPipePlugin.celery import app
+    app.conf.broker_url = 'memory://'
+    app.conf.result_backend = 'cache+memory://'
+
+    from JIPipeRunner import registry, tasks, views
+
+    return SimpleNamespace(
+        app=app,
+        log_dir=log_dir,
+        registry=registry,
+        tasks=tasks,
+        views=views,
+        start_jipipe_job=inspect.unwrap(views.start_jipipe_job),
+        fetch_jipipe_logs=inspect.unwrap(views.fetch_jipipe_logs),
+        jipipe_job_status=inspect.unwrap(views.jipipe_job_status),
+        list_jipipe_files=inspect.unwrap(views.list_jipipe_files),
+        get_jipipe_config=inspect.unwrap(views.get_jipipe_config),
+    )
+
+
+def make_project(index=0, node_count=5):
+    """
+    Build a small JIPipe project with one dataset input node, processing
+    nodes and a results project output node. The index makes every project
+    unique, so submissions are not coalesced by their fingerprint.
+    """
+    nodes = {
+        'input': {'jipipe:node-info-id': 'omero-define-dataset-ids', 'jipipe:alias-id': 'define-dataset-ids', 'jipipe:node:name': 'Import images', 'dataset-ids': [index + 1]},
+        'output': {'jipipe:node-info-id': 'omero-define-project-ids', 'jipipe:alias-id': 'define-project-ids', 'jipipe:node:name': 'Export to OMERO', 'dataset-ids': []},
+    }
+    for node_index in range(node_count):
+        nodes[f'node-{node_index}'] = {
+            'jipipe:node-info-id': 'clij2-gaussian-blur-2d',
+            'jipipe:node:name': f'Gaussian blur {node_index}',
+            'sigma': 1.0 + node_index,
+            'jipipe:node:ui-grid-location': {'x': node_index, 'y': 0},
+        }
+    return {'metadata': {'name': f'Benchmark pipeline {index}'}, 'graph': {'nodes': nodes, 'edges': []}}
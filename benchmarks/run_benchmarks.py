@@ -0,0 +1,338 @@
+"""
+Offline end-to-end benchmarks of JIPipeRunner.
+
+Drives the real views and the real run_jipipe_task against a fake OMERO
+gateway, a fake JIPipe CLI, fakeredis and the in-memory Celery broker (see
+harness.py) and reports:
+
+- submit: latency of start_jipipe_job for new and coalesced submissions
+- poll: cost of fetch_jipipe_logs and job_status against the log size, for live and archived logs
+- files: scaling of list_jipipe_files with the number of groups, projects and .jip files
+- config: latency of get_jipipe_config when uncached, cached and revalidated (304)
+- worker: overhead of run_jipipe_task per job compared to running the JIPipe process alone
+- modes: duration of the same jobs in cold and warm execution mode with a simulated JVM startup time
+
+Results are printed (or written to --output) as JSON, so runs can be compared over time.
+
+Usage: python benchmarks/run_benchmarks.py [--quick] [--only submit,poll,...] [--output results.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from harness import REPOSITORY_DIR, make_project, setup_environment
+from fake_omero import FakeGateway
+
+BENCHMARKS = ('submit', 'poll', 'files', 'config', 'worker', 'modes')
+
+
+def _summary(seconds):
+    # Latency statistics in milliseconds
+    milliseconds = sorted(value * 1000 for value in seconds)
+    return {
+        'runs': len(milliseconds),
+        'median_ms': round(statistics.median(milliseconds), 3),
+        'p95_ms': round(milliseconds[min(int(len(milliseconds) * 0.95), len(milliseconds) - 1)], 3),
+        'max_ms': round(milliseconds[-1], 3),
+    }
+
+
+def _time(function, repeat):
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - started)
+    return _summary(seconds)
+
+
+def _check(response, expected=200):
+    if response.status_code != expected:
+        raise RuntimeError(f'Unexpected status {response.status_code}: {response.content[:200]!r}')
+    return response
+
+
+def bench_submit(env, factory, options):
+    gateway = FakeGateway(latency_ms=options.latency_ms)
+
+    def submit(project):
+        request = factory.post('/JIPipeRunner/jipipe_start_job/', data=json.dumps(project), content_type='application/json')
+        return json.loads(_check(env.start_jipipe_job(request, conn=gateway)).content)
+
+    new_jobs = []
+    for index in range(options.submissions):
+        started = time.perf_counter()
+        submit(make_project(index))
+        new_jobs.append(time.perf_counter() - started)
+
+    # Identical submissions are coalesced onto the first job
+    reused = []
+    for _ in range(options.submissions):
+        started = time.perf_counter()
+        submit(make_project(0))
+        reused.append(time.perf_counter() - started)
+
+    gateway.reset_calls()
+    submit(make_project(options.submissions))
+    return {'new': _summary(new_jobs), 'reused': _summary(reused), 'omero_calls_per_submit': gateway.calls}
+
+
+def _write_log(env, job_uuid, line_count):
+    from JIPipeRunner.logs import LogWriter
+
+    log_file = os.path.join(env.log_dir, f'{job_uuid}.log')
+    open(log_file, 'w').close()
+    batch = []
+    with LogWriter(log_file) as writer:
+        for number in range(line_count):
+            prefix = 'ERROR ' if number % 1000 == 999 else ''
+            batch.append(f'{prefix}<{number}/{line_count}> Run | Node {number % 7} | Processing item {number}\n')
+            if len(batch) == 1000:
+                writer.write(''.join(batch))
+                batch = []
+        writer.write(''.join(batch) + '\n[ JIPipe exited with code 0 ]\n')
+    return log_file
+
+
+def bench_poll(env, factory, options):
+    from JIPipeRunner.logs import archive_log
+
+    gateway = FakeGateway()
+    owner = gateway.getUser().getName()
+    results = []
+    for line_count in options.log_lines:
+        job_uuid = str(uuid.uuid4())
+        log_file = _write_log(env, job_uuid, line_count)
+        env.registry.register_job(owner, job_uuid, pipeline='benchmark')
+        end_cursor = os.path.getsize(log_file)
+
+        def fetch(query):
+            return _check(env.fetch_jipipe_logs(factory.get('/', query), job_uuid, conn=gateway))
+
+        def status():
+            return _check(env.jipipe_job_status(factory.get('/'), job_uuid, conn=gateway))
+
+        entry = {'lines': line_count, 'log_bytes': end_cursor}
+        for storage in ('live', 'archived'):
+            if storage == 'archived':
+                archive_log(log_file)
+            entry[storage] = {
+                'tail_1000': _time(lambda: fetch({'tail': 1000}), options.repeat),
+                'poll_at_end': _time(lambda: fetch({'cursor': end_cursor}), options.repeat),
+                'job_status': _time(status, options.repeat),
+            }
+        results.append(entry)
+    return results
+
+
+def bench_files(env, factory, options):
+    results = []
+    for groups, projects, files in options.catalogs:
+        gateway = FakeGateway(groups=groups, projects_per_group=projects, files_per_project=files, latency_ms=options.latency_ms)
+        request = factory.get('/', {'refresh': '1'})
+        gateway.reset_calls()
+        uncached = _time(lambda: _check(env.list_jipipe_files(request, conn=gateway)), options.repeat)
+        calls = {name: count // options.repeat for name, count in gateway.calls.items()}
+        cached = _time(lambda: _check(env.list_jipipe_files(factory.get('/'), conn=gateway)), options.repeat)
+        results.append({
+            'groups': groups,
+            'projects_per_group': projects,
+            'files_per_project': files,
+            'files': len(gateway.files),
+            'uncached': uncached,
+            'cached': cached,
+            'omero_calls_uncached': calls,
+        })
+    return results
+
+
+def bench_config(env, factory, options):
+    from JIPipeRunner.views import CONFIG_CACHE
+
+    results = []
+    for node_count in options.config_nodes:
+        gateway = FakeGateway(groups=1, projects_per_group=1, files_per_project=1, latency_ms=options.latency_ms, pipeline=make_project(0, node_count))
+        file_id = next(iter(gateway.files))
+
+        def uncached():
+            CONFIG_CACHE.clear()
+            return _check(env.get_jipipe_config(factory.get('/'), file_id, conn=gateway))
+
+        etag = uncached()['ETag']
+        results.append({
+            'nodes': node_count,
+            'bytes': gateway.files[file_id][1].getSize(),
+            'uncached': _time(uncached, options.repeat),
+            'cached': _time(lambda: _check(env.get_jipipe_config(factory.get('/'), file_id, conn=gateway)), options.repeat),
+            'not_modified': _time(
+                lambda: _check(env.get_jipipe_config(factory.get('/', HTTP_IF_NONE_MATCH=etag), file_id, conn=gateway), 304),
+                options.repeat,
+            ),
+        })
+    return results
+
+
+def _run_fake_process(line_count, project_file, output_dir):
+    # Baseline: the JIPipe process alone, with its output discarded
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(os.path.dirname(__file__), 'fake_jipipe.py'), 'run', '--project', project_file, '--output-folder', output_dir],
+        stdout=subprocess.DEVNULL,
+        env={**os.environ, 'FAKE_JIPIPE_LINES': str(line_count)},
+        check=True,
+    )
+    return time.perf_counter() - started
+
+
+def _run_task(env, owner, index):
+    # Run one job through run_jipipe_task in this process, returns its duration
+    job_uuid = str(uuid.uuid4())
+    log_file = os.path.join(env.log_dir, f'{job_uuid}.log')
+    open(log_file, 'w').close()
+    env.registry.register_job(owner, job_uuid, pipeline='benchmark')
+    started = time.perf_counter()
+    env.tasks.run_jipipe_task.apply(
+        args=[make_project(index), job_uuid, owner, log_file],
+        kwargs={'memory_gb': 1},
+        task_id=job_uuid,
+    )
+    seconds = time.perf_counter() - started
+    job = env.registry.get_job(job_uuid)
+    if job.get('exit_code') != '0':
+        raise RuntimeError(f'Benchmark job failed: {job}')
+    return seconds
+
+
+def bench_worker(env, factory, options):
+    owner = 'benchmark'
+    results = []
+    for line_count in options.worker_lines:
+        os.environ['FAKE_JIPIPE_LINES'] = str(line_count)
+        with tempfile.TemporaryDirectory() as baseline_dir:
+            project_file = os.path.join(baseline_dir, 'project.jip')
+            with open(project_file, 'w') as project_handle:
+                json.dump(make_project(0), project_handle)
+            baseline = [_run_fake_process(line_count, project_file, baseline_dir) for _ in range(options.jobs)]
+
+        task_seconds = []
+        cpu_seconds = []
+        for index in range(options.jobs):
+            cpu_started = time.process_time()
+            task_seconds.append(_run_task(env, owner, index))
+            cpu_seconds.append(time.process_time() - cpu_started)
+
+        results.append({
+            'lines': line_count,
+            'process_alone': _summary(baseline),
+            'task': _summary(task_seconds),
+            'overhead_median_ms': round((statistics.median(task_seconds) - statistics.median(baseline)) * 1000, 3),
+            'worker_cpu_median_ms': round(statistics.median(cpu_seconds) * 1000, 3),
+        })
+    return results
+
+
+def bench_modes(env, factory, options):
+    from JIPipeRunner import displays, warm_pool
+
+    owner = 'benchmark'
+    os.environ['FAKE_JIPIPE_LINES'] = str(options.worker_lines[0])
+    os.environ['FAKE_JIPIPE_STARTUP_MS'] = str(options.startup_ms)
+    execution_mode = env.tasks.EXECUTION_MODE
+    display_mode = displays.DISPLAY_MODE
+    results = {'startup_ms': options.startup_ms, 'lines': options.worker_lines[0]}
+    try:
+        # Warm processes always get a display; both modes use the fake xvfb-run, as hosts may have no Xvfb
+        displays.DISPLAY_MODE = 'xvfb-run'
+        for mode in ('cold', 'warm'):
+            env.tasks.EXECUTION_MODE = mode
+            seconds = [_run_task(env, owner, index) for index in range(options.jobs)]
+            # The first warm job pays for starting the warm process
+            results[mode] = {**_summary(seconds), 'first_ms': round(seconds[0] * 1000, 3), 'total_ms': round(sum(seconds) * 1000, 3)}
+    finally:
+        env.tasks.EXECUTION_MODE = execution_mode
+        displays.DISPLAY_MODE = display_mode
+        os.environ.pop('FAKE_JIPIPE_STARTUP_MS')
+        if warm_pool._warm_worker is not None:
+            warm_pool._warm_worker.stop()
+    results['warm_speedup_total'] = round(results['cold']['total_ms'] / results['warm']['total_ms'], 2)
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmarks of JIPipeRunner')
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help='Comma-separated benchmarks to run')
+    parser.add_argument('--quick', action='store_true', help='Small sizes for a fast smoke run')
+    parser.add_argument('--repeat', type=int, default=20, help='Repetitions of every measured request')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Simulated OMERO round trip per service call')
+    parser.add_argument('--execution-mode', default='cold', choices=['cold', 'warm'], help='JIPIPE_EXECUTION_MODE of the worker')
+    parser.add_argument('--startup-ms', type=float, default=2000.0, help='Simulated JVM startup time of the modes benchmark')
+    parser.add_argument('--imagej', help='Real ImageJ launcher instead of the fake JIPipe CLI (required for warm mode)')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    options = parser.parse_args()
+
+    if options.quick:
+        options.repeat = min(options.repeat, 5)
+        options.submissions, options.jobs = 10, 2
+        options.log_lines = [1_000, 100_000]
+        options.catalogs = [(1, 10, 1), (5, 50, 2)]
+        options.config_nodes = [10, 200]
+        options.worker_lines = [1_000]
+    else:
+        options.submissions, options.jobs = 100, 5
+        options.log_lines = [1_000, 100_000, 1_000_000]
+        options.catalogs = [(1, 10, 1), (5, 100, 2), (20, 500, 5)]
+        options.config_nodes = [10, 200, 2000]
+        options.worker_lines = [1_000, 100_000]
+
+    selected = [name for name in options.only.split(',') if name]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'Unknown benchmarks: {", ".join(sorted(unknown))}')
+
+    with tempfile.TemporaryDirectory(prefix='jipipe-benchmark-') as temp_dir:
+        env = setup_environment(temp_dir, execution_mode=options.execution_mode, imagej_path=options.imagej)
+        from django.test import RequestFactory
+        factory = RequestFactory()
+
+        started = time.perf_counter()
+        results = {name: globals()[f'bench_{name}'](env, factory, options) for name in selected}
+        report = {
+            'meta': {
+                'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'git_revision': _git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'options': {key: value for key, value in vars(options).items() if key != 'output'},
+                'seconds': round(time.perf_counter() - started, 3),
+                'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            },
+            'results': results,
+        }
+
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,5 +5,15 @@ setup(
     version='0.0.1',
     description="OMERO plugin to run JIPipe",
     packages=find_packages(),
+    package_data={'JIPipeRunner': ['templates/JIPipeRunner/*', 'scripts/*']},
     keywords=['omero', 'jipipe'],
+    extras_require={
+        # Offline benchmark suite in benchmarks/
+        'benchmarks': ['fakeredis[lua]'],
+        # Prometheus metrics and OpenTelemetry trace context propagation
+        'metrics': ['prometheus_client'],
+        'tracing': ['opentelemetry-api'],
+        # Faster parsing and writing of .jip projects
+        'fast-json': ['orjson'],
+    },
 )